@@ -1,11 +1,30 @@
 #!/usr/bin/python
 import sys
+import atexit
 import os
-import pathlib
 import platform
 import subprocess
 import argparse
-from source.rr_dwnldr import BookDownloader
+import sqlite3
+from contextlib import ExitStack
+from typing import Any
+from source.rr_dwnldr import LocalizedException, ChapterTransformer, set_parser_backend, set_base_url
+from source.epub_writer import EpubException, CompressionPolicy
+from source.http_session import HttpSession, RetryPolicy, set_default_session
+from source.http_cache import HttpCache
+from source.rate_limiter import RateLimiter
+from source.image_store import ImageStore
+from source.payload_store import PayloadStore
+from source.volumes import VolumePolicy
+from source.selection import ChapterSelection, single
+from source.catalog import Catalog, CatalogEntry, SORT_KEYS
+from source import image_optimizer
+from source.image_optimizer import ImageOptimizer, DeviceProfile, PROFILES
+from source.batch import download_books, read_ids
+from source.library import download_book, update_book
+from source.progress import Event, BookStarted, ChapterStarted, ChapterFinished, Notice, BookWritten, \
+    CancelToken, Cancelled
+from source.profiler import Profiler, set_profiler
 
 def main() -> None:
     '''Start me from the command line. Either provide "arguments" in-code or from cmd line'''
@@ -16,31 +35,309 @@ def main() -> None:
         parser.print_help()
         return
     if args.op in ('l', 'list'):
-        list_books()
+        list_books(args)
         return
+    if args.op in ('reindex', 'r'):
+        reindex(args)
+        return
+    if args.profile is not None:
+        profiler = Profiler()
+        set_profiler(profiler)
+        atexit.register(report_profile, profiler, args.profile)
+        # However the operation ends.
+    with ExitStack() as stack:
+        run(args, stack)
+        # Whatever run() opens is closed however it ends.
+
+def run(args: argparse.Namespace, stack: ExitStack) -> None:
+    '''Downloads, updates or batches, opening the session, catalog and pools on stack'''
     if args.op in ('download', 'd'):
-        specific_chapter = -1 if 'single' not in vars(args) else 0 if args.single is None else args.single
+        if volume_policy(args) is not None and not chapter_selection(args).everything:
+            print('Only a whole book can be split into volumes, as they are numbered from its first chapter;',
+                  'leave out --range, --last and -s')
+            return
+        if not configure_session(args, stack):
+            return
+        print('Finding', args.id)
         try:
-            book = BookDownloader(args.id, specific_chapter)
+            save_name = download_book(args.id, report_event, CancelToken(args.timeout),
+                                      chapters=chapter_selection(args), workers=args.workers,
+                                      streaming=args.stream, image_workers=args.image_workers,
+                                      pretty=args.pretty, work_dir=args.work_dir,
+                                      compression=CompressionPolicy(level=args.compress_level),
+                                      volumes=volume_policy(args), **resources(args, stack))
         except ConnectionError as c_e:
             print(c_e.args[0])
+            return
         except RuntimeError:
             print('The story you entered does not exist!')
+            return
+        except (Cancelled, LocalizedException) as c_e:
+            print(c_e.args[0])
+            return
         if args.open:
-            open_sys(book.save_name)
+            open_sys(save_name)
+        return
+    if args.op in ('update', 'u'):
+        if not configure_session(args, stack):
+            return
+        if volume_policy(args) is not None:
+            print('A book split into volumes is updated by downloading it again with the same',
+                  '--volume-chapters/--volume-size; volumes that have not changed are kept as they are')
+            return
+        try:
+            update_book(args.file, report_event, CancelToken(args.timeout), workers=args.workers,
+                        streaming=args.stream, image_workers=args.image_workers, pretty=args.pretty,
+                        work_dir=args.work_dir, compression=CompressionPolicy(level=args.compress_level),
+                        **resources(args, stack))
+        except (FileNotFoundError, EpubException):
+            print('Unable to read', args.file)
+        except ConnectionError as c_e:
+            print(c_e.args[0])
+        except RuntimeError:
+            print('The story no longer exists!')
+        except (Cancelled, LocalizedException) as c_e:
+            print(c_e.args[0])
+        return
+    if args.op in ('batch', 'b'):
+        book_ids = list(args.ids)
+        if args.file is not None:
+            try:
+                if args.file == '-':
+                    book_ids += read_ids(sys.stdin)
+                else:
+                    with open(args.file, 'r', encoding='UTF-8') as stream:
+                        book_ids += read_ids(stream)
+            except FileNotFoundError:
+                print('Unable to read', args.file)
+                return
+        book_ids = read_ids(book_ids)
+        if len(book_ids) == 0:
+            print('No books to download')
+            return
+        if not configure_session(args, stack, books=args.books):
+            return
+        results = download_books(book_ids, args.books, args.workers, args.image_workers,
+                                 streaming=args.stream, pretty=args.pretty, work_dir=args.work_dir,
+                                 compression=CompressionPolicy(level=args.compress_level),
+                                 volumes=volume_policy(args), on_event=report_event, timeout=args.timeout,
+                                 **resources(args, stack))
+        print()
+        for result in results:
+            print('ok    ' if result.ok else 'FAILED', result.book_id.ljust(8), str(round(result.seconds, 1)).rjust(6) + 's',
+                  result.save_name if result.ok else result.error)
+        print(sum(1 for result in results if result.ok), 'of', len(results), 'books downloaded')
+        if not all(result.ok for result in results):
+            sys.exit(1)
+            # Through the stack, which closes what the batch used.
         return
     print('unexpected error: unrecognized operation')
     return
 
-def list_books() -> None:
-    books_tmp = pathlib.Path().glob('*.epub')
-    books = list(books_tmp)
+def configure_session(args: argparse.Namespace, stack: ExitStack, books: int = 1) -> bool:
+    '''Sets up the shared HTTP session from the network options, closed with stack'''
+    if args.offline and args.cache is None:
+        print('--offline needs a cache to read from; use --cache')
+        return False
+    if args.images is not None and not image_optimizer.AVAILABLE:
+        print('--images needs Pillow; install it with pip3 install pillow')
+        return False
+    if args.site is not None:
+        set_base_url(args.site)
+    if args.parser is not None:
+        try:
+            set_parser_backend(args.parser)
+        except LocalizedException as l_e:
+            print(l_e.args[0])
+            return False
+    session = HttpSession(
+        pool_size=max(10, args.workers + args.image_workers + books),
+        retry=RetryPolicy(retries=args.retries),
+        limiter=None if args.max_rate <= 0 else RateLimiter(rate=min(args.rate, args.max_rate), max_rate=args.max_rate,
+                                                            log=print),
+        log=print,
+        cache=None if args.cache is None else HttpCache(
+            args.cache,
+            max_bytes=args.cache_size * 1024 ** 2,
+            offline=args.offline
+        )
+    )
+    set_default_session(session)
+    stack.callback(session.close)
+    return True
+
+def resources(args: argparse.Namespace, stack: ExitStack) -> dict[str, Any]:
+    '''The image store, optimizer, process pool, payload store and catalog the options
+    ask for, as keyword arguments of download_book(), closed with stack'''
+    opened: dict[str, Any] = {
+        'image_store': image_store(args),
+        'optimizer': optimizer(args),
+        'transformer': transformer(args),
+        'payload_store': payload_store(args),
+        'catalog': catalog(args)
+    }
+    for resource in opened.values():
+        if resource is not None:
+            stack.callback(resource.close)
+    return opened
+
+def report_event(event: Event) -> None:
+    '''Prints a download's progress'''
+    if isinstance(event, BookStarted):
+        if event.updating is not None:
+            print('Updating', event.updating, 'with', event.new, 'new chapters from RoyalRoad')
+        elif event.selected == event.chapters:
+            print('Downloading', event.chapters, 'chapters of book', event.title, 'from RoyalRoad')
+        else:
+            print('Downloading', event.selected, 'of', event.chapters, 'chapters of book', event.title,
+                  'from RoyalRoad')
+        if event.resumed > 0:
+            print('Resuming from', event.resumed, 'chapters saved by an earlier run')
+    elif isinstance(event, ChapterStarted):
+        print('Getting index ' + str(event.place) + '/' + str(event.chapters - 1) + ' chapter ' + event.name)
+    elif isinstance(event, ChapterFinished):
+        if event.source == 'downloaded' and (event.done % 10 == 0 or event.done == event.total):
+            print(str(event.done) + ' of ' + str(event.total) + ' chapters, '
+                  + str(round(event.downloaded / 1024 ** 2, 1)) + ' MB downloaded'
+                  + ('' if event.eta is None else ', about ' + duration(event.eta) + ' left'))
+    elif isinstance(event, Notice):
+        print(event.message)
+    elif isinstance(event, BookWritten):
+        print('Saved', event.save_name, 'in', duration(event.seconds))
+
+def duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    return str(minutes) + 'm ' + str(seconds).rjust(2, '0') + 's' if minutes > 0 else str(seconds) + 's'
+
+def report_profile(profiler: Profiler, trace: str) -> None:
+    print()
+    print(profiler.summary())
+    profiler.write_trace(trace)
+    print('Trace written to', trace, '- open it in chrome://tracing or ui.perfetto.dev')
+
+def image_store(args: argparse.Namespace) -> ImageStore|None:
+    return None if args.image_store is None else ImageStore(args.image_store)
+
+def resolution(value: str) -> tuple[int, int]:
+    '''Parses WxH for --max-resolution'''
+    width, _, height = value.lower().partition('x')
+    if not (width.isdigit() and height.isdigit()):
+        raise argparse.ArgumentTypeError('expected WIDTHxHEIGHT, e.g. 1264x1680')
+    return int(width), int(height)
+
+def chapter_ranges(value: str) -> list[tuple[int|None, int|None]]:
+    '''Parses START:END[,...] for --range; a bare index is that one chapter'''
+    ranges: list[tuple[int|None, int|None]] = []
+    for part in value.split(','):
+        start, colon, end = part.strip().partition(':')
+        try:
+            if colon == '':
+                ranges.append(single(int(start)))
+            else:
+                ranges.append((None if start == '' else int(start), None if end == '' else int(end)))
+        except ValueError:
+            raise argparse.ArgumentTypeError('expected START:END, e.g. 1200:1300, or several separated by commas')
+    return ranges
+
+def chapter_selection(args: argparse.Namespace) -> ChapterSelection:
+    '''The chapters picked by --range, --last and -s; all of them if none is given'''
+    ranges = list(args.range)
+    if 'single' in vars(args):
+        ranges.append(single(0 if args.single is None else args.single))
+    return ChapterSelection(ranges, args.last)
+
+def optimizer(args: argparse.Namespace) -> ImageOptimizer|None:
+    '''The image optimizer for --images, with any of its settings overridden'''
+    if args.images is None:
+        return None
+    profile = PROFILES[args.images]
+    width, height = (profile.max_width, profile.max_height) if args.max_resolution is None else args.max_resolution
+    return ImageOptimizer(DeviceProfile(
+        profile.name,
+        width,
+        height,
+        profile.image_format if args.image_format is None else args.image_format.upper(),
+        profile.quality if args.image_quality is None else args.image_quality,
+        profile.grayscale,
+        profile.min_bytes
+    ))
+
+def transformer(args: argparse.Namespace) -> ChapterTransformer|None:
+    '''The process pool for --processes; 0 processes is one per core'''
+    if args.processes is None:
+        return None
+    return ChapterTransformer(args.processes if args.processes > 0 else None)
+
+def payload_store(args: argparse.Namespace) -> PayloadStore|None:
+    '''Where chapters and images wait to be written, within --memory'''
+    if args.memory <= 0:
+        return None
+    return PayloadStore(budget=args.memory * 1024 ** 2)
+
+def volume_policy(args: argparse.Namespace) -> VolumePolicy|None:
+    if args.volume_chapters is None and args.volume_size is None:
+        return None
+    return VolumePolicy(args.volume_chapters, None if args.volume_size is None else args.volume_size * 1024 ** 2)
+
+def catalog(args: argparse.Namespace) -> Catalog|None:
+    '''The catalog at --catalog, or None if it can't be opened'''
+    try:
+        return Catalog(args.catalog)
+    except sqlite3.Error as issue:
+        print('Unable to open the catalog', args.catalog + ':', issue)
+        return None
+
+def reindex(args: argparse.Namespace) -> None:
+    '''Brings the catalog up to date with the epubs beside it'''
+    books = catalog(args)
+    if books is None:
+        return
+    read, unchanged, forgotten = books.reindex(args.full, lambda path, issue: print('Skipped', path + ':', issue))
+    print('Read', read, 'epubs,', unchanged, 'unchanged,', forgotten, 'no longer there')
+    books.close()
+
+def describe(entry: CatalogEntry) -> str:
+    '''One line of list'''
+    size = str(round(entry.size / 1024 ** 2, 1)) + ' MB'
+    return ' '.join((entry.book_id.ljust(8), (entry.date_updated or '').ljust(10), str(entry.chapters).rjust(5),
+                     size.rjust(9), ' ', entry.title, '' if entry.author is None else 'by ' + entry.author))
+
+def list_books(args: argparse.Namespace) -> None:
+    library = catalog(args)
+    if library is None:
+        return
+    unlisted: list[str] = []
+    # Why epubs that are or were beside the catalog aren't listed
+    new = not library.indexed
+    if new:
+        library.reindex(on_error=lambda path, issue: unlisted.append(os.path.basename(path) + ': ' + str(issue)))
+        # The first list in a directory catalogs the epubs already in it.
+    else:
+        unlisted += [os.path.basename(path) + ': not in the catalog' for path in library.unlisted()]
+    entries = []
+    for entry in library.find(args.title, args.author, args.id, args.since, args.sort, args.reverse):
+        if os.path.exists(library.locate(entry)):
+            entries.append(entry)
+        else:
+            unlisted.append(entry.path + ': deleted since it was cataloged')
+    books = [library.locate(entry) for entry in entries]
+    library.close()
+    for reason in unlisted:
+        print('Not listed', reason)
+    if len(unlisted) > 0 and not new:
+        print('Run RRTool reindex to bring the catalog up to date; it says why any epub it skips is unreadable')
     if len(books) == 0 :
-        print("You haven't downloaded any books!")
+        if len(unlisted) > 0:
+            print('No books listed')
+        elif new or not any(vars(args)[name] is not None for name in ('title', 'author', 'id', 'since')):
+            print("You haven't downloaded any books!")
+        else:
+            print('No books match')
     else:
-        for i, book in enumerate(books):
+        print('  ', 'id'.ljust(8), 'updated'.ljust(10), 'chaps'.rjust(5), 'size'.rjust(9), ' ', 'title')
+        for i, entry in enumerate(entries):
             print(i, end='')
-            print(' ', book)
+            print(' ', describe(entry))
         i = -1
         while i == -1:
             r = input('Enter the number of the book you wish to open, or enter to quit.\n')
@@ -82,22 +379,263 @@ def bootstrap_arguments() -> argparse.ArgumentParser:
     )
     subparsers = parser.add_subparsers(
         title='usage',
-        description='this can be used to list epubs in the current directory or to download and create a new epub',
-        help='list or download',
-        metavar='download|list',
+        description='this can be used to list epubs in the current directory, to download and create a new epub, to download many, or to update one',
+        help='list, download, batch, update or reindex',
+        metavar='download|batch|update|list|reindex',
         dest='op')
+    library = argparse.ArgumentParser(add_help=False)
+    library.add_argument(
+        '--catalog',
+        metavar='file',
+        default='.rrcatalog.db',
+        help='the catalog of the epubs beside it, which list reads and downloads update (defaults to .rrcatalog.db)'
+    )
+    network = argparse.ArgumentParser(add_help=False, parents=[library])
+    network.add_argument(
+        '-w', '--workers',
+        metavar='N',
+        type=int,
+        default=1,
+        help='number of chapters to download at once (defaults to 1)'
+    )
+    network.add_argument(
+        '--image-workers',
+        metavar='N',
+        type=int,
+        default=4,
+        help='number of images to download at once, alongside chapters (defaults to 4)'
+    )
+    network.add_argument(
+        '-r', '--retries',
+        metavar='N',
+        type=int,
+        default=4,
+        help='times to retry a failed or throttled request, with backoff (defaults to 4)'
+    )
+    network.add_argument(
+        '--rate',
+        metavar='N',
+        type=float,
+        default=4,
+        help='requests per second to start each host at; the rate then adapts to what the host tolerates (defaults to 4)'
+    )
+    network.add_argument(
+        '--max-rate',
+        metavar='N',
+        type=float,
+        default=50,
+        help='most requests per second to send any host; 0 turns pacing off (defaults to 50)'
+    )
+    network.add_argument(
+        '-c', '--cache',
+        metavar='dir',
+        nargs='?',
+        const='.rrcache',
+        default=None,
+        help='keep downloaded pages and images in dir (defaults to .rrcache), and only re-download what changed'
+    )
+    network.add_argument(
+        '--cache-size',
+        metavar='MB',
+        type=int,
+        default=2048,
+        help='evict least recently used cache entries beyond this size (defaults to 2048)'
+    )
+    network.add_argument(
+        '--offline',
+        action='store_true',
+        help='build only from the cache, without touching the network'
+    )
+    network.add_argument(
+        '--image-store',
+        metavar='dir',
+        nargs='?',
+        const='.rrimages',
+        default=None,
+        help='share downloaded images between books through dir (defaults to .rrimages)'
+    )
+    network.add_argument(
+        '--work-dir',
+        metavar='dir',
+        default='.rrwork',
+        help='journal finished chapters in dir while downloading, so an interrupted download resumes where it stopped (defaults to .rrwork)'
+    )
+    network.add_argument(
+        '--images',
+        choices=sorted(PROFILES),
+        default=None,
+        help='shrink and re-encode images for this kind of reader; needs Pillow'
+    )
+    network.add_argument(
+        '--image-format',
+        choices=['jpeg', 'png', 'webp'],
+        default=None,
+        help='format to re-encode images to, instead of the one for --images'
+    )
+    network.add_argument(
+        '--image-quality',
+        metavar='N',
+        type=int,
+        default=None,
+        help='jpeg/webp quality from 1 to 95, instead of the one for --images'
+    )
+    network.add_argument(
+        '--max-resolution',
+        metavar='WxH',
+        type=resolution,
+        default=None,
+        help='scale larger images down to fit, instead of the size for --images (e.g. 1264x1680)'
+    )
+    network.add_argument(
+        '--processes',
+        metavar='N',
+        type=int,
+        nargs='?',
+        const=0,
+        default=None,
+        help='parse and render chapters on N processes, to use more than one core; with no N, one per core (defaults to doing it on the chapter workers)'
+    )
+    network.add_argument(
+        '--memory',
+        metavar='MB',
+        type=int,
+        default=512,
+        help='memory for chapters and images waiting to be written; beyond it, and for any of 1 MB or more, they wait in a temporary file instead. 0 keeps them all in memory (defaults to 512)'
+    )
+    network.add_argument(
+        '--volume-chapters',
+        metavar='N',
+        type=int,
+        default=None,
+        help='split the book into volumes of N chapters, each an epub of its own'
+    )
+    network.add_argument(
+        '--volume-size',
+        metavar='MB',
+        type=int,
+        default=None,
+        help='split the book into volumes of at most this size, each an epub of its own'
+    )
+    network.add_argument(
+        '--compress-level',
+        metavar='N',
+        type=int,
+        choices=range(10),
+        default=6,
+        help='deflate level for text in the epub, from 0 (stored) to 9; images are always stored (defaults to 6)'
+    )
+    network.add_argument(
+        '--site',
+        metavar='url',
+        default=None,
+        help='download from this address instead of https://www.royalroad.com, e.g. a local stand-in (see bench/server.py)'
+    )
+    network.add_argument(
+        '--parser',
+        choices=['lxml', 'html.parser'],
+        default=None,
+        help='HTML parser for downloaded pages (defaults to lxml if installed)'
+    )
+    network.add_argument(
+        '--profile',
+        metavar='file',
+        nargs='?',
+        const='profile.json',
+        default=None,
+        help='time each stage of the build, print a summary, and save a Chrome trace to file (defaults to profile.json)'
+    )
+    network.add_argument(
+        '--timeout',
+        metavar='seconds',
+        type=float,
+        default=None,
+        help='give up on a book that takes longer than this to download; its journal is kept, to resume from'
+    )
+    network.add_argument(
+        '--pretty',
+        action='store_true',
+        help='indent chapter xhtml for reading while debugging; slower and larger'
+    )
+    network.add_argument(
+        '--stream',
+        action='store_true',
+        help='write chapters and images to the epub as they arrive, so memory use stays flat'
+    )
     download = subparsers.add_parser(
         'download',
         prog='download',
         aliases=['d'],
+        parents=[network],
         help='downloads a book from RoyalRoad and saves as an epub'
     )
-    subparsers.add_parser(
+    update = subparsers.add_parser(
+        'update',
+        prog='update',
+        aliases=['u'],
+        parents=[network],
+        help='adds chapters released since an epub was made, downloading only those'
+    )
+    batch = subparsers.add_parser(
+        'batch',
+        prog='batch',
+        aliases=['b'],
+        parents=[network],
+        help='downloads many books in one go, sharing connections and workers between them, and images with --image-store'
+    )
+    listing = subparsers.add_parser(
         'list',
         prog='list',
         aliases=['l'],
+        parents=[library],
         help='list books in current directory'
     )
+    reindexing = subparsers.add_parser(
+        'reindex',
+        prog='reindex',
+        aliases=['r'],
+        parents=[library],
+        help='catalogs epubs added, changed or deleted since list last saw them'
+    )
+    listing.add_argument(
+        '-t', '--title',
+        metavar='text',
+        default=None,
+        help='only books whose title contains text'
+    )
+    listing.add_argument(
+        '-a', '--author',
+        metavar='text',
+        default=None,
+        help='only books whose author contains text'
+    )
+    listing.add_argument(
+        '--id',
+        metavar='id',
+        default=None,
+        help='only the book with this id, or its volumes'
+    )
+    listing.add_argument(
+        '--since',
+        metavar='YYYY-MM-DD',
+        default=None,
+        help='only books with chapters released on or after this date'
+    )
+    listing.add_argument(
+        '--sort',
+        choices=list(SORT_KEYS),
+        default='title',
+        help='order to list books in (defaults to title)'
+    )
+    listing.add_argument(
+        '--reverse',
+        action='store_true',
+        help='list in the opposite order'
+    )
+    reindexing.add_argument(
+        '--full',
+        action='store_true',
+        help='read every epub again, not only those that changed'
+    )
     download.add_argument(
         '-o', '--open',
         action='store_true',
@@ -109,12 +647,52 @@ def bootstrap_arguments() -> argparse.ArgumentParser:
         nargs='?',
         type=int,
         default=argparse.SUPPRESS,
-        help='only download one chapter (defaults to first chapter)'
+        help='only download one chapter (defaults to first chapter); short for --range index'
+    )
+    download.add_argument(
+        '--range',
+        metavar='START:END',
+        type=chapter_ranges,
+        action='extend',
+        default=[],
+        help='only download chapters START up to but not including END, counting from 0; '
+             'either may be left out, and several ranges or indexes can be separated by commas'
+    )
+    download.add_argument(
+        '--last',
+        metavar='N',
+        type=int,
+        default=None,
+        help='only download the last N chapters, e.g. to catch up on a book partway through'
     )
     download.add_argument(
         'id',
         help='id can be found after "fiction/" in the URL'
     )
+    batch.add_argument(
+        '-f', '--file',
+        metavar='file',
+        default=None,
+        help='also read ids from file, one per line; - reads standard input'
+    )
+    batch.add_argument(
+        '-b', '--books',
+        metavar='N',
+        type=int,
+        default=2,
+        help='number of books to build at once; -w and --image-workers are shared between them (defaults to 2)'
+    )
+    batch.add_argument(
+        'ids',
+        nargs='*',
+        help='ids can be found after "fiction/" in the URL'
+    )
+    update.add_argument(
+        'file',
+        help='epub previously made by this tool'
+    )
     return parser
 
-main()
+if __name__ == '__main__':
+    main()
+    # Guarded, as process pools re-import this module in their workers on Windows and macOS.
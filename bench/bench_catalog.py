@@ -0,0 +1,64 @@
+'''Compares finding books by opening every epub with looking them up in a Catalog,
+for a library of synthetic epubs.
+
+    python -m bench.bench_catalog [-b books] [-c chapters]
+from the repository root.'''
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from typing import Callable
+from source.epub_writer import EpubWriter, EpubChapter, TableOfContents, EpubCover
+from source.epub_reader import EpubReader
+from source.catalog import Catalog
+from bench.synthetic import paragraph
+
+def make_book(path: str, chapters: int) -> None:
+    rng = random.Random(0)
+    writer = EpubWriter('Benchmark', log=open(os.devnull, 'w', encoding='UTF-8'))
+    writer.create(replace=path)
+    toc = TableOfContents()
+    for place in range(chapters):
+        chapter = EpubChapter('Chapter ' + str(place), 'Chapter_' + str(place), place,
+                              '<p>' + '</p><p>'.join(paragraph(rng) for _ in range(20)) + '</p>')
+        toc.push_chapter(chapter)
+        writer.push_item(chapter)
+    writer.push_item(toc)
+    writer.push_item(EpubCover(None, 'Benchmark'))
+    writer.complete('A. Benchmark', None, None, None, '0', '2021-01-01')
+
+def timed(action: Callable[..., object], *args: object) -> float:
+    start = time.perf_counter()
+    action(*args)
+    return time.perf_counter() - start
+
+def open_all(directory: str) -> None:
+    '''What finding a book took without a catalog'''
+    for name in os.listdir(directory):
+        if name.endswith('.epub'):
+            EpubReader(os.path.join(directory, name)).close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the library catalog')
+    parser.add_argument('-b', '--books', type=int, default=1000)
+    parser.add_argument('-c', '--chapters', type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        first = os.path.join(directory, 'Book 0.epub')
+        make_book(first, args.chapters)
+        for number in range(1, args.books):
+            shutil.copyfile(first, os.path.join(directory, 'Book ' + str(number) + '.epub'))
+        print(f'{args.books} epubs of {args.chapters} chapters, {os.path.getsize(first) / 1e6:.1f} MB each')
+        print(f'{"lookup":<28} {"seconds":>8}')
+        print(f'{"open every epub":<28} {timed(open_all, directory):>8.3f}')
+        catalog = Catalog(os.path.join(directory, '.rrcatalog.db'))
+        print(f'{"reindex, full":<28} {timed(catalog.reindex, True):>8.3f}')
+        print(f'{"reindex, nothing changed":<28} {timed(catalog.reindex):>8.3f}')
+        print(f'{"find by title, sorted":<28} {timed(catalog.find, "book", None, None, None, "updated"):>8.3f}')
+        catalog.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''Times building an image-heavy book with the old deflate-everything-on-one-thread
+packaging, and with the per-media-type policy and parallel compression.
+
+    python -m bench.bench_compress [-c chapters] [-i images] [--image-kb KB] [-w workers]
+from the repository root.'''
+import os
+import time
+import random
+import argparse
+import tempfile
+from source.epub_writer import EpubWriter, EpubChapter, EpubImage, TableOfContents, EpubCover, CompressionPolicy
+from bench.synthetic import paragraph
+
+def build(path: str, chapters: list[str], images: list[bytes], policy: CompressionPolicy, workers: int) -> tuple[float, float]:
+    '''Wall and CPU seconds to package the book'''
+    wall, cpu = time.perf_counter(), time.process_time()
+    writer = EpubWriter('Benchmark', log=open(os.devnull, 'w', encoding='UTF-8'),
+                        compression=policy, compress_workers=workers)
+    writer.create(replace=path)
+    toc = TableOfContents()
+    for place, data in enumerate(chapters):
+        chapter = EpubChapter('Chapter ' + str(place), 'Chapter_' + str(place), place, data)
+        toc.push_chapter(chapter)
+        writer.push_item(chapter)
+    for identity, image in enumerate(images):
+        writer.push_item(EpubImage(image, '.jpg', str(identity)))
+    writer.push_item(toc)
+    writer.push_item(EpubCover(None, 'Benchmark'))
+    writer.complete('Benchmark', None, None, None, '0', '2021-01-01')
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark epub compression')
+    parser.add_argument('-c', '--chapters', type=int, default=500)
+    parser.add_argument('-i', '--images', type=int, default=200)
+    parser.add_argument('--image-kb', type=int, default=300)
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    chapters = ['<p>' + '</p><p>'.join(paragraph(rng) for _ in range(40)) + '</p>' for _ in range(args.chapters)]
+    images = [rng.randbytes(args.image_kb * 1024) for _ in range(args.images)]
+    # Random bytes stand in for JPEGs: they don't deflate either.
+    print(f'{args.chapters} chapters, {args.images} images of {args.image_kb} KB, {args.workers} workers')
+    print(f'{"packaging":<28} {"wall s":>7} {"cpu s":>7} {"epub bytes":>12}')
+    with tempfile.TemporaryDirectory() as directory:
+        for label, policy, workers in (
+                ('deflate all, 1 thread', CompressionPolicy(stored=()), 1),
+                ('store images, 1 thread', CompressionPolicy(), 1),
+                ('store images, ' + str(args.workers) + ' threads', CompressionPolicy(), args.workers)):
+            path = os.path.join(directory, 'book.epub')
+            wall, cpu = build(path, chapters, images, policy, workers)
+            print(f'{label:<28} {wall:>7.2f} {cpu:>7.2f} {os.path.getsize(path):>12,}')
+
+if __name__ == '__main__':
+    main()
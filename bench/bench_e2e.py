@@ -0,0 +1,121 @@
+'''Downloads a synthetic fiction end to end from a local stand-in server, through the
+real BookDownloader and EpubWriter, and reports chapters/s, peak RSS and epub size.
+
+    python -m bench.bench_e2e [-c chapters] [--images per_chapter] [--latency ms] [--errors rate] [-w workers]
+from the repository root. Each run is appended to bench-results.jsonl (see --results),
+and compared with the last run there with the same settings.'''
+import io
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+from source.rr_dwnldr import set_base_url
+from source.library import download_book
+from source.http_session import HttpSession, RetryPolicy, set_default_session
+from source.rate_limiter import RateLimiter
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return int(probe.getsockname()[1])
+
+def start_server(args: argparse.Namespace) -> tuple[subprocess.Popen[str], str]:
+    '''The stand-in runs in its own process, so it isn't counted in this one's RSS or CPU'''
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'bench.server', '-p', str(port), '-c', str(args.chapters),
+         '--images', str(args.images), '--image-kb', str(args.image_kb),
+         '--latency', str(args.latency), '--errors', str(args.errors)],
+        stdout=subprocess.PIPE, text=True)
+    if server.stdout is None or 'Serving' not in server.stdout.readline():
+        server.kill()
+        raise RuntimeError('The stand-in server did not start')
+    return server, 'http://127.0.0.1:' + str(port)
+
+def git_revision() -> str|None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args: argparse.Namespace, url: str) -> dict[str, float]:
+    set_base_url(url)
+    set_default_session(HttpSession(
+        pool_size=max(10, args.workers + args.image_workers),
+        retry=RetryPolicy(retries=8, backoff=0.05, max_backoff=1.0),
+        limiter=RateLimiter(rate=args.rate, max_rate=1000) if args.rate > 0 else None
+    ))
+    start_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            wall, cpu = time.perf_counter(), time.process_time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                save_name = download_book('1', workers=args.workers, image_workers=args.image_workers,
+                                          streaming=args.stream)
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            size = os.path.getsize(save_name)
+        finally:
+            os.chdir(start_dir)
+    return {
+        'seconds': round(wall, 3),
+        'cpu_seconds': round(cpu, 3),
+        'chapters_per_second': round(args.chapters / wall, 2),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        # ru_maxrss is in KiB on Linux.
+        'epub_bytes': size,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='End to end benchmark against a local stand-in server')
+    parser.add_argument('-c', '--chapters', type=int, default=200)
+    parser.add_argument('--images', type=float, default=1.0, help='images per chapter')
+    parser.add_argument('--image-kb', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=20, help='ms per response')
+    parser.add_argument('--errors', type=float, default=0, help='fraction of responses that are 503s')
+    parser.add_argument('-w', '--workers', type=int, default=8)
+    parser.add_argument('--image-workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0, help='start the adaptive rate limiter at this rate; 0 for none')
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--label', default='', help='note saved with the result, e.g. the change being measured')
+    parser.add_argument('--results', default='bench-results.jsonl', help='file results are appended to')
+    args = parser.parse_args()
+
+    settings = {name: getattr(args, name) for name in
+                ('chapters', 'images', 'image_kb', 'latency', 'errors', 'workers', 'image_workers', 'rate', 'stream')}
+    server, url = start_server(args)
+    try:
+        metrics = run(args, url)
+    finally:
+        server.kill()
+        server.wait()
+
+    previous = None
+    try:
+        with open(args.results, 'r', encoding='UTF-8') as stream:
+            for line in stream:
+                result = json.loads(line)
+                if result.get('settings') == settings:
+                    previous = result
+    except FileNotFoundError:
+        pass
+    with open(args.results, 'a', encoding='UTF-8') as stream:
+        stream.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': git_revision(),
+                                 'label': args.label, 'settings': settings, 'metrics': metrics}) + '\n')
+
+    print(', '.join(name + '=' + str(value) for name, value in settings.items()))
+    print(f'{"metric":<20} {"this run":>12} {"last run":>12} {"change":>8}')
+    for name, value in metrics.items():
+        before = None if previous is None else previous['metrics'].get(name)
+        change = '' if not before else f'{100 * (value - before) / before:+.1f}%'
+        print(f'{name:<20} {value:>12} {"" if before is None else before:>12} {change:>8}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''Compares image bytes and processing time for each device profile, over synthetic
+maps and screenshots like those embedded in chapters.
+
+    python -m bench.bench_images [-n images] [-w workers]
+from the repository root. Needs Pillow.'''
+import io
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw
+from source.image_optimizer import PROFILES, optimize
+
+def synthetic_image(number: int) -> tuple[bytes, str]:
+    '''A large PNG: a noisy map with gridlines and labels, or a flat screenshot'''
+    rng = random.Random(number)
+    width, height = rng.choice([(3000, 2000), (2400, 3200), (1920, 1080), (800, 600), (300, 200)])
+    image = Image.effect_noise((width, height), 40).convert('RGB') if number % 2 == 0 else \
+        Image.new('RGB', (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        colour = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        draw.rectangle((x, y, x + rng.randrange(200), y + rng.randrange(60)), fill=colour)
+        draw.text((x, y), 'Label ' + str(rng.randrange(1000)), fill=(0, 0, 0))
+    result = io.BytesIO()
+    image.save(result, 'PNG')
+    return result.getvalue(), '.png'
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark image optimization per device profile')
+    parser.add_argument('-n', '--images', type=int, default=12)
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    images = [synthetic_image(number) for number in range(args.images)]
+    original = sum(len(data) for data, _ in images)
+    print(f'{args.images} images, {original:,} bytes as downloaded')
+    print(f'{"profile":<8} {"seconds":>8} {"bytes":>12} {"smaller":>8}')
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for name, profile in PROFILES.items():
+            start = time.perf_counter()
+            results = list(executor.map(optimize, *zip(*images), [profile] * len(images)))
+            seconds = time.perf_counter() - start
+            size = sum(len(data) for data, _ in results)
+            print(f'{name:<8} {seconds:>8.2f} {size:>12,} {original / size:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+'''Times content.opf/toc.ncx generation for synthetic books of growing length.
+
+    python -m bench.bench_package [-c 1000 10000 50000]
+from the repository root.'''
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+from source.epub_writer import EpubWriter, EpubChapter, TableOfContents, EpubCover
+
+def build(chapters: int, directory: str) -> tuple[float, int]:
+    '''Seconds spent in complete(), and peak bytes allocated during it'''
+    writer = EpubWriter('Benchmark', log=open(os.devnull, 'w', encoding='UTF-8'), streaming=True)
+    writer.create(replace=os.path.join(directory, str(chapters) + '.epub'))
+    toc = TableOfContents()
+    for place in range(chapters):
+        chapter = EpubChapter('Chapter ' + str(place), 'Chapter_' + str(place), place, '<p/>')
+        toc.push_chapter(chapter)
+        writer.push_item(chapter)
+    writer.push_item(toc)
+    writer.push_item(EpubCover(None, 'Benchmark'))
+    tracemalloc.start()
+    start = time.perf_counter()
+    writer.complete('Benchmark', None, None, None, '0', '2021-01-01')
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark package document generation')
+    parser.add_argument('-c', '--chapters', type=int, nargs='+', default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    print(f'{"chapters":>9} {"complete s":>11} {"us/chapter":>11} {"peak MiB":>9}')
+    with tempfile.TemporaryDirectory() as directory:
+        for chapters in args.chapters:
+            seconds, peak = build(chapters, directory)
+            print(f'{chapters:>9} {seconds:>11.3f} {seconds / chapters * 1e6:>11.1f} {peak / 2 ** 20:>9.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+'''Times parsing saved chapter pages with each parser backend, in full and strained.
+
+Save some chapter pages from RoyalRoad (e.g. with your browser) into a directory, then run
+    python -m bench.bench_parse path/to/pages [-n repeats]
+from the repository root.'''
+import sys
+import time
+import pathlib
+import argparse
+import importlib.util
+from bs4 import BeautifulSoup as bs
+from source.rr_dwnldr import _CHAPTER_PARTS
+
+def time_parse(pages: list[str], parser: str, strain: bool, repeats: int) -> float:
+    '''Seconds per page, best of repeats'''
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for page in pages:
+            bs(page, parser, parse_only=_CHAPTER_PARTS if strain else None)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pages)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark chapter page parsing')
+    parser.add_argument('pages', help='directory of saved chapter pages (*.html)')
+    parser.add_argument('-n', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = [path.read_text(encoding='UTF-8') for path in sorted(pathlib.Path(args.pages).glob('*.htm*'))]
+    if len(pages) == 0:
+        sys.exit('No pages found in ' + args.pages)
+    backends = ['html.parser']
+    if importlib.util.find_spec('lxml') is not None:
+        backends.append('lxml')
+
+    baseline = time_parse(pages, 'html.parser', False, args.repeats)
+    print(f'{len(pages)} pages, {sum(len(page) for page in pages) // len(pages)} characters on average')
+    print(f'{"parser":<12} {"mode":<9} {"ms/page":>8} {"speedup":>8}')
+    for backend in backends:
+        for strain in (False, True):
+            seconds = time_parse(pages, backend, strain, args.repeats)
+            print(f'{backend:<12} {"strained" if strain else "full":<9} '
+                  f'{seconds * 1000:>8.2f} {baseline / seconds:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''Compares peak memory and time building an image-heavy book with everything held
+in memory, and with a PayloadStore spilling beyond budgets of growing size.
+
+    python -m bench.bench_payloads [-c chapters] [-i images] [--image-kb KB] [-b MB ...]
+from the repository root.'''
+import os
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from source.epub_writer import EpubWriter, EpubChapter, EpubImage, TableOfContents, EpubCover
+from source.payload_store import PayloadStore
+from bench.synthetic import paragraph
+
+def build(path: str, chapters: list[str], image_kb: int, images: int, store: PayloadStore|None) -> tuple[float, int]:
+    '''Seconds to build the book, and peak bytes allocated while doing so.
+    Images are made as they are pushed, as downloads arrive, so only the writer holds them.'''
+    rng = random.Random(1)
+    tracemalloc.start()
+    start = time.perf_counter()
+    writer = EpubWriter('Benchmark', log=open(os.devnull, 'w', encoding='UTF-8'))
+    writer.create(replace=path)
+    toc = TableOfContents()
+    for place, data in enumerate(chapters):
+        chapter = EpubChapter('Chapter ' + str(place), 'Chapter_' + str(place), place, data, store)
+        toc.push_chapter(chapter)
+        writer.push_item(chapter)
+    for identity in range(images):
+        writer.push_item(EpubImage(rng.randbytes(image_kb * 1024), '.jpg', str(identity), store))
+    writer.push_item(toc)
+    writer.push_item(EpubCover(None, 'Benchmark'))
+    writer.complete('Benchmark', None, None, None, '0', '2021-01-01')
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark spilling payloads to disk')
+    parser.add_argument('-c', '--chapters', type=int, default=1000)
+    parser.add_argument('-i', '--images', type=int, default=300)
+    parser.add_argument('--image-kb', type=int, default=500)
+    parser.add_argument('-b', '--budgets', type=int, nargs='+', default=[256, 32, 0], help='memory budgets in MB')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    chapters = ['<p>' + '</p><p>'.join(paragraph(rng) for _ in range(40)) + '</p>' for _ in range(args.chapters)]
+    print(f'{args.chapters} chapters, {args.images} images of {args.image_kb} KB')
+    print(f'{"payloads":<22} {"seconds":>8} {"peak MB":>8} {"spilled MB":>11}')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'book.epub')
+        seconds, peak = build(path, chapters, args.image_kb, args.images, None)
+        print(f'{"all in memory":<22} {seconds:>8.2f} {peak / 1e6:>8.1f} {0:>11.1f}')
+        for budget in args.budgets:
+            store = PayloadStore(budget=budget * 1024 ** 2, directory=directory)
+            seconds, peak = build(path, chapters, args.image_kb, args.images, store)
+            label = 'store, ' + str(budget) + ' MB budget'
+            print(f'{label:<22} {seconds:>8.2f} {peak / 1e6:>8.1f} {store.spilled / 1e6:>11.1f}')
+            store.close()
+
+if __name__ == '__main__':
+    main()
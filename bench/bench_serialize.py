@@ -0,0 +1,62 @@
+'''Compares pretty and compact chapter serialization: time, and the size of the finished epub.
+
+    python -m bench.bench_serialize [-c chapters]
+from the repository root.'''
+import os
+import time
+import argparse
+import tempfile
+from bs4 import BeautifulSoup as bs
+from source.epub_writer import EpubWriter, EpubChapter, TableOfContents, EpubCover
+from source.rr_dwnldr import Chapter, _CHAPTER_PARTS, parser_backend
+from source.templates import template
+from bench.synthetic import chapter_page
+
+def build(chapters: list[Chapter], pretty: bool, directory: str) -> tuple[float, int, int]:
+    '''Seconds spent serializing, bytes of xhtml, and bytes of the resulting epub'''
+    path = os.path.join(directory, ('pretty' if pretty else 'compact') + '.epub')
+    writer = EpubWriter('Benchmark', log=open(os.devnull, 'w', encoding='UTF-8'))
+    writer.create(replace=path)
+    toc = TableOfContents()
+    serializing = 0.0
+    xhtml = 0
+    for place, chapter in enumerate(chapters):
+        start = time.perf_counter()
+        data = chapter.render(pretty)
+        serializing += time.perf_counter() - start
+        xhtml += len(data.encode('UTF-8'))
+        epub_chapter = EpubChapter(chapter.name, chapter.sanitized_name, place, data)
+        toc.push_chapter(epub_chapter)
+        writer.push_item(epub_chapter)
+    writer.push_item(toc)
+    writer.push_item(EpubCover(None, 'Benchmark'))
+    writer.complete('Benchmark', None, None, None, '0', '2021-01-01')
+    return serializing, xhtml, os.path.getsize(path)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark chapter serialization')
+    parser.add_argument('-c', '--chapters', type=int, default=500)
+    args = parser.parse_args()
+
+    chapters = []
+    for number in range(args.chapters):
+        chapter = Chapter('Chapter ' + str(number), '/fiction/0/chapter/' + str(number))
+        chapter.soup = bs('', 'html.parser')
+        for part in bs(chapter_page(number), parser_backend(), parse_only=_CHAPTER_PARTS).find_all('div', recursive=False):
+            chapter.soup.append(part)
+        chapters.append(chapter)
+    # Parsed up front; only serialization is timed.
+    template('BasicChapter.xhtml')
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {pretty: build(chapters, pretty, directory) for pretty in (True, False)}
+    print(f'{args.chapters} chapters')
+    print(f'{"mode":<8} {"serialize s":>12} {"xhtml bytes":>12} {"epub bytes":>12}')
+    for pretty, (seconds, xhtml, size) in results.items():
+        print(f'{"pretty" if pretty else "compact":<8} {seconds:>12.3f} {xhtml:>12,} {size:>12,}')
+    print(f'compact is {results[True][0] / results[False][0]:.1f}x faster, with '
+          f'{100 * (1 - results[False][1] / results[True][1]):.0f}% less xhtml and a '
+          f'{100 * (1 - results[False][2] / results[True][2]):.0f}% smaller epub')
+
+if __name__ == '__main__':
+    main()
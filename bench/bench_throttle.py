@@ -0,0 +1,99 @@
+'''Downloads from a local server that throttles, with and without the adaptive rate limiter.
+
+    python -m bench.bench_throttle [-n requests] [-w workers] [--limit per_second] [--max-rate per_second] [--latency ms]
+from the repository root. The server answers 429 to requests beyond --limit per second.'''
+import io
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from source.http_session import HttpSession, RetryPolicy
+from source.rate_limiter import RateLimiter
+
+class ThrottlingServer(ThreadingHTTPServer):
+    '''Serves a small page, but only limit requests in any second; the rest get 429'''
+    daemon_threads = True
+
+    def __init__(self, limit: int, latency: float) -> None:
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.limit = limit
+        self.latency = latency
+        self.served = 0
+        self.throttled = 0
+        self._recent: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def admit(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            while len(self._recent) > 0 and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.limit:
+                self.throttled += 1
+                return False
+            self._recent.append(now)
+            self.served += 1
+            return True
+
+class _Handler(BaseHTTPRequestHandler):
+    server: ThrottlingServer
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        if not self.server.admit():
+            self.send_response(429)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'<html><body>' + b'x' * 2000 + b'</body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def run(args: argparse.Namespace, adaptive: bool) -> None:
+    server = ThrottlingServer(args.limit, args.latency / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:' + str(server.server_address[1]) + '/page'
+    log = io.StringIO()
+    session = HttpSession(
+        pool_size=args.workers,
+        retry=RetryPolicy(retries=20, backoff=0.05, max_backoff=2.0),
+        limiter=RateLimiter(max_rate=args.max_rate, log=lambda line: print(line, file=log)) if adaptive else None
+    )
+    failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for response in executor.map(session.get, [url] * args.requests):
+            failed += response.status_code != 200
+    seconds = time.perf_counter() - start
+    session.close()
+    server.shutdown()
+    server.server_close()
+    print(f'{"adaptive" if adaptive else "fixed":<9} {seconds:>8.2f} {args.requests / seconds:>8.1f} '
+          f'{server.throttled:>6} {failed:>7}')
+    if adaptive:
+        lines = log.getvalue().splitlines()
+        print('   ', len(lines), 'rate changes, last:', lines[-1] if len(lines) > 0 else None)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the rate limiter against a throttling server')
+    parser.add_argument('-n', '--requests', type=int, default=300)
+    parser.add_argument('-w', '--workers', type=int, default=16)
+    parser.add_argument('--limit', type=int, default=40, help='requests the server allows per second')
+    parser.add_argument('--max-rate', type=float, default=50, help='most requests per second the limiter allows')
+    parser.add_argument('--latency', type=float, default=20, help='ms the server takes per request')
+    args = parser.parse_args()
+    print(f'{args.requests} requests, {args.workers} workers, server allows {args.limit}/s')
+    print(f'{"limiter":<9} {"wall s":>8} {"req/s":>8} {"429s":>6} {"failed":>7}')
+    for adaptive in (False, True):
+        run(args, adaptive)
+
+if __name__ == '__main__':
+    main()
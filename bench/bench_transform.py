@@ -0,0 +1,42 @@
+'''Times parsing and rendering synthetic chapter pages on the calling thread, and on
+ChapterTransformer process pools of growing size, as when building a fully cached book.
+
+    python -m bench.bench_transform [-c chapters] [-p 1 2 4 8]
+from the repository root.'''
+import os
+import time
+import argparse
+from source.rr_dwnldr import ChapterTransformer, transform_chapter, parser_backend
+from bench.synthetic import chapter_page
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark chapter transformation across processes')
+    parser.add_argument('-c', '--chapters', type=int, default=2000)
+    parser.add_argument('-p', '--processes', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    pages = [chapter_page(number, images=['/images/' + str(number) + '.png']) for number in range(args.chapters)]
+    print(f'{args.chapters} chapters, {sum(map(len, pages)) / 1e6:.1f} MB of pages, {os.cpu_count()} cores')
+    print(f'{"transform":<16} {"seconds":>8} {"chapters/s":>11} {"speedup":>8}')
+    start = time.perf_counter()
+    for number, page in enumerate(pages):
+        transform_chapter('Chapter ' + str(number), page, number != 0, False, parser_backend())
+    inline = time.perf_counter() - start
+    print(f'{"this thread":<16} {inline:>8.2f} {args.chapters / inline:>11.0f} {1.0:>7.2f}x')
+    for processes in args.processes:
+        transformer = ChapterTransformer(processes)
+        transformer.submit('warm up', pages[0], True, False).result()
+        # Start the workers before timing.
+        start = time.perf_counter()
+        transforms = [transformer.submit('Chapter ' + str(number), page, number != 0, False)
+                      for number, page in enumerate(pages)]
+        for transform in transforms:
+            transform.result()
+        seconds = time.perf_counter() - start
+        transformer.close()
+        label = str(processes) + ' processes'
+        print(f'{label:<16} {seconds:>8.2f} {args.chapters / seconds:>11.0f} {inline / seconds:>7.2f}x')
+
+if __name__ == '__main__':
+    main()
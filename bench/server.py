@@ -0,0 +1,129 @@
+'''A local stand-in for RoyalRoad, serving synthetic fictions, chapters and images.
+
+    python -m bench.server [-p port] [-c chapters] [--images per_chapter] [--latency ms] [--errors rate]
+from the repository root, then point the tool at http://127.0.0.1:port (see set_base_url).
+Any fiction id is served, with the same chapters.'''
+import re
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from bench.synthetic import chapter_page, fiction_page, png
+
+class StandinServer(ThreadingHTTPServer):
+    '''Serves fiction pages with chapters, chapter pages with images_per_chapter images
+    each (about a fifth of them shared with other chapters), and the images.
+    Every response waits latency seconds, and error_rate of them are 503s, which the
+    downloader retries. Pages and images are the same for the same seed. Without
+    author_box, only the chapters show the author; with broken_images, the chapters'
+    images are 500s.'''
+    daemon_threads = True
+
+    def __init__(self,
+                 port: int = 0,
+                 chapters: int = 100,
+                 images_per_chapter: float = 1.0,
+                 image_size: int = 40 * 1024,
+                 latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 seed: int = 0,
+                 author_box: bool = True,
+                 broken_images: bool = False
+            ) -> None:
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.chapters = chapters
+        self.images_per_chapter = images_per_chapter
+        self.image_size = image_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.author_box = author_box
+        self.broken_images = broken_images
+        self.requests = 0
+        self.errors = 0
+        self.paths: list[str] = [] # Of the requests answered without an error, in order
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._distinct_images = max(1, int(chapters * images_per_chapter * 0.8))
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def fail(self) -> bool:
+        '''Whether to answer this request with an error'''
+        with self._lock:
+            self.requests += 1
+            if self._rng.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def chapter_images(self, number: int) -> list[str]:
+        first = int(number * self.images_per_chapter)
+        count = int((number + 1) * self.images_per_chapter) - first
+        return ['/images/' + str((first + i) % self._distinct_images) + '.png' for i in range(count)]
+
+    def start(self) -> 'StandinServer':
+        '''Serves on a background thread'''
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class _Handler(BaseHTTPRequestHandler):
+    server: StandinServer
+    protocol_version = 'HTTP/1.1'
+    # Keep-alive, as RoyalRoad does.
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+        if server.fail():
+            self._send(503, b'', 'text/plain')
+            return
+        path = self.path.partition('?')[0]
+        server.paths.append(path)
+        if match := re.fullmatch(r'/fiction/(\d+)', path):
+            page = fiction_page(match[1], server.chapters, author_box=server.author_box)
+            self._send(200, page.encode(), 'text/html; charset=utf-8')
+        elif match := re.fullmatch(r'/fiction/\d+/chapter/(\d+)', path):
+            number = int(match[1])
+            page = chapter_page(number, images=server.chapter_images(number), seed=server.seed)
+            self._send(200, page.encode(), 'text/html; charset=utf-8')
+        elif server.broken_images and re.fullmatch(r'/images/\d+\.png', path):
+            self._send(500, b'', 'text/plain')
+        elif match := re.fullmatch(r'/images/(\d+)\.png', path):
+            self._send(200, png(server.seed * 1000003 + int(match[1]), server.image_size), 'image/png')
+        elif path in ('/images/cover.png', '/avatar.png'):
+            self._send(200, png(-1 if path == '/avatar.png' else -2, 8 * 1024), 'image/png')
+        else:
+            self._send(404, b'', 'text/plain')
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Serve synthetic RoyalRoad pages')
+    parser.add_argument('-p', '--port', type=int, default=8765)
+    parser.add_argument('-c', '--chapters', type=int, default=100)
+    parser.add_argument('--images', type=float, default=1.0, help='images per chapter')
+    parser.add_argument('--image-kb', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0, help='ms per response')
+    parser.add_argument('--errors', type=float, default=0, help='fraction of responses that are 503s')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    server = StandinServer(args.port, args.chapters, args.images, args.image_kb * 1024,
+                           args.latency / 1000, args.errors, args.seed)
+    print('Serving', args.chapters, 'chapters at', server.url)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''Synthetic RoyalRoad-like pages, shaped like the parts BookDownloader parses'''
+import zlib
+import random
+import struct
+
+_WORDS = ('the of and to in a is that it was he for on are as with his they at be this '
+          'from have or by one had not but what all were when we there can an your which '
+          'their said if do will each about how up out them then she many some so these').split()
+
+def paragraph(rng: random.Random, words: int = 60) -> str:
+    return ' '.join(rng.choice(_WORDS) for _ in range(words)).capitalize() + '.'
+
+def chapter_page(number: int, paragraphs: int = 40, images: list[str]|None = None, seed: int = 0) -> str:
+    '''A chapter page: site chrome, an author's note either side of the content, and comments'''
+    rng = random.Random(seed * 100003 + number)
+    body = ''.join('<p style="text-align: justify"><span style="font-weight: 400">' + paragraph(rng)
+                   + ' <em>' + rng.choice(_WORDS) + '</em></span></p>' for _ in range(paragraphs))
+    body += ''.join('<p><img src="' + image + '" alt="" /></p>' for image in images or [])
+    nav = ''.join('<li class="nav-item"><a class="nav-link" href="/nav/' + str(i) + '"><span>Item '
+                  + str(i) + '</span></a></li>' for i in range(150))
+    comments = ''.join('<div class="comment"><div class="media-body"><h4>User ' + str(i) + '</h4><p>'
+                       + paragraph(rng, 30) + '</p></div></div>' for i in range(20))
+    return ('<!DOCTYPE html><html><head><title>Chapter ' + str(number) + ' - Royal Road</title></head><body>'
+            '<ul class="nav">' + nav + '</ul>'
+            '<div class="portlet"><div class="portlet-body author-note"><p>' + paragraph(rng, 20) + '</p></div></div>'
+            '<div class="chapter-inner chapter-content">' + body + '</div>'
+            '<div class="portlet"><div class="portlet-body author-note"><p>' + paragraph(rng, 20) + '</p></div></div>'
+            '<div class="portlet"><div class="avatar-container-general"><img src="/avatar.png" /></div>'
+            '<div class="author-info"><i class="fa fa-info-circle"></i> Bio: an author</div></div>'
+            + comments + '</body></html>')
+
+def fiction_page(book_id: str, chapters: int, title: str = 'Benchmark Fiction', cover: str = '/images/cover.png',
+                 author_box: bool = True) -> str:
+    '''A fiction page: title, author and their box (unless author_box is False, as on
+    some fictions), description, cover and the table of chapters with their dates'''
+    rows = ''.join('<tr><td><a href="/fiction/' + book_id + '/chapter/' + str(number) + '">Chapter '
+                   + str(number) + '</a></td><td><time title="Monday, March 3, 2021 10:00">3 years ago</time></td></tr>'
+                   for number in range(chapters))
+    return ('<!DOCTYPE html><html><head><title>' + title + ' - Royal Road</title>'
+            '<meta property="books:author" content="A. Benchmark" /></head><body>'
+            '<div class="cover-art-container"><img src="' + cover + '" /></div>'
+            '<div class="description"><p>A synthetic fiction for benchmarks.</p></div>'
+            + ('<div class="portlet"><div class="avatar-container-general"><img src="/avatar.png" /></div>'
+               '<div class="author-info"><i class="fa fa-info-circle"></i> Bio: an author</div></div>'
+               if author_box else '') +
+            '<table><tbody>' + rows + '</tbody></table></body></html>')
+
+def png(seed: int, size: int = 40 * 1024) -> bytes:
+    '''A valid PNG of about size bytes, of noise, so it doesn't compress'''
+    rng = random.Random(seed)
+    width = 256
+    height = max(1, size // (3 * width))
+    raw = b''.join(b'\x00' + rng.randbytes(3 * width) for _ in range(height))
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b''))
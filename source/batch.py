@@ -0,0 +1,92 @@
+'''Builds many books in one process, sharing connections, caches and workers'''
+import time
+from typing import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from source.rr_dwnldr import LocalizedException, ChapterTransformer
+from source.library import download_book
+from source.progress import Event, CancelToken, Cancelled
+from source.epub_writer import EpubException, CompressionPolicy
+from source.image_store import ImageStore
+from source.image_optimizer import ImageOptimizer
+from source.payload_store import PayloadStore
+from source.volumes import VolumePolicy
+from source.catalog import Catalog
+
+class BookResult:
+    '''How building one book of a batch went'''
+    def __init__(self, book_id: str, save_name: str|None = None, error: str|None = None, seconds: float = 0.0) -> None:
+        self.book_id = book_id
+        self.save_name = save_name
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+def read_ids(lines: Iterable[str]) -> list[str]:
+    '''Fiction ids, one per line, in order and without repeats.
+    Blank lines and # comments are skipped, and fiction URLs reduced to their id.'''
+    ids: dict[str, None] = {}
+    for line in lines:
+        line = line.partition('#')[0].strip()
+        if line == '':
+            continue
+        if 'fiction/' in line:
+            line = line.partition('fiction/')[2].partition('/')[0]
+        ids.setdefault(line)
+    return list(ids)
+
+def download_books(book_ids: list[str],
+                   books: int = 2,
+                   workers: int = 1,
+                   image_workers: int = 4,
+                   streaming: bool = False,
+                   image_store: ImageStore|None = None,
+                   pretty: bool = False,
+                   work_dir: str|None = None,
+                   optimizer: ImageOptimizer|None = None,
+                   compression: CompressionPolicy|None = None,
+                   transformer: ChapterTransformer|None = None,
+                   payload_store: PayloadStore|None = None,
+                   volumes: VolumePolicy|None = None,
+                   catalog: Catalog|None = None,
+                   on_event: Callable[[Event], None]|None = None,
+                   cancel: CancelToken|None = None,
+                   timeout: float|None = None
+            ) -> list[BookResult]:
+    '''Downloads each book, up to books of them at once. All of them share one pool
+    of workers for chapters and one of image_workers for images, so the budget holds
+    however many books are running. A book that fails, or takes longer than timeout
+    seconds, doesn't stop the others; cancelling cancel stops them all.
+    Images are only shared between the books through image_store, if given.
+    Events from every book go to on_event. Results are in the order of book_ids.'''
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as chapter_executor, \
+         ThreadPoolExecutor(max_workers=max(1, image_workers)) as image_executor, \
+         ThreadPoolExecutor(max_workers=max(1, books)) as book_executor:
+
+        def build(book_id: str) -> BookResult:
+            start = time.perf_counter()
+            try:
+                save_name = download_book(book_id, on_event, CancelToken(timeout, parent=cancel),
+                                          streaming=streaming, image_store=image_store,
+                                          pretty=pretty, workers=workers, chapter_executor=chapter_executor,
+                                          image_executor=image_executor, work_dir=work_dir,
+                                          optimizer=optimizer, compression=compression,
+                                          transformer=transformer, payload_store=payload_store,
+                                          volumes=volumes, catalog=catalog)
+            except ConnectionError as c_e:
+                error = str(c_e.args[0])
+            except RuntimeError:
+                error = 'The story does not exist'
+            except (LocalizedException, EpubException, Cancelled) as issue:
+                error = str(issue.args[0]) if issue.args else type(issue).__name__
+            except Exception as issue:
+                error = type(issue).__name__ + ': ' + str(issue)
+                # One broken page shouldn't cost the rest of the night's books.
+            else:
+                return BookResult(book_id, save_name, seconds=time.perf_counter() - start)
+            print('Failed', book_id + ':', error)
+            return BookResult(book_id, error=error, seconds=time.perf_counter() - start)
+
+        return list(book_executor.map(build, book_ids))
@@ -0,0 +1,190 @@
+'''A catalog of the epubs in a library directory, kept in SQLite, so books can be
+listed and looked up without opening every archive'''
+import os
+import sqlite3
+import zipfile
+import threading
+from typing import Any, Callable
+from source.epub_reader import EpubSummary
+from source.epub_writer import EpubException
+
+_SCHEMA = '''CREATE TABLE IF NOT EXISTS books (
+    path TEXT PRIMARY KEY,
+    book_id TEXT NOT NULL,
+    volume INTEGER,
+    title TEXT NOT NULL,
+    author TEXT,
+    chapters INTEGER NOT NULL,
+    date_updated TEXT,
+    size INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    content_hash TEXT NOT NULL
+)'''
+
+_COLUMNS = 'path, book_id, volume, title, author, chapters, date_updated, size, modified, content_hash'
+
+SORT_KEYS = {
+    'title': 'title COLLATE NOCASE, volume',
+    'author': 'author COLLATE NOCASE, title COLLATE NOCASE, volume',
+    'id': 'CAST(book_id AS INTEGER), volume',
+    'updated': 'date_updated, title COLLATE NOCASE, volume',
+    'chapters': 'chapters',
+    'size': 'size',
+}
+# What find() can sort by.
+
+class CatalogEntry:
+    '''One epub in the catalog'''
+    def __init__(self,
+                 path: str,
+                 book_id: str,
+                 volume: int|None,
+                 title: str,
+                 author: str|None,
+                 chapters: int,
+                 date_updated: str|None,
+                 size: int,
+                 modified: float,
+                 content_hash: str
+            ) -> None:
+        self.path = path                   # Relative to the catalog's directory
+        self.book_id = book_id
+        self.volume = volume               # Its number, if it is a volume of a longer book
+        self.title = title
+        self.author = author
+        self.chapters = chapters
+        self.date_updated = date_updated   # YYYY-MM-DD of the latest chapter
+        self.size = size                   # Bytes
+        self.modified = modified           # Modification time of the file when it was read
+        self.content_hash = content_hash   # See EpubSummary
+
+    def row(self) -> tuple[Any, ...]:
+        return (self.path, self.book_id, self.volume, self.title, self.author, self.chapters,
+                self.date_updated, self.size, self.modified, self.content_hash)
+
+class Catalog:
+    '''The epubs in the directory holding the catalog file at path. The downloader
+    records each epub it writes, and reindex() catches up with epubs that were added,
+    changed or deleted some other way. Only content.opf is read from each epub.
+    One catalog can be shared by every book in a batch.'''
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        # Shared between threads under _lock.
+        with self._lock, self._connection:
+            self._connection.execute(_SCHEMA)
+
+    @property
+    def indexed(self) -> bool:
+        '''Whether reindex() has run, so epubs that were in the directory before the
+        catalog are in it too'''
+        with self._lock:
+            return bool(self._connection.execute('PRAGMA user_version').fetchone()[0])
+
+    def record(self, epub_path: str) -> CatalogEntry:
+        '''Adds the epub at epub_path, or brings its entry up to date'''
+        summary = EpubSummary(epub_path)
+        stat = os.stat(epub_path)
+        entry = CatalogEntry(self._relative(epub_path), summary.book_id, summary.volume, summary.title,
+                             summary.author, summary.chapters, summary.date_updated, stat.st_size,
+                             stat.st_mtime, summary.content_hash)
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO books (' + _COLUMNS + ') VALUES ('
+                                     + ', '.join('?' * len(entry.row())) + ')', entry.row())
+        return entry
+
+    def forget(self, epub_path: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM books WHERE path = ?', (self._relative(epub_path),))
+
+    def reindex(self, full: bool = False,
+                on_error: Callable[[str, Exception], None]|None = None
+            ) -> tuple[int, int, int]:
+        '''Brings the catalog in line with the epubs in its directory: reads those
+        that are new, or whose size or modification time changed (all of them if
+        full), and forgets those that are gone. Files that can't be read as epubs
+        made by this tool are passed to on_error and left out.
+        Returns how many epubs were read, left as they were, and forgotten.'''
+        known = {entry.path: entry for entry in self.find()}
+        read = unchanged = 0
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.epub') or not os.path.isfile(path):
+                continue
+            entry = known.pop(name, None)
+            stat = os.stat(path)
+            if not full and entry is not None and entry.size == stat.st_size and entry.modified == stat.st_mtime:
+                unchanged += 1
+                continue
+            try:
+                self.record(path)
+                read += 1
+            except (OSError, zipfile.BadZipFile, EpubException) as issue:
+                if entry is not None:
+                    self.forget(path)
+                if on_error is not None:
+                    on_error(path, issue)
+        for gone in known:
+            self.forget(os.path.join(self.directory, gone))
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA user_version = 1')
+        return read, unchanged, len(known)
+
+    def unlisted(self) -> list[str]:
+        '''Paths of the epubs in the directory that aren't in the catalog: added by
+        hand since the last reindex(), or unreadable when it ran'''
+        with self._lock:
+            known = {row[0] for row in self._connection.execute('SELECT path FROM books')}
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.endswith('.epub') and name not in known and os.path.isfile(os.path.join(self.directory, name))]
+
+    def find(self,
+             title: str|None = None,
+             author: str|None = None,
+             book_id: str|None = None,
+             updated_since: str|None = None,
+             sort: str = 'title',
+             descending: bool = False
+        ) -> list[CatalogEntry]:
+        '''Entries whose title or author contain the given text (ignoring case), of
+        book_id, and with chapters released on or after updated_since (YYYY-MM-DD),
+        sorted by one of SORT_KEYS.'''
+        if sort not in SORT_KEYS:
+            raise ValueError('Unable to sort by ' + sort)
+        conditions: list[str] = []
+        values: list[str] = []
+        if title is not None:
+            conditions.append("title LIKE ? ESCAPE '\\'")
+            values.append('%' + _escape_like(title) + '%')
+        if author is not None:
+            conditions.append("author LIKE ? ESCAPE '\\'")
+            values.append('%' + _escape_like(author) + '%')
+        if book_id is not None:
+            conditions.append('book_id = ?')
+            values.append(book_id)
+        if updated_since is not None:
+            conditions.append('date_updated >= ?')
+            values.append(updated_since)
+        order = ', '.join(key + (' DESC' if descending else '') for key in SORT_KEYS[sort].split(', '))
+        query = ('SELECT ' + _COLUMNS + ' FROM books'
+                 + ('' if len(conditions) == 0 else ' WHERE ' + ' AND '.join(conditions))
+                 + ' ORDER BY ' + order + ', path')
+        with self._lock:
+            rows = self._connection.execute(query, values).fetchall()
+        return [CatalogEntry(*row) for row in rows]
+
+    def locate(self, entry: CatalogEntry) -> str:
+        '''The path of an entry's epub'''
+        return os.path.join(self.directory, entry.path)
+
+    def _relative(self, epub_path: str) -> str:
+        return os.path.relpath(os.path.abspath(epub_path), self.directory)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+def _escape_like(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
@@ -0,0 +1,133 @@
+'''Reads back the epubs EpubWriter makes, so they can be updated in place'''
+import re
+import hashlib
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from source.epub_writer import EpubException
+
+_NS = {
+    'opf': 'http://www.idpf.org/2007/opf',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'ncx': 'http://www.daisy.org/z3986/2005/ncx/',
+    'xhtml': 'http://www.w3.org/1999/xhtml',
+}
+
+class ExistingItem:
+    '''A manifest entry of an existing epub'''
+    def __init__(self, idref: str, href: str, media_type: str) -> None:
+        self.idref = idref
+        self.href = href
+        self.media_type = media_type
+
+    def get_short_name(self) -> str:
+        return posixpath.splitext(self.href)[0]
+
+    def get_ext(self) -> str:
+        return posixpath.splitext(self.href)[1]
+
+def _read_opf(epub_file: zipfile.ZipFile, path: str) -> ET.Element:
+    try:
+        return ET.fromstring(epub_file.read('OEBPS/content.opf'))
+    except (KeyError, ET.ParseError) as issue:
+        raise EpubException('Not an epub made by this tool', path) from issue
+
+def _identify(opf: ET.Element) -> tuple[str, int|None]:
+    '''The book id in content.opf, and its volume number if it is a volume.
+    A volume of a book split by source.volumes has the book's id + '-vol' + volume.'''
+    identifier = opf.findtext('opf:metadata/dc:identifier', default='', namespaces=_NS)
+    book_id = identifier.strip().removeprefix('ID:')
+    volume = re.fullmatch(r'(.+)-vol(\d+)', book_id)
+    if volume is not None:
+        return volume[1], int(volume[2])
+    return book_id, None
+
+def _fingerprint(opf: ET.Element) -> str|None:
+    for meta in opf.iterfind('opf:metadata/opf:meta', _NS):
+        if meta.attrib.get('name') == 'rrdownloader:fingerprint':
+            return meta.attrib.get('content')
+    return None
+
+class EpubReader:
+    '''Indexes the chapters and images of an epub from its content.opf and toc.ncx'''
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._epub_file = zipfile.ZipFile(path, 'r')
+        opf = _read_opf(self._epub_file, path)
+
+        self.book_id, self.volume = _identify(opf)
+        self.fingerprint = _fingerprint(opf)
+        self.book_name = opf.findtext('opf:metadata/dc:title', default='', namespaces=_NS)
+
+        self._items: dict[str, ExistingItem] = {}
+        for element in opf.iterfind('opf:manifest/opf:item', _NS):
+            self._items[element.attrib['id']] = ExistingItem(
+                element.attrib['id'], element.attrib['href'], element.attrib.get('media-type', ''))
+
+        nav_text: dict[str, str] = {}
+        if 'ncx' in self._items:
+            ncx = ET.fromstring(self._epub_file.read('OEBPS/' + self._items['ncx'].href))
+            for nav_point in ncx.iterfind('.//ncx:navPoint', _NS):
+                content = nav_point.find('ncx:content', _NS)
+                if content is not None:
+                    nav_text[content.attrib['src']] = nav_point.findtext(
+                        'ncx:navLabel/ncx:text', default='', namespaces=_NS)
+
+        self.chapters: dict[str, tuple[str, ExistingItem]] = {}
+        # sanitized name -> (chapter name, manifest entry), in spine order
+        for itemref in opf.iterfind('opf:spine/opf:itemref', _NS):
+            idref = itemref.attrib['idref']
+            if idref.startswith('CHAPTER') and idref in self._items:
+                item = self._items[idref]
+                self.chapters[item.get_short_name()] = (nav_text.get(item.href, ''), item)
+
+        self.images: dict[str, ExistingItem] = {
+            item.href: item for item in self._items.values() if item.idref.startswith('img')
+        }
+
+    def read(self, item: ExistingItem) -> bytes:
+        return self._epub_file.read('OEBPS/' + item.href)
+
+    def author_info(self) -> tuple[str|None, ExistingItem|None]:
+        '''The author's bio and image, from the epub's author's page'''
+        if 'author' not in self._items:
+            return None, None
+        try:
+            page = ET.fromstring(self.read(self._items['author']))
+        except ET.ParseError:
+            return None, None
+        bio = page.find(".//xhtml:div[@class='author-description']", _NS)
+        image = page.find('.//xhtml:img', _NS)
+        return (None if bio is None else ''.join(bio.itertext()),
+                None if image is None else self.images.get(image.attrib.get('src', '')))
+
+    def referenced_images(self, chapter_data: str) -> list[ExistingItem]:
+        '''The existing images a chapter's xhtml points to'''
+        return [self.images[src] for src in re.findall(r'src="([^"]+)"', chapter_data)
+                if src in self.images]
+
+    def close(self) -> None:
+        self._epub_file.close()
+
+class EpubSummary:
+    '''What an epub's content.opf says about it, read without the rest of the book'''
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with zipfile.ZipFile(path, 'r') as epub_file:
+            opf = _read_opf(epub_file, path)
+            entries = epub_file.infolist()
+        self.book_id, self.volume = _identify(opf)
+        self.fingerprint = _fingerprint(opf)
+        self.title = opf.findtext('opf:metadata/dc:title', default='', namespaces=_NS)
+        self.author = opf.findtext('opf:metadata/dc:creator', namespaces=_NS)
+        self.date_updated = opf.findtext('opf:metadata/dc:date', namespaces=_NS)
+        self.chapters = sum(1 for itemref in opf.iterfind('opf:spine/opf:itemref', _NS)
+                            if itemref.attrib.get('idref', '').startswith('CHAPTER'))
+        digest = hashlib.sha256()
+        for entry in entries:
+            if entry.filename != 'OEBPS/content.opf':
+                digest.update((entry.filename + '\0' + format(entry.CRC, '08x') + '\0'
+                               + str(entry.file_size) + '\n').encode('UTF-8'))
+        self.content_hash = digest.hexdigest()
+        # Of the checksums the zip keeps of each entry, so only content.opf is read. It is
+        # left out, as it holds the time the epub was made; the same book hashes the same.
@@ -1,13 +1,22 @@
 '''TODO: replace with dedicated package someone else spent effort working on'''
+import io
+import os
 import sys
 import abc
-from typing import TextIO, Callable, Iterator
+import time
+import zlib
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TextIO, IO, Callable, Iterator
 import zipfile
 import re
-from datetime import datetime
-from xml.sax.saxutils import escape
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape, quoteattr
 from typing_extensions import Self
-from bs4 import BeautifulSoup as bs, NavigableString
+from source.templates import load_text, template
+from source.profiler import stage
+from source.payload_store import Payload, PayloadStore, in_memory
 
 def _parse_mediatype(ext: str) -> str:
     if ext == '.xhtml':
@@ -15,22 +24,20 @@ def _parse_mediatype(ext: str) -> str:
     elif ext == '.png':
         return 'image/png'
     elif ext == '.gif':
-        return '"image/gif'
+        return 'image/gif'
+    elif ext == '.webp':
+        return 'image/webp'
     elif ext == '.svg':
         return 'image/svg+xml'
     elif ext == '.css':
         return 'text/css'
     elif ext == '.ncx':
         return 'application/x-dtbncx+xml'
+    elif ext == '.opf':
+        return 'application/oebps-package+xml'
     else: # Assume JPG otherwise
         return 'image/jpeg'
 
-def _from_file(name: str) -> str:
-    result = None
-    with open('./assets/' + name, mode="r", encoding="UTF-8") as stream:
-        result = stream.read()
-    return result
-
 class EpubException(Exception):
     '''Raised when parsing invalid source template files'''
     pass
@@ -110,17 +117,63 @@ class _EpubResourceManifests(metaclass=abc.ABCMeta):
             return ''
         return '<itemref idref="' + self.get_idref() + '"/>'
 
+    def depends_on_items(self) -> bool:
+        '''True if the data describes the other items, so can only be written last'''
+        return False
+
+    def write_data(self, stream: IO[bytes]) -> None:
+        '''Writes the data to an open zip entry. Items with large generated data
+        override this to stream it instead of building it in memory.'''
+        data = self.get_data()
+        stream.write(data.encode('UTF-8') if isinstance(data, str) else data)
+
+    def is_spilled(self) -> bool:
+        '''True if the data waits on disk, so is best streamed into the zip (see PayloadStore)'''
+        return False
+
+    def release(self) -> None:
+        '''Called once the data is written, so any memory it holds can be given back'''
+
+class _ItemRecord(_EpubResourceManifests):
+    '''The manifest details of an item whose data was already written out'''
+    def __init__(self, item: _EpubResourceManifests) -> None:
+        super().__init__()
+        self._spine_priority = item.get_spine_priority()
+        self._nav_text = item.get_nav_text()
+        self._ext = item.get_ext()
+        self._idref = item.get_idref()
+        self._short_name = item.get_short_name()
+        self._additional_props = item.get_additional_props()
+
+    def get_spine_priority(self) -> int:
+        return self._spine_priority
+
+    def get_nav_text(self) -> str:
+        return self._nav_text
+
+    def get_ext(self) -> str:
+        return self._ext
+
+    def get_idref(self) -> str:
+        return self._idref
+
+    def get_short_name(self) -> str:
+        return self._short_name
+
+    def get_additional_props(self) -> str:
+        return self._additional_props
+
+    def get_data(self) -> str|bytes:
+        raise EpubException('Data already written', self.get_name())
+
 class _ItemGroup:
     def __init__(self) -> None:
         self._item_dict: dict[int, list[_EpubResourceManifests]] = {}
-        self.strat: Callable[[_EpubResourceManifests], bool] = lambda _: True
 
-    def list_with_strat(self, strat: Callable[[_EpubResourceManifests], bool]) -> list[_EpubResourceManifests]:
-        self.strat = strat
-        result = list(self)
-        self.strat = lambda _: True
-        return result
-    
+    def filtered(self, strat: Callable[[_EpubResourceManifests], bool]) -> Iterator[_EpubResourceManifests]:
+        '''The items strat accepts, in priority order. Safe to nest and repeat.'''
+        return (item for item in self if strat(item))
+
     def append(self, item: _EpubResourceManifests) -> None:
         pri = item.get_spine_priority()
         if pri not in self._item_dict:
@@ -131,15 +184,19 @@ class _ItemGroup:
         priorities = list(self._item_dict.keys())
         priorities.sort()
         for key in priorities: # iterate in priority order
-            for item in self._item_dict[key]:
-                if self.strat(item):
-                    yield item
+            yield from self._item_dict[key]
 
 class EpubImage(_EpubResourceManifests):
-    '''Represents an image to be added to an epub'''
-    def __init__(self, data: str|bytes, ext: str, identity: str) -> None:
+    '''Represents an image to be added to an epub. With a store, the data is kept
+    there until written, rather than in memory.'''
+    def __init__(self, data: str|bytes|Payload, ext: str, identity: str, store: PayloadStore|None = None) -> None:
         super().__init__()
-        self._data = data
+        if isinstance(data, str):
+            data = data.encode('UTF-8')
+        self._shared = isinstance(data, Payload)
+        # Another image owns a shared payload, and releases it.
+        self._payload: Payload = data if isinstance(data, Payload) else \
+            in_memory(data) if store is None else store.put(data)
         self._ext = ext
         self._identity = identity
 
@@ -159,16 +216,34 @@ class EpubImage(_EpubResourceManifests):
         return 0
 
     def get_data(self) -> str|bytes:
-        return self._data
+        return self._payload.read()
+
+    def write_data(self, stream: IO[bytes]) -> None:
+        self._payload.copy_to(stream)
+
+    def is_spilled(self) -> bool:
+        return self._payload.spilled
+
+    def release(self) -> None:
+        if not self._shared:
+            self._payload.release()
+
+    def share(self) -> 'EpubImage':
+        '''The same image as another item, e.g. to add to several volumes.
+        Its data stays this one's to release.'''
+        return EpubImage(self._payload, self._ext, self._identity)
 
 class EpubChapter(_EpubResourceManifests):
-    '''Represents a chapter to be added to an epub'''
-    def __init__(self, name: str, sanitized_name: str, place: int, contents: str) -> None:
+    '''Represents a chapter to be added to an epub. With a store, the contents are
+    kept there until written, rather than in memory.'''
+    def __init__(self, name: str, sanitized_name: str, place: int, contents: str,
+                 store: PayloadStore|None = None) -> None:
         super().__init__()
         self._name = name
         self._sanitized_name = sanitized_name
         self._place = place
-        self._contents = contents
+        data = contents.encode('UTF-8')
+        self._payload: Payload = in_memory(data) if store is None else store.put(data)
 
     def get_spine_priority(self) -> int:
         return 4
@@ -186,7 +261,16 @@ class EpubChapter(_EpubResourceManifests):
         return 'CHAPTER' + self._sanitized_name
 
     def get_data(self) -> str|bytes:
-        return self._contents
+        return self._payload.read()
+
+    def write_data(self, stream: IO[bytes]) -> None:
+        self._payload.copy_to(stream)
+
+    def is_spilled(self) -> bool:
+        return self._payload.spilled
+
+    def release(self) -> None:
+        self._payload.release()
 
     def get_raw_name(self) -> str:
         return self._name
@@ -195,10 +279,7 @@ class TableOfContents(_EpubResourceManifests):
     '''Represents the TOC to be added to an epub'''
     def __init__(self) -> None:
         super().__init__()
-        soup = bs(_from_file('toc.xhtml'), 'html.parser')
-        if soup.ol is None:
-            raise EpubException('invalid toc')
-        self._toc_soup: bs = soup
+        self._entries: list[str] = []
 
     def get_nav_text(self) -> str:
         return 'Table of Contents'
@@ -216,31 +297,22 @@ class TableOfContents(_EpubResourceManifests):
         return 'toc'
 
     def get_data(self) -> str|bytes:
-        return self._toc_soup.prettify()
+        return template('toc.xhtml').render(chapters=''.join(self._entries))
 
     def get_additional_props(self) -> str:
         return 'properties="nav"'
 
     def push_chapter(self, chapter: EpubChapter) -> None:
-        chapter_tag = self._toc_soup.new_tag('li')
-        chapter_link_tag = self._toc_soup.new_tag('a', href=chapter.get_name())
-        chapter_link_tag.append(chapter.get_raw_name())
-        chapter_tag.append(chapter_link_tag)
-        self._toc_soup.ol.append('\n') # type: ignore[union-attr]
-        self._toc_soup.ol.append(chapter_tag) # type: ignore[union-attr]
+        self._entries.append('\n    <li><a href=' + quoteattr(chapter.get_name()) + '>'
+                             + escape(chapter.get_raw_name()) + '</a></li>')
 
 class EpubCover(_EpubResourceManifests):
     '''cover'''
     def __init__(self, img: str|None, book_name: str) -> None:
         super().__init__()
-        cover_soup = bs(_from_file('cover.xhtml'), 'html.parser')
-        if cover_soup.img is None:
-            raise EpubException('bad cover.xhtml')
-        if img is not None:
-            cover_soup.img.attrs['src'] = img
-        else:
-            cover_soup.img.decompose()
-        self._data = cover_soup.prettify()
+        self._data = template('cover.xhtml').render(
+            image='' if img is None else '<img src=' + quoteattr(img) + ' alt="Cover Art" />'
+        )
         self._book_name = book_name
 
     def get_nav_text(self) -> str:
@@ -264,39 +336,14 @@ class EpubCover(_EpubResourceManifests):
 class _EpubAuthorPage(_EpubResourceManifests):
     def __init__(self, book_name: str, author: str|None, author_bio: str|None, author_image: str|None) -> None:
         super().__init__()
-        self._index_soup = index_soup = bs(_from_file('index.xhtml'), 'html.parser')
-        index_title = index_soup.title
-        index_mouseover = index_soup.find('div', class_="book")
-        index_bold = index_soup.find('strong')
-        index_img = index_soup.img
-        index_header =index_soup.find('h2')
-        desc_soup = index_soup.find('div', class_="author-description")
-        if ((index_img is None) or
-            (index_title is None) or
-            (index_mouseover is None) or (isinstance(index_mouseover, NavigableString)) or
-            (index_bold is None) or (isinstance(index_bold, NavigableString)) or
-            (desc_soup is None) or (isinstance(desc_soup, NavigableString)) or
-            (index_header is None) or (isinstance(index_header, NavigableString))):
-            raise EpubException('invalid index.xhtml')
-
-        index_title.string = book_name
-        index_mouseover.attrs['title'] = book_name
-        index_bold.string = book_name
-
-        if author is None:
-            index_header.decompose()
-        else:
-            index_header.string = "By: " + author
-
-        if author_bio is None:
-            desc_soup.decompose()
-        else:
-            desc_soup.string = author_bio
-
-        if author_image is None:
-            index_img.decompose()
-        else:
-            index_img.attrs['src'] = author_image
+        self._data = template('index.xhtml').render(
+            book_name=escape(book_name, {'"': '&quot;'}),
+            author='' if author is None else '<h2>By: ' + escape(author) + '</h2>',
+            author_bio='' if author_bio is None
+                else '<div class="author-description">' + escape(author_bio) + '</div>',
+            author_image='' if author_image is None
+                else '<img src=' + quoteattr(author_image) + ' alt="Cover Art" />'
+        )
 
     def get_nav_text(self) -> str:
         return 'About Author'
@@ -314,7 +361,7 @@ class _EpubAuthorPage(_EpubResourceManifests):
         return 'author'
 
     def get_data(self) -> str|bytes:
-        return self._index_soup.prettify()
+        return self._data
 
 class _EpubNcx(_EpubResourceManifests):
     '''toc.ncx indicates the proper order of the book'''
@@ -325,18 +372,30 @@ class _EpubNcx(_EpubResourceManifests):
         self._items = items
         self._book_id = book_id
 
-    def get_data(self) -> str|bytes:
-        ncx_addition = ''
+    def _nav_points(self) -> Iterator[str]:
         play_order = 1
-        for item in self._items.list_with_strat(lambda item: item.get_spine_priority() != 0):
-            ncx_addition += item.get_nav(play_order) + '\n '
+        for item in self._items.filtered(lambda item: item.get_spine_priority() != 0):
+            yield item.get_nav(play_order) + '\n '
             play_order += 1
 
-        return _from_file('toc_template.ncx').format(
-                                    book_num = self._book_id,
-                                    book_name = self._book_name,
-                                    author = self._author,
-                                    ncx_chapter_string = ncx_addition)
+    def _render_to(self, stream: TextIO) -> None:
+        template('toc_template.ncx').render_to(stream,
+                                    book_num = escape(self._book_id, {'"': '&quot;'}),
+                                    book_name = escape(self._book_name),
+                                    author = escape(self._author),
+                                    ncx_chapter_string = self._nav_points())
+
+    def get_data(self) -> str|bytes:
+        result = io.StringIO()
+        self._render_to(result)
+        return result.getvalue()
+
+    def write_data(self, stream: IO[bytes]) -> None:
+        with io.TextIOWrapper(stream, encoding='UTF-8', newline='') as text:
+            self._render_to(text)
+
+    def depends_on_items(self) -> bool:
+        return True
 
     def get_spine_priority(self) -> int:
         return 0 # no nav
@@ -362,8 +421,12 @@ class _EpubOpf(_EpubResourceManifests):
                  items: _ItemGroup,
                  description: str|None,
                  updated_date: str,
+                 modified: float,
+                 extra_metadata: str = ''
             ) -> None:
         super().__init__()
+        self._modified = modified
+        self._extra_metadata = extra_metadata
         self._author = '' if author is None else author
         self._description = '' if description is None else description
         self._date_updated = updated_date
@@ -371,25 +434,32 @@ class _EpubOpf(_EpubResourceManifests):
         self._items = items
         self._book_num = book_id
 
-    def get_data(self) -> str|bytes:
-        spine_addition = ''
-        for item in self._items.list_with_strat(lambda item: item.get_spine_priority() != 0):
-            spine_addition += item.get_spine() + '\n '
-        manifest_addition = ''
-        for item in self._items:
-            manifest_addition += item.get_manifest() + '\n '
-
-        return _from_file('content_template.opf').format(
-                                    book_name = self._book_name,
-                                    author = self._author,
-                                    description = self._description,
-                                    date_updated = self._date_updated,
-                                    date = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
-                                    manifest_chapter_string = manifest_addition,
-                                    spine_string = spine_addition,
-                                    book_num = self._book_num
+    def _render_to(self, stream: TextIO) -> None:
+        template('content_template.opf').render_to(stream,
+                                    book_name = escape(self._book_name),
+                                    author = escape(self._author),
+                                    description = escape(self._description),
+                                    date_updated = escape(self._date_updated),
+                                    date = datetime.fromtimestamp(self._modified, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                                    manifest_chapter_string = (item.get_manifest() + '\n ' for item in self._items),
+                                    spine_string = (item.get_spine() + '\n ' for item in self._items.filtered(
+                                        lambda item: item.get_spine_priority() != 0)),
+                                    book_num = escape(self._book_num),
+                                    extra_metadata = self._extra_metadata
                                  )
 
+    def get_data(self) -> str|bytes:
+        result = io.StringIO()
+        self._render_to(result)
+        return result.getvalue()
+
+    def write_data(self, stream: IO[bytes]) -> None:
+        with io.TextIOWrapper(stream, encoding='UTF-8', newline='') as text:
+            self._render_to(text)
+
+    def depends_on_items(self) -> bool:
+        return True
+
     def get_spine_priority(self) -> int:
         return 0
 
@@ -408,7 +478,7 @@ class _EpubOpf(_EpubResourceManifests):
 class EpubStyle(_EpubResourceManifests):
 
     def get_data(self) -> str:
-        return _from_file("RRStyle.css")
+        return load_text('RRStyle.css')
 
     def get_spine_priority(self) -> int:
         return 0
@@ -425,48 +495,191 @@ class EpubStyle(_EpubResourceManifests):
     def get_short_name(self) -> str:
         return 'Styles/RRStyle'
 
+class CompressionPolicy:
+    '''How each entry of the epub is compressed, by media type. Formats that are
+    compressed already (most images) are stored, as deflating them again costs
+    time and saves nothing; everything else is deflated at level (0-9).'''
+    def __init__(self,
+                 level: int = 6,
+                 stored: tuple[str, ...] = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+            ) -> None:
+        self.level = level
+        self.stored = stored
+
+    def compress_type(self, media_type: str) -> int:
+        return zipfile.ZIP_STORED if media_type in self.stored or self.level == 0 else zipfile.ZIP_DEFLATED
+
+    def compressed_size(self, ext: str, data: bytes) -> int:
+        '''Bytes data takes in the zip, as an item with extension ext'''
+        if self.compress_type(_parse_mediatype(ext)) == zipfile.ZIP_STORED:
+            return len(data)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return len(compressor.compress(data)) + len(compressor.flush())
+
+def _compress(data: bytes, compress_type: int, level: int) -> tuple[bytes, int]:
+    '''data as it goes in a zip entry, and its CRC. Runs on the compression pool;
+    zlib releases the GIL, so entries really are compressed in parallel.'''
+    with stage('compress') as span:
+        span.bytes = len(data)
+        crc = zlib.crc32(data)
+        if compress_type == zipfile.ZIP_STORED:
+            return data, crc
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        # Raw deflate, as zipfile writes it.
+        return compressor.compress(data) + compressor.flush(), crc
+
+def _write_raw(epub_file: zipfile.ZipFile, entry: zipfile.ZipInfo, data: bytes) -> None:
+    '''Appends entry, whose file_size, compress_size and CRC are set, holding data
+    compressed already, as writestr() would after compressing it'''
+    with epub_file._lock: # type: ignore[attr-defined]
+        epub_file._writecheck(entry) # type: ignore[attr-defined]
+        epub_file._didModify = True # type: ignore[attr-defined]
+        entry.header_offset = epub_file.fp.tell() # type: ignore[union-attr]
+        epub_file.fp.write(entry.FileHeader()) # type: ignore[union-attr]
+        epub_file.fp.write(data) # type: ignore[union-attr]
+        epub_file.filelist.append(entry)
+        epub_file.NameToInfo[entry.filename] = entry
+        epub_file.start_dir = epub_file.fp.tell() # type: ignore[union-attr]
+
+def _raw_entries_work() -> bool:
+    '''Whether _write_raw works with this Python's zipfile. zipfile has no public way
+    to write an entry that is compressed already, so _write_raw relies on its
+    internals; this writes a small zip with it and with writestr(), and checks they
+    read back and come out the same, so that a zipfile that has changed is found
+    out here rather than in a broken epub.'''
+    data = b'All work and no play. ' * 64
+    def build(raw: bool) -> bytes:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                entry = zipfile.ZipInfo(str(compress_type), (1980, 1, 1, 0, 0, 0))
+                entry.compress_type = compress_type
+                entry.external_attr = 0o600 << 16
+                if raw:
+                    compressed, entry.CRC = _compress(data, compress_type, 6)
+                    entry.file_size = len(data)
+                    entry.compress_size = len(compressed)
+                    _write_raw(archive, entry, compressed)
+                else:
+                    archive.writestr(entry, data)
+            archive.writestr('after', data)
+        with zipfile.ZipFile(buffer) as archive:
+            if archive.testzip() is not None or any(archive.read(name) != data for name in archive.namelist()):
+                raise zipfile.BadZipFile('Entries read back wrong')
+        return buffer.getvalue()
+    try:
+        return build(True) == build(False)
+    except Exception:
+        return False
+
+_RAW_ENTRIES = _raw_entries_work()
+# Otherwise, entries are compressed by ZipFile as they are written.
+
+_building: set[str] = set()
+# Paths of the epubs being built in this process, so that books of a batch
+# with the same title don't write the same .part file.
+_building_lock = threading.Lock()
+
+def _reserve(save_name: str) -> bool:
+    '''Claims save_name for one build in this process; False if another has it'''
+    with _building_lock:
+        path = os.path.abspath(save_name)
+        if path in _building:
+            return False
+        _building.add(path)
+        return True
+
+def _release(save_name: str) -> None:
+    with _building_lock:
+        _building.discard(os.path.abspath(save_name))
+
+def epub_name(book_name: str) -> str:
+    '''The file name EpubWriter.create() gives a book, unless that is taken'''
+    return re.sub(
+        r"""['"{}\/\\<>`!@#$%&*\-_+\s|?=:]+""",
+        ' ',
+        book_name,
+        1000000
+    ) + '.epub'
+
 class EpubWriter:
-    '''writes epubs'''
-    def __init__(self, book_name: str, log: TextIO = sys.stdout) -> None:
+    '''writes epubs. When streaming, items are written to the file as soon as
+    they are pushed, and only their manifest details are kept until complete().
+    modified (seconds since the epoch, defaults to now) dates the book and its
+    zip entries, so the same contents and modified always give the same bytes.
+    Entries are compressed per compression's policy on compress_workers threads
+    (on the writing thread, where _write_raw doesn't work; see _raw_entries_work),
+    and written in the order they were pushed.'''
+    def __init__(self, book_name: str, log: TextIO = sys.stdout, streaming: bool = False,
+                 modified: float|None = None, compression: CompressionPolicy|None = None,
+                 compress_workers: int|None = None) -> None:
         self.log = log
         self.book_name = book_name
+        self.streaming = streaming
+        self.modified = time.time() if modified is None else modified
+        self.compression = CompressionPolicy() if compression is None else compression
         self._epub_file: zipfile.ZipFile
-        self._toc = TableOfContents()
+        self._created = False
+        self._completed = False
+        self._save_name: str|None = None
         self._item_group = _ItemGroup()
-
-    def create(self) -> str:
-        '''Create the epub file'''
+        self._compress_workers = (os.cpu_count() or 1) if compress_workers is None else max(1, compress_workers)
+        self._compressor: ThreadPoolExecutor|None = None
+        self._compressing: deque[tuple[zipfile.ZipInfo, int, Future[tuple[bytes, int]]]] = deque()
+        # Entries being compressed, in the order they will be written; (entry, size, compression)
+
+    def create(self, replace: str|None = None) -> str:
+        '''Create the epub file. It is built as save_name + '.part', and only
+        renamed to save_name once complete, so an interrupted build never looks
+        like a finished book. If replace is given, that is the save_name.
+        Otherwise, if another book with the same name is being built in this
+        process, a number is added to the name.'''
         i = 0
         save_name: str
-        sanitized_name = re.sub(
-            r"""['"{}\/\\<>`!@#$%&*\-_+\s|?=:]+""",
-            ' ',
-            self.book_name,
-            1000000
-        )
+        sanitized_name = epub_name(self.book_name)[:-len('.epub')]
         initialized_file = None
+        if replace is not None:
+            save_name = replace
+            if not _reserve(save_name):
+                raise EpubException(save_name + ' is already being built', save_name)
+            try:
+                initialized_file = self._epub_file = zipfile.ZipFile(
+                    save_name + '.part',
+                    'w',
+                    compression=zipfile.ZIP_DEFLATED,
+                    compresslevel=self.compression.level
+                )
+            except OSError:
+                _release(save_name)
+                raise
         while initialized_file is None:
+            if i == 0 :
+                save_name = sanitized_name + ".epub"
+            else:
+                save_name = sanitized_name+str(i) + ".epub"
+            if not _reserve(save_name):
+                i += 1
+                continue
             try:
-                if i == 0 :
-                    save_name = sanitized_name + ".epub"
-                else:
-                    save_name = sanitized_name+str(i) + ".epub"
                 initialized_file = self._epub_file = zipfile.ZipFile(
-                    save_name,
+                    save_name + '.part',
                     'w',
                     compression=zipfile.ZIP_DEFLATED,
-                    compresslevel=6
+                    compresslevel=self.compression.level
                 )
         # ZIP_DEFLATED is used for for standard .zip files.
-        # compresslevel=6 matches Z_DEFAULT_COMPRESSION from
+        # The default level, 6, matches Z_DEFAULT_COMPRESSION from
         # https://docs.python.org/3/library/zlib.html#zlib.compressobj
-        # and overrides the default None value.
-        #   *Not sure if None equates to 0 or aforementioned default
+        # Entries are compressed per the policy; see _write_item.
             except PermissionError:
+                _release(save_name)
                 if i < 10 :
                     i += 1
                 else:
                     raise
+            except OSError:
+                _release(save_name)
+                raise
         if self._epub_file.filename is None:
             self._log_status('Epub missing name somehow?')
         else:
@@ -474,38 +687,129 @@ class EpubWriter:
 
         #   mimetype cannot be compressed.
         self._epub_file.writestr(
-            'mimetype',
-            'application/epub+zip',
-            compress_type=zipfile.ZIP_STORED
+            self._entry('mimetype', zipfile.ZIP_STORED),
+            'application/epub+zip'
         )
-        self._epub_file.writestr('META-INF/container.xml', _from_file('container.xml'))
+        self._epub_file.writestr(self._entry('META-INF/container.xml'), load_text('container.xml'))
+        if _RAW_ENTRIES:
+            self._compressor = ThreadPoolExecutor(max_workers=self._compress_workers)
+        self._created = True
+        self._save_name = save_name
 
         return save_name
 
     def push_item(self, item: _EpubResourceManifests) -> Self:
+        if self.streaming and self._created and not item.depends_on_items():
+            self._write_item(item)
+            item = _ItemRecord(item)
         self._item_group.append(item)
         return self
 
+    def _entry(self, name: str, compress_type: int|None = None) -> zipfile.ZipInfo:
+        '''A zip entry dated modified, rather than the time it happens to be written'''
+        entry = zipfile.ZipInfo(name, time.localtime(self.modified)[:6])
+        entry.compress_type = self._epub_file.compression if compress_type is None else compress_type
+        if sys.version_info >= (3, 13):
+            entry.compress_level = self.compression.level
+        else:
+            entry._compresslevel = self.compression.level # type: ignore[attr-defined]
+            # Public as compress_level since 3.13.
+        entry.external_attr = 0o600 << 16
+        # As writestr() would set them.
+        return entry
+
+    def _write_item(self, item: _EpubResourceManifests) -> None:
+        '''Queues item to be compressed and written, after the items before it'''
+        entry = self._entry('OEBPS/' + item.get_name(),
+                            self.compression.compress_type(_parse_mediatype(item.get_ext())))
+        if item.depends_on_items() or self._compressor is None or item.is_spilled():
+            self._write_compressed(wait=True)
+            with self._epub_file.open(entry, 'w') as stream:
+                item.write_data(stream)
+                # Streamed rather than built in memory; see _EpubOpf and PayloadStore.
+            item.release()
+            return
+        data = item.get_data()
+        if isinstance(data, str):
+            data = data.encode('UTF-8')
+        item.release()
+        self._compressing.append((entry, len(data), self._compressor.submit(
+            _compress, data, entry.compress_type, self.compression.level)))
+        self._write_compressed(wait=False)
+
+    def _write_compressed(self, wait: bool) -> None:
+        '''Writes the queued entries that are compressed, up to the first that isn't,
+        or all of them if wait is set. The queue is held to a few entries per worker,
+        so streaming stays streaming.'''
+        while len(self._compressing) > 0 and (
+                wait or self._compressing[0][2].done() or len(self._compressing) > 4 * self._compress_workers):
+            entry, size, compression = self._compressing.popleft()
+            data, crc = compression.result()
+            entry.file_size = size
+            entry.compress_size = len(data)
+            entry.CRC = crc
+            _write_raw(self._epub_file, entry, data)
+
     def complete(self,
                  author: str|None,
                  author_bio: str|None,
                  author_image: str|None,
                  description: str|None,
                  book_id: str,
-                 updated_date: str
+                 updated_date: str,
+                 series: tuple[str, int]|None = None,
+                 fingerprint: str|None = None
             ) -> None:
-        self.push_item(_EpubNcx(self.book_name, author, book_id, self._item_group))
-        self.push_item(EpubStyle())
-        self.push_item(_EpubAuthorPage(
-            book_name=self.book_name,
-            author=author,
-            author_bio=author_bio,
-            author_image=author_image
-            ))
-        self.push_item(_EpubOpf(self.book_name, author, book_id, self._item_group, description, updated_date))
-        for item in self._item_group:
-            self._epub_file.writestr('OEBPS/' + item.get_name(), item.get_data())
+        '''Writes the contents, author's page, style and TOC, and finishes the file.
+        A volume of a series gives the series' name and its number in it, and a
+        fingerprint of its contents (see source.volumes).'''
+        extra_metadata = ''
+        if series is not None:
+            extra_metadata += (
+                '\n <meta property="belongs-to-collection" id="series">' + escape(series[0]) + '</meta>'
+                '\n <meta refines="#series" property="collection-type">series</meta>'
+                '\n <meta refines="#series" property="group-position">' + str(series[1]) + '</meta>')
+        if fingerprint is not None:
+            extra_metadata += '\n <meta name="rrdownloader:fingerprint" content=' + quoteattr(fingerprint) + '/>'
+        with stage('complete'):
+            self.push_item(_EpubNcx(self.book_name, author, book_id, self._item_group))
+            self.push_item(EpubStyle())
+            self.push_item(_EpubAuthorPage(
+                book_name=self.book_name,
+                author=author,
+                author_bio=author_bio,
+                author_image=author_image
+                ))
+            self.push_item(_EpubOpf(self.book_name, author, book_id, self._item_group, description, updated_date,
+                                    self.modified, extra_metadata))
+            for item in self._item_group:
+                if not isinstance(item, _ItemRecord):
+                    self._write_item(item)
+            self._write_compressed(wait=True)
+            if self._compressor is not None:
+                self._compressor.shutdown()
+            self._epub_file.close()
+            if self._save_name is not None:
+                os.replace(self._save_name + '.part', self._save_name)
+                _release(self._save_name)
+            self._completed = True
+
+    def abort(self) -> None:
+        '''Stops a build that won't be completed, and deletes its .part file.
+        Does nothing once complete() has finished.'''
+        if not self._created or self._completed:
+            return
+        self._completed = True
+        if self._compressor is not None:
+            self._compressor.shutdown(cancel_futures=True)
+        self._compressing.clear()
         self._epub_file.close()
+        if self._save_name is not None:
+            _release(self._save_name)
+            try:
+                os.remove(self._save_name + '.part')
+            except FileNotFoundError:
+                pass
 
 
     def _log_status(self, string: str) -> None:
@@ -0,0 +1,134 @@
+'''Persistent on-disk response cache, revalidated with ETag/Last-Modified'''
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Callable
+import requests
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+class CacheEntry:
+    '''A cached response body and the validators needed to revalidate it'''
+    def __init__(self, url: str, path: str, etag: str|None, last_modified: str|None, content_type: str|None) -> None:
+        self.url = url
+        self.path = path
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+
+    def validators(self) -> dict[str, str]:
+        '''Conditional request headers for revalidating this entry'''
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_response(self) -> Response:
+        '''Rebuild a 200 response, as if the body had just been downloaded'''
+        with open(self.path, 'rb') as stream:
+            body = stream.read()
+        response = Response()
+        response.status_code = 200
+        response.url = self.url
+        response._content = body
+        response.headers = CaseInsensitiveDict()
+        if self.content_type is not None:
+            response.headers['Content-Type'] = self.content_type
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+class HttpCache:
+    '''Response bodies stored under directory, keyed by URL.
+    An sqlite index tracks validators, sizes and last use, so the cache can be
+    held under max_bytes by evicting the least recently used bodies; every lookup
+    that finds a body counts as a use, online or off.
+    In offline mode nothing is revalidated and uncached URLs fail.'''
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024 ** 3, offline: bool = False,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._clock = clock
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'bodies'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS entries (
+            url TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            content_type TEXT,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)')
+        self._db.commit()
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.directory, 'bodies', key)
+
+    def lookup(self, url: str) -> CacheEntry|None:
+        '''The entry for url, if its body is stored, marked as recently used'''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT key, etag, last_modified, content_type FROM entries WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        path = self._body_path(row[0])
+        if not os.path.exists(path):
+            return None
+        self.touch(url)
+        return CacheEntry(url, path, row[1], row[2], row[3])
+
+    def touch(self, url: str) -> None:
+        '''Mark url as recently used'''
+        with self._lock:
+            self._db.execute('UPDATE entries SET last_used = ? WHERE url = ?', (self._clock(), url))
+            self._db.commit()
+
+    def store(self, url: str, response: Response) -> None:
+        '''Save a 200 response body along with its validators'''
+        key = hashlib.sha256(url.encode('UTF-8')).hexdigest()
+        body = response.content
+        path = self._body_path(key)
+        temp_path = path + '.' + str(threading.get_ident()) + '.tmp'
+        with open(temp_path, 'wb') as stream:
+            stream.write(body)
+        os.replace(temp_path, path)
+        # Written aside then renamed, so a crash never leaves a truncated body.
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, key,
+                 response.headers.get('ETag'),
+                 response.headers.get('Last-Modified'),
+                 response.headers.get('Content-Type'),
+                 len(body), self._clock())
+            )
+            self._db.commit()
+            self._evict()
+
+    def _evict(self) -> None:
+        '''Drop least recently used entries until under max_bytes. Call holding _lock'''
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, key, size in self._db.execute(
+                'SELECT url, key, size FROM entries ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._body_path(key))
+            except FileNotFoundError:
+                pass
+            self._db.execute('DELETE FROM entries WHERE url = ?', (url,))
+            total -= size
+        self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,158 @@
+'''Shared HTTP session used by scrape(): keep-alive pooling, retries and backoff'''
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable
+import requests
+from requests import Response
+from requests.adapters import HTTPAdapter
+from source.http_cache import HttpCache
+from source.rate_limiter import RateLimiter
+
+class RetryPolicy:
+    '''Decides which failures are retried, and how long to wait between attempts.
+    Waits grow exponentially from backoff, capped at max_backoff, with up to
+    jitter * wait of random noise so concurrent workers don't retry in lockstep.
+    A Retry-After header from the server is honored up to max_retry_after.'''
+    def __init__(self,
+                 retries: int = 4,
+                 backoff: float = 0.5,
+                 max_backoff: float = 30.0,
+                 jitter: float = 0.5,
+                 max_retry_after: float = 300.0,
+                 statuses: tuple[int, ...] = (429, 500, 502, 503, 504, 522, 524)
+            ) -> None:
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+        self.statuses = statuses
+
+    def should_retry(self, status: int) -> bool:
+        return status in self.statuses
+
+    def delay(self, attempt: int, retry_after: str|None = None) -> float:
+        '''Seconds to wait before retry number attempt (0 based)'''
+        requested = _parse_retry_after(retry_after)
+        if requested is not None:
+            return min(requested, self.max_retry_after)
+        wait = min(self.backoff * (2 ** attempt), self.max_backoff)
+        return wait + random.uniform(0, self.jitter * wait)
+
+def _parse_retry_after(value: str|None) -> float|None:
+    '''Retry-After is either a number of seconds or an HTTP date'''
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class HttpSession:
+    '''A pooled requests.Session that retries transient failures.
+    With a cache, stored responses are revalidated rather than downloaded again.
+    With a limiter, requests to each host are paced to what it tolerates.
+    Retries are reported to log, if given.
+    Safe to share between the download workers of one or more books.'''
+    def __init__(self,
+                 pool_size: int = 10,
+                 timeout: float = 30,
+                 retry: RetryPolicy|None = None,
+                 sleep: Callable[[float], None] = time.sleep,
+                 cache: HttpCache|None = None,
+                 limiter: RateLimiter|None = None,
+                 log: Callable[[str], None]|None = None
+            ) -> None:
+        self.timeout = timeout
+        self.limiter = limiter
+        self.retry = RetryPolicy() if retry is None else retry
+        self.cache = cache
+        self._sleep = sleep
+        self._log = log
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        # Retries are handled here rather than by urllib3, to get jitter and logging.
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def get(self, url: str) -> Response:
+        '''GET url, answering from the cache when the server says it is unchanged'''
+        if self.cache is None:
+            return self._get(url, {})
+        entry = self.cache.lookup(url)
+        if self.cache.offline:
+            if entry is None:
+                raise requests.exceptions.ConnectionError('Not cached, and offline: ' + url)
+            return entry.to_response()
+        response = self._get(url, {} if entry is None else entry.validators())
+        if response.status_code == 304 and entry is not None:
+            return entry.to_response()
+        if response.status_code == 200:
+            self.cache.store(url, response)
+        return response
+
+    def _get(self, url: str, headers: dict[str, str]) -> Response:
+        '''GET url, retrying connection errors, timeouts and retryable statuses.
+        The last failure is raised, or the last retryable response returned,
+        once the retries are exhausted.'''
+        attempt = 0
+        host = None if self.limiter is None else self.limiter.host(url)
+        while True:
+            if host is not None:
+                host.acquire()
+            start = time.monotonic()
+            healthy = False
+            try:
+                response = self._session.get(url, headers=headers, timeout=self.timeout)
+                healthy = response.status_code != 429 and response.status_code < 500
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as issue:
+                if attempt >= self.retry.retries:
+                    raise
+                wait = self.retry.delay(attempt)
+                self._report(url, wait, type(issue).__name__)
+            else:
+                if attempt >= self.retry.retries or not self.retry.should_retry(response.status_code):
+                    return response
+                wait = self.retry.delay(attempt, response.headers.get('Retry-After'))
+                self._report(url, wait, 'status ' + str(response.status_code))
+                response.close()
+            finally:
+                if host is not None:
+                    host.release(healthy, time.monotonic() - start)
+            self._sleep(wait)
+            attempt += 1
+
+    def _report(self, url: str, wait: float, reason: str) -> None:
+        if self._log is not None:
+            self._log('Retrying ' + url + ' in ' + str(round(wait, 1)) + ' s: ' + reason)
+
+    def close(self) -> None:
+        self._session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+_default_session: HttpSession|None = None
+_default_lock = threading.Lock()
+
+def default_session() -> HttpSession:
+    '''The session scrape() uses. Created on first use.'''
+    global _default_session
+    with _default_lock:
+        if _default_session is None:
+            _default_session = HttpSession()
+        return _default_session
+
+def set_default_session(session: HttpSession) -> None:
+    '''Replace the session scrape() uses, e.g. to change pool size or retries'''
+    global _default_session
+    with _default_lock:
+        _default_session = session
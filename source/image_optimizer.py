@@ -0,0 +1,92 @@
+'''Optional downsizing and re-encoding of images for the reader they are meant for.
+Needs Pillow (pip3 install pillow).'''
+import io
+import importlib.util
+from concurrent.futures import Future, ProcessPoolExecutor
+
+AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+class DeviceProfile:
+    '''How images are prepared for a kind of reader. Images larger than max_width
+    by max_height are scaled down to fit, and re-encoded as image_format at
+    quality. Images under min_bytes that already fit are left alone, as are
+    animations and vector images.'''
+    def __init__(self,
+                 name: str,
+                 max_width: int,
+                 max_height: int,
+                 image_format: str = 'JPEG',
+                 quality: int = 80,
+                 grayscale: bool = False,
+                 min_bytes: int = 64 * 1024
+            ) -> None:
+        self.name = name
+        self.max_width = max_width
+        self.max_height = max_height
+        self.image_format = image_format # A Pillow format: JPEG, PNG or WEBP
+        self.quality = quality
+        self.grayscale = grayscale
+        self.min_bytes = min_bytes
+
+PROFILES = {
+    profile.name: profile for profile in (
+        DeviceProfile('kindle', 1264, 1680, 'JPEG', 75, grayscale=True),
+        DeviceProfile('kobo', 1264, 1680, 'JPEG', 80),
+        DeviceProfile('phone', 1080, 1920, 'JPEG', 80),
+        DeviceProfile('tablet', 2048, 2048, 'JPEG', 85),
+        DeviceProfile('webp', 2048, 2048, 'WEBP', 80),
+    )
+}
+
+_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+
+def optimize(data: bytes, ext: str, profile: DeviceProfile) -> tuple[bytes, str]:
+    '''The image re-encoded for profile, and its extension. If it is small, can't
+    be read, or wouldn't get smaller, the original is returned as it was.
+    Runs in the optimizer's worker processes.'''
+    from PIL import Image, UnidentifiedImageError
+    # Imported here, as Pillow is optional.
+    try:
+        image: Image.Image = Image.open(io.BytesIO(data))
+        fits = image.width <= profile.max_width and image.height <= profile.max_height
+        if (fits and len(data) < profile.min_bytes) or getattr(image, 'is_animated', False):
+            return data, ext
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return data, ext
+    # Not an image Pillow knows (e.g. svg), or broken. Embedded as downloaded.
+
+    if not fits:
+        image.thumbnail((profile.max_width, profile.max_height), Image.Resampling.LANCZOS)
+    image_format = profile.image_format
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+    if profile.grayscale:
+        image = image.convert('LA' if has_alpha else 'L')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    if image_format == 'JPEG' and has_alpha:
+        image_format = 'PNG'
+        # JPEG has no transparency; keep it rather than guess a background.
+
+    result = io.BytesIO()
+    if image_format == 'PNG':
+        image.save(result, 'PNG', optimize=True)
+    else:
+        image.save(result, image_format, quality=profile.quality, optimize=True)
+    if fits and result.tell() >= len(data):
+        return data, ext
+    return result.getvalue(), _EXTENSIONS[image_format]
+
+class ImageOptimizer:
+    '''Runs optimize() for a profile on a pool of worker processes, so the CPU-heavy
+    resizing happens alongside downloading rather than holding it up.
+    One optimizer can be shared by every book in a batch.'''
+    def __init__(self, profile: DeviceProfile, workers: int|None = None) -> None:
+        self.profile = profile
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, data: bytes, ext: str) -> Future[tuple[bytes, str]]:
+        return self._executor.submit(optimize, data, ext, self.profile)
+
+    def close(self) -> None:
+        self._executor.shutdown(cancel_futures=True)
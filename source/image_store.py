@@ -0,0 +1,53 @@
+'''Local store of downloaded images, shared by every book in a library'''
+import os
+import sqlite3
+import hashlib
+import threading
+
+def content_hash(data: bytes) -> str:
+    '''The key identical images share, whatever address they came from'''
+    return hashlib.sha256(data).hexdigest()
+
+class ImageStore:
+    '''Images saved under directory by content hash, with an index from the
+    addresses they were downloaded from. Once any book has downloaded an image,
+    later books (e.g. by the same author) reuse it without touching the network.'''
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'images'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS addresses (url TEXT PRIMARY KEY, hash TEXT NOT NULL)')
+        self._db.commit()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, 'images', digest)
+
+    def lookup(self, url: str) -> bytes|None:
+        with self._lock:
+            row = self._db.execute('SELECT hash FROM addresses WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._path(row[0]), 'rb') as stream:
+                return stream.read()
+        except FileNotFoundError:
+            return None
+
+    def store(self, url: str, data: bytes) -> str:
+        '''Saves data downloaded from url, once per distinct content, and returns its hash'''
+        digest = content_hash(data)
+        path = self._path(digest)
+        if not os.path.exists(path):
+            temp_path = path + '.' + str(threading.get_ident()) + '.tmp'
+            with open(temp_path, 'wb') as stream:
+                stream.write(data)
+            os.replace(temp_path, path)
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO addresses VALUES (?, ?)', (url, digest))
+            self._db.commit()
+        return digest
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
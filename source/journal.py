@@ -0,0 +1,143 @@
+'''Crash-safe record of a book's finished chapters and images, so an interrupted
+download can pick up where it stopped'''
+import os
+import json
+import time
+import shutil
+import threading
+from typing import Any
+from source.image_store import content_hash
+
+class JournaledChapter:
+    '''A chapter rendered before the download was interrupted'''
+    def __init__(self, url: str, path: str, images: list[list[str]], author_info: list[str|None]|None) -> None:
+        self.url = url
+        self.path = path
+        self.images = images            # (img src, placeholder it was given), in document order
+        self.author_info = author_info  # (bio, image address), for the first chapter
+
+    def read(self) -> str:
+        with open(self.path, 'r', encoding='UTF-8', newline='') as stream:
+            return stream.read()
+
+class Journal:
+    '''One book's work directory. journal.jsonl lists what is finished, one JSON
+    object per line, and each line is only appended once the file it describes has
+    been written in full; a line cut short by a crash is ignored. The first line
+    holds the settings the chapters were rendered with, and the time the download
+    started, which dates the book so a resumed download gives the same bytes.
+    A journal kept with other settings is discarded. The work directory, which
+    every book's directory is kept in, is removed with the last of them.'''
+    def __init__(self, directory: str, book_id: str, settings: dict[str, Any]) -> None:
+        self.work_dir = directory
+        self.directory = os.path.join(directory, str(book_id))
+        self.chapters: dict[str, JournaledChapter] = {}  # Chapter ID -> chapter
+        self._images: dict[str, str] = {}                # Address -> content hash
+        self._chapter_files = 0
+        self._lock = threading.Lock()
+        self.started = time.time()
+        path = os.path.join(self.directory, 'journal.jsonl')
+        entries, length = self._load(path)
+        if len(entries) == 0 or entries[0].get('settings') != settings:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            entries = [{'settings': settings, 'started': self.started}]
+            os.makedirs(os.path.join(self.directory, 'chapters'))
+            os.makedirs(os.path.join(self.directory, 'images'))
+            with open(path, 'w', encoding='UTF-8') as stream:
+                stream.write(json.dumps(entries[0]) + '\n')
+        else:
+            os.truncate(path, length)
+            # Drop a line cut short, so the next is appended after the last whole one.
+        self.started = entries[0]['started']
+        for entry in entries[1:]:
+            if 'chapter' in entry:
+                self._chapter_files += 1
+                self.chapters[entry['chapter']] = JournaledChapter(
+                    entry['url'], os.path.join(self.directory, entry['file']),
+                    entry['images'], entry.get('author_info'))
+            elif 'image' in entry:
+                self._images[entry['image']] = entry['hash']
+        self._journal = open(path, 'a', encoding='UTF-8')
+
+    @staticmethod
+    def _load(path: str) -> tuple[list[dict[str, Any]], int]:
+        '''The whole entries of the journal at path, and the bytes they take up'''
+        entries = []
+        length = 0
+        try:
+            with open(path, 'rb') as stream:
+                for line in stream:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break
+                    length += len(line)
+        except FileNotFoundError:
+            pass
+        return entries, length
+
+    def _append(self, entry: dict[str, Any]) -> None:
+        '''Call holding _lock'''
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+
+    @staticmethod
+    def _write_file(path: str, data: bytes) -> None:
+        with open(path + '.tmp', 'wb') as stream:
+            stream.write(data)
+        os.replace(path + '.tmp', path)
+
+    def record_chapter(self,
+                       chapter_id: str,
+                       url: str,
+                       data: str,
+                       images: list[list[str]],
+                       author_info: tuple[str|None, str|None]|None = None
+                ) -> None:
+        '''Records a rendered chapter. images pairs the img src it had before
+        rendering with the placeholder that replaced it in data.'''
+        with self._lock:
+            name = 'chapters/' + str(self._chapter_files) + '.xhtml'
+            self._chapter_files += 1
+            self._write_file(os.path.join(self.directory, name), data.encode('UTF-8'))
+            entry: dict[str, Any] = {'chapter': chapter_id, 'url': url, 'file': name, 'images': images}
+            if author_info is not None:
+                entry['author_info'] = list(author_info)
+            self._append(entry)
+            self.chapters[chapter_id] = JournaledChapter(
+                url, os.path.join(self.directory, name), images, entry.get('author_info'))
+
+    def record_image(self, url: str, data: bytes) -> None:
+        digest = content_hash(data)
+        path = os.path.join(self.directory, 'images', digest)
+        with self._lock:
+            if url in self._images:
+                return
+            if not os.path.exists(path):
+                self._write_file(path, data)
+            self._append({'image': url, 'hash': digest})
+            self._images[url] = digest
+
+    def image(self, url: str) -> bytes|None:
+        with self._lock:
+            digest = self._images.get(url)
+        if digest is None:
+            return None
+        with open(os.path.join(self.directory, 'images', digest), 'rb') as stream:
+            return stream.read()
+
+    def close(self) -> None:
+        self._journal.close()
+
+    def discard(self) -> None:
+        '''Deletes the book's directory, once the book is finished, and the work
+        directory if no other book's is left in it'''
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        try:
+            os.rmdir(self.work_dir)
+        except OSError:
+            pass
+            # Not empty: other books are being downloaded, or were interrupted.
@@ -0,0 +1,78 @@
+'''Downloading books from another program. The steps are separate:
+
+    info = fetch_book_info('12345')             # The fiction page: title, chapters, ...
+    with BookDownloader(info, on_event=print, cancel=CancelToken(timeout=600)) as book:
+        book.download()                         # Chapters and their images
+        save_name = book.build()                # The finished epub
+
+or together, in download_book(), update_book() and download_events(). Progress is
+reported as the events in source.progress. RRTool.py is a client of this module.'''
+import queue
+import threading
+from typing import Any, Callable, Iterator
+from source.rr_dwnldr import BookInfo, BookDownloader, LocalizedException, fetch_book_info
+from source.epub_reader import EpubReader
+from source.progress import Event, CancelToken
+
+def download_book(book: str|BookInfo,
+                  on_event: Callable[[Event], None]|None = None,
+                  cancel: CancelToken|None = None,
+                  **options: Any
+            ) -> str:
+    '''Downloads a book, given by its id or BookInfo, and builds its epub.
+    Returns the epub's file name. options are passed on to BookDownloader.'''
+    if not isinstance(book, BookInfo):
+        if cancel is not None:
+            cancel.check()
+        book = fetch_book_info(book)
+    with BookDownloader(book, on_event=on_event, cancel=cancel, **options) as downloader:
+        downloader.download()
+        return downloader.build()
+
+def update_book(path: str,
+                on_event: Callable[[Event], None]|None = None,
+                cancel: CancelToken|None = None,
+                **options: Any
+            ) -> str:
+    '''Adds the chapters released since the epub at path was made, downloading only those'''
+    reader = EpubReader(path)
+    try:
+        book_id = reader.book_id
+        volume = reader.volume
+    finally:
+        reader.close()
+    if volume is not None:
+        raise LocalizedException(path + ' is a volume; download the book again with the same volume '
+                                 'settings, and the volumes that have not changed are kept as they are')
+    return download_book(book_id, on_event, cancel, existing=path, **options)
+
+def download_events(book: str|BookInfo,
+                    cancel: CancelToken|None = None,
+                    **options: Any
+            ) -> Iterator[Event]:
+    '''download_book() as an iterator of its events, ending with BookWritten (one per volume).
+    The download runs on another thread, and an error there is raised here.
+    Stopping the iteration early cancels the download.'''
+    token = CancelToken(parent=cancel)
+    events: queue.Queue[Event|None] = queue.Queue()
+    failure: list[BaseException] = []
+
+    def run() -> None:
+        try:
+            download_book(book, events.put, token, **options)
+        except BaseException as issue:
+            failure.append(issue)
+        finally:
+            events.put(None)
+
+    thread = threading.Thread(target=run, name='download ' + str(getattr(book, 'book_id', book)), daemon=True)
+    thread.start()
+    try:
+        while (event := events.get()) is not None:
+            yield event
+    finally:
+        token.cancel()
+        # Only matters if the iteration was stopped early; the download has finished otherwise.
+        thread.join()
+    if len(failure) > 0:
+        raise failure[0]
@@ -0,0 +1,138 @@
+'''Where the contents of epub items wait until they are written: in memory while
+that stays within a budget, and in a temporary file beyond it'''
+import bisect
+import tempfile
+import threading
+from typing import IO
+
+_CHUNK = 1024 * 1024
+# Bytes copied at a time out of the spill file.
+
+class Payload:
+    '''The contents of one item, in memory or in its store's spill file.
+    release() once it has been written, to give its memory back to the budget.'''
+    __slots__ = ('size', '_data', '_offset', '_store')
+
+    def __init__(self, size: int, data: bytes|None, offset: int = 0, store: 'PayloadStore|None' = None) -> None:
+        self.size = size
+        self._data = data
+        self._offset = offset
+        self._store = store
+
+    @property
+    def spilled(self) -> bool:
+        return self._data is None and self._store is not None
+
+    def read(self) -> bytes:
+        if self._data is not None:
+            return self._data
+        if self._store is None:
+            raise ValueError('Payload read after release')
+        return self._store.read(self._offset, self.size)
+
+    def copy_to(self, stream: IO[bytes]) -> None:
+        '''Writes the contents to stream, a piece at a time if spilled'''
+        if self._data is not None or self._store is None:
+            stream.write(self.read())
+            return
+        for start in range(0, self.size, _CHUNK):
+            stream.write(self._store.read(self._offset + start, min(_CHUNK, self.size - start)))
+
+    def release(self) -> None:
+        if self._store is not None:
+            if self._data is not None:
+                self._store.forget(self.size)
+            else:
+                self._store.free(self._offset, self.size)
+        self._data = None
+        self._store = None
+
+def in_memory(data: bytes) -> Payload:
+    '''A payload kept in memory, outside any store's budget'''
+    return Payload(len(data), data)
+
+class PayloadStore:
+    '''Keeps payloads in memory up to budget bytes in all, and spills the rest to one
+    temporary file in directory (defaults to the system's), as do payloads of
+    spill_size bytes or more, which are seldom worth their memory. The space of
+    released payloads is reused, and the file is cut short when its end is free, so
+    it holds about as much as the payloads still waiting; it is deleted when the
+    store is closed. One store can be shared by every book in a batch, to budget
+    them together.'''
+    def __init__(self, budget: int = 256 * 1024 ** 2, spill_size: int = 1024 ** 2,
+                 directory: str|None = None) -> None:
+        self.budget = budget
+        self.spill_size = spill_size
+        self.directory = directory
+        self.in_memory = 0          # Bytes of payloads held in memory
+        self.spilled = 0            # Bytes written to the spill file, in all
+        self.file_size = 0          # Bytes the spill file takes now
+        self._file: IO[bytes]|None = None
+        self._free: list[list[int]] = [] # Released extents of the file, [offset, size], in order
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes) -> Payload:
+        with self._lock:
+            if len(data) < self.spill_size and self.in_memory + len(data) <= self.budget:
+                self.in_memory += len(data)
+                return Payload(len(data), data, store=self)
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix='rrpayloads', dir=self.directory)
+            offset = self._allocate(len(data))
+            self._file.seek(offset)
+            self._file.write(data)
+            self.spilled += len(data)
+            return Payload(len(data), None, offset, self)
+
+    def _allocate(self, size: int) -> int:
+        '''Where to spill size bytes: the first released extent they fit in, or the
+        end of the file. Call holding _lock.'''
+        for extent in self._free:
+            if extent[1] >= size:
+                offset = extent[0]
+                extent[0] += size
+                extent[1] -= size
+                if extent[1] == 0:
+                    self._free.remove(extent)
+                return offset
+        offset = self.file_size
+        self.file_size += size
+        return offset
+
+    def read(self, offset: int, size: int) -> bytes:
+        with self._lock:
+            if self._file is None:
+                raise ValueError('Nothing spilled to read')
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def forget(self, size: int) -> None:
+        '''Gives back the memory of a released payload'''
+        with self._lock:
+            self.in_memory -= size
+
+    def free(self, offset: int, size: int) -> None:
+        '''Gives back the space of a released payload in the spill file'''
+        with self._lock:
+            if self._file is None or size == 0:
+                return
+            index = bisect.bisect(self._free, [offset, size])
+            self._free.insert(index, [offset, size])
+            if index + 1 < len(self._free) and offset + size == self._free[index + 1][0]:
+                self._free[index][1] += self._free.pop(index + 1)[1]
+            if index > 0 and self._free[index - 1][0] + self._free[index - 1][1] == offset:
+                self._free[index - 1][1] += self._free.pop(index)[1]
+            # Merged with its neighbours, so a run of released payloads is one extent.
+            last = self._free[-1]
+            if last[0] + last[1] == self.file_size:
+                self.file_size = last[0]
+                self._file.truncate(self.file_size)
+                self._free.pop()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._free.clear()
+            self.file_size = 0
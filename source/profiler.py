@@ -0,0 +1,132 @@
+'''Where the time goes in a build: wall and CPU time, bytes and counts per stage
+and per chapter, as a summary table and a Chrome trace (chrome://tracing, Perfetto).
+Off unless set_profiler() is called; stage() then costs next to nothing.'''
+import os
+import json
+import time
+import threading
+from typing import Any
+
+SpanRecord = tuple[str, dict[str, Any], int, float, float, float, int, int]
+# A finished span: name, args, bytes, start (time.perf_counter()), wall, cpu, pid, thread.
+
+class Span:
+    '''One timed run of a stage. Add to bytes to record the data it moved.'''
+    __slots__ = ('name', 'args', 'bytes', '_wall', '_cpu', '_profiler')
+
+    def __init__(self, profiler: 'Profiler', name: str, args: dict[str, Any]) -> None:
+        self.name = name
+        self.args = args
+        self.bytes = 0
+        self._profiler = profiler
+        self._wall = 0.0
+        self._cpu = 0.0
+
+    def __enter__(self) -> 'Span':
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self._profiler.record(self, self._wall, time.perf_counter() - self._wall, time.thread_time() - self._cpu)
+
+class _NullSpan:
+    '''Stands in for Span while profiling is off'''
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        pass
+
+    @property
+    def bytes(self) -> int:
+        return 0
+
+    @bytes.setter
+    def bytes(self, _: int) -> None:
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Profiler:
+    '''Collects spans from every thread'''
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._events: list[dict[str, Any]] = []
+        self._stages: dict[str, list[float]] = {}    # Stage -> [count, wall, cpu, bytes]
+        self._chapters: dict[str, list[float]] = {}  # Chapter -> [spans, wall, cpu, bytes]
+
+    def record(self, span: Span, start: float, wall: float, cpu: float) -> None:
+        self.merge([(span.name, span.args, span.bytes, start, wall, cpu, os.getpid(), threading.get_ident())])
+
+    def merge(self, spans: list[SpanRecord]) -> None:
+        '''Adds spans timed elsewhere, such as those a SpanRecorder kept in a worker
+        process. perf_counter() is system wide, so their starts line up with ours.'''
+        with self._lock:
+            for name, args, size, start, wall, cpu, pid, tid in spans:
+                self._events.append({
+                    'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                    'ts': round((start - self._start) * 1e6), 'dur': round(wall * 1e6),
+                    'args': dict(args, cpu_ms=round(cpu * 1e3, 3), bytes=size)
+                })
+                for totals, key in ((self._stages, name), (self._chapters, args.get('chapter'))):
+                    if key is None:
+                        continue
+                    if key not in totals:
+                        totals[key] = [0, 0.0, 0.0, 0]
+                    row = totals[key]
+                    row[0] += 1
+                    row[1] += wall
+                    row[2] += cpu
+                    row[3] += size
+
+    def summary(self, chapters: int = 10) -> str:
+        '''A table of the stages, then the chapters that took longest'''
+        with self._lock:
+            stages = sorted(self._stages.items(), key=lambda item: -item[1][1])
+            slowest = sorted(self._chapters.items(), key=lambda item: -item[1][1])[:chapters]
+        lines = [f'{"stage":<16} {"count":>7} {"wall s":>9} {"cpu s":>9} {"MB":>9}']
+        for name, (count, wall, cpu, size) in stages:
+            lines.append(f'{name:<16} {int(count):>7} {wall:>9.3f} {cpu:>9.3f} {size / 1e6:>9.2f}')
+        lines.append('')
+        lines.append(f'{"slowest chapters":<40} {"spans":>5} {"wall s":>9} {"cpu s":>9} {"MB":>9}')
+        for name, (count, wall, cpu, size) in slowest:
+            lines.append(f'{name[:40]:<40} {int(count):>5} {wall:>9.3f} {cpu:>9.3f} {size / 1e6:>9.2f}')
+        return '\n'.join(lines)
+
+    def write_trace(self, path: str) -> None:
+        '''Writes the spans in Chrome's trace event format'''
+        with self._lock:
+            events = list(self._events)
+        with open(path, 'w', encoding='UTF-8') as stream:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, stream)
+
+class SpanRecorder(Profiler):
+    '''Keeps the spans it is given, for a worker process to send back to the
+    Profiler of the process that started it'''
+    def __init__(self) -> None:
+        super().__init__()
+        self.spans: list[SpanRecord] = []
+
+    def merge(self, spans: list[SpanRecord]) -> None:
+        self.spans.extend(spans)
+
+_profiler: Profiler|None = None
+
+def profiler() -> Profiler|None:
+    '''The profiler stage() records to, or None when profiling is off'''
+    return _profiler
+
+def set_profiler(new_profiler: Profiler|None) -> None:
+    global _profiler
+    _profiler = new_profiler
+
+def stage(name: str, **args: Any) -> Span|_NullSpan:
+    '''Times the with block as a run of stage name. Pass chapter= to also count it
+    towards that chapter.'''
+    if _profiler is None:
+        return _NULL_SPAN
+    return Span(_profiler, name, args)
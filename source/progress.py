@@ -0,0 +1,145 @@
+'''What a book download reports as it goes, and how to stop one early.
+Events are passed to the on_event callback given to BookDownloader (see also
+source.library.download_events); a CancelToken stops the download at its next
+chapter or image.'''
+import time
+import threading
+from typing import Callable
+
+class Event:
+    '''Something that happened while building the book book_id'''
+    def __init__(self, book_id: str) -> None:
+        self.book_id = book_id
+
+    def __repr__(self) -> str:
+        return type(self).__name__ + '(' + ', '.join(
+            name + '=' + repr(value) for name, value in vars(self).items()) + ')'
+
+class BookStarted(Event):
+    '''The download has begun. Of the book's chapters, selected are being built,
+    of which new will be downloaded and resumed were saved by an earlier run.
+    updating is the epub being updated, if any.'''
+    def __init__(self, book_id: str, title: str, chapters: int, selected: int, new: int, resumed: int,
+                 updating: str|None) -> None:
+        super().__init__(book_id)
+        self.title = title
+        self.chapters = chapters
+        self.selected = selected
+        self.new = new
+        self.resumed = resumed
+        self.updating = updating
+
+class ChapterStarted(Event):
+    '''A chapter has started downloading. Sent from the worker downloading it.'''
+    def __init__(self, book_id: str, place: int, name: str, chapters: int) -> None:
+        super().__init__(book_id)
+        self.place = place
+        self.name = name
+        self.chapters = chapters
+
+class ChapterFinished(Event):
+    '''A chapter is rendered and queued for the book. source is 'downloaded',
+    'reused' from the epub being updated, or 'resumed' from the journal, and bytes
+    the size of its page (0 unless downloaded). done of total selected chapters are
+    finished, downloaded bytes of pages and images have been fetched so far, and
+    eta is the estimated seconds left, if there is enough to go on.'''
+    def __init__(self, book_id: str, place: int, name: str, source: str, size: int,
+                 done: int, total: int, downloaded: int, eta: float|None) -> None:
+        super().__init__(book_id)
+        self.place = place
+        self.name = name
+        self.source = source
+        self.bytes = size
+        self.done = done
+        self.total = total
+        self.downloaded = downloaded
+        self.eta = eta
+
+class Notice(Event):
+    '''Something worth telling the user that doesn't stop the download, e.g. a broken image'''
+    def __init__(self, book_id: str, message: str) -> None:
+        super().__init__(book_id)
+        self.message = message
+
+class BookWritten(Event):
+    '''The epub is finished and saved as save_name'''
+    def __init__(self, book_id: str, save_name: str, chapters: int, downloaded: int, seconds: float) -> None:
+        super().__init__(book_id)
+        self.save_name = save_name
+        self.chapters = chapters
+        self.downloaded = downloaded
+        self.seconds = seconds
+
+class Progress:
+    '''Counts a book's chapters as they finish and the bytes downloaded, and
+    estimates the time left from the rate chapters are downloading at. Reused and
+    resumed chapters take no time, so they don't count towards the rate.
+    Bytes can be added from any thread.'''
+    def __init__(self, total: int, to_download: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self.total = total
+        self.to_download = to_download
+        self.done = 0
+        self.downloaded_chapters = 0
+        self.bytes = 0
+        self._clock = clock
+        self._start = clock()
+        self._lock = threading.Lock()
+
+    def add_bytes(self, count: int) -> None:
+        with self._lock:
+            self.bytes += count
+
+    def chapter_done(self, downloaded: bool) -> None:
+        self.done += 1
+        if downloaded:
+            self.downloaded_chapters += 1
+
+    def eta(self) -> float|None:
+        remaining = self.to_download - self.downloaded_chapters
+        if remaining <= 0:
+            return 0.0
+        if self.downloaded_chapters == 0:
+            return None
+        return (self._clock() - self._start) / self.downloaded_chapters * remaining
+
+    def seconds(self) -> float:
+        return self._clock() - self._start
+
+class Cancelled(Exception):
+    '''Raised in a cancelled download, where it next checks its CancelToken'''
+
+class TimedOut(Cancelled):
+    '''Raised in a download that ran past its CancelToken's timeout'''
+
+class CancelToken:
+    '''Lets one thread stop downloads running in others. A download checks its token
+    before each chapter and image, so it stops within a request or so of cancel(),
+    or of timeout seconds passing since the token was made. A token with a parent
+    is also cancelled with it, e.g. a per-book timeout within a batch.'''
+    def __init__(self, timeout: float|None = None, parent: 'CancelToken|None' = None,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.timeout = timeout
+        self.parent = parent
+        self._clock = clock
+        self._deadline = None if timeout is None else clock() + timeout
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        try:
+            self.check()
+        except Cancelled:
+            return True
+        return False
+
+    def check(self) -> None:
+        '''Raises Cancelled if the download should stop'''
+        if self._cancelled.is_set():
+            raise Cancelled('Download cancelled')
+        if self._deadline is not None and self._clock() >= self._deadline:
+            raise TimedOut('Download timed out after ' + str(self.timeout) + ' s')
+        if self.parent is not None:
+            self.parent.check()
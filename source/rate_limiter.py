@@ -0,0 +1,124 @@
+'''Per-host request pacing that finds the fastest rate a server tolerates'''
+import time
+import threading
+from typing import Callable
+from urllib.parse import urlsplit
+
+class HostLimiter:
+    '''A token bucket for one host, plus a cap on requests in flight.
+    Both grow additively while requests succeed at a healthy latency, and are cut
+    multiplicatively when the host throttles (429), fails (5xx) or times out.
+    Until the first cut they double every round instead, to find the host's limit quickly.
+    Cuts are at most one per cooldown, so a burst of failures from requests sent
+    before the last cut doesn't collapse the rate. Big changes of rate go to log, if given.'''
+    def __init__(self,
+                 host: str,
+                 rate: float = 4.0,
+                 max_rate: float = 50.0,
+                 min_rate: float = 0.2,
+                 concurrency: float = 4.0,
+                 max_concurrency: float = 32.0,
+                 increase: float = 2.0,
+                 decrease: float = 0.5,
+                 slow_factor: float = 3.0,
+                 cooldown: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 log: Callable[[str], None]|None = None
+            ) -> None:
+        self.host = host
+        self.rate = rate                 # Requests started per second
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.concurrency = concurrency   # Requests in flight at once
+        self.max_concurrency = max_concurrency
+        self.increase = increase         # Requests/s added per second of healthy requests
+        self.decrease = decrease
+        self.slow_factor = slow_factor   # Latency this many times the usual is unhealthy
+        self.cooldown = cooldown
+        self._clock = clock
+        self._log = log
+        self._condition = threading.Condition()
+        self._tokens = 1.0
+        self._refilled = clock()
+        self._in_flight = 0
+        self._latency: float|None = None # Moving average of healthy latencies
+        self._last_cut = float('-inf')
+        self._slow_start = True
+        self._logged_rate = rate
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._refilled) * self.rate)
+        # The bucket holds at most a second's worth, so an idle host can't bank a flood.
+        self._refilled = now
+
+    def acquire(self) -> None:
+        '''Blocks until a request may be sent'''
+        with self._condition:
+            while True:
+                now = self._clock()
+                self._refill(now)
+                if self._in_flight < int(self.concurrency) and self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    self._in_flight += 1
+                    return
+                if self._in_flight >= int(self.concurrency):
+                    self._condition.wait()
+                else:
+                    self._condition.wait((1.0 - self._tokens) / self.rate)
+
+    def release(self, healthy: bool, latency: float) -> None:
+        '''Reports how the request went. Unhealthy means throttled, failed or timed out.'''
+        with self._condition:
+            self._in_flight -= 1
+            now = self._clock()
+            if healthy:
+                if self._latency is None or latency <= self.slow_factor * self._latency:
+                    self._latency = latency if self._latency is None else 0.9 * self._latency + 0.1 * latency
+                    if self._slow_start:
+                        self.rate = min(self.max_rate, self.rate + 1.0)
+                        self.concurrency = min(self.max_concurrency, self.concurrency + 1.0)
+                    else:
+                        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+                        self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+                        # +increase requests/s per second, and +1 in flight per round of requests.
+                    if self.rate >= self._logged_rate * 1.5:
+                        self._report('speeding up')
+                # Otherwise the host is slowing down; hold the rate where it is.
+            elif now - self._last_cut >= self.cooldown:
+                self._last_cut = now
+                self._slow_start = False
+                self._refill(now)
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.concurrency = max(1.0, self.concurrency * self.decrease)
+                self._tokens = min(self._tokens, 1.0)
+                self._report('slowing down')
+            self._condition.notify_all()
+
+    def _report(self, change: str) -> None:
+        self._logged_rate = self.rate
+        if self._log is not None:
+            self._log(self.host + ': ' + change + ' to ' + str(round(self.rate, 1))
+                      + ' requests/s, ' + str(int(self.concurrency)) + ' at once')
+
+class RateLimiter:
+    '''A HostLimiter for every host, each starting at rate requests per second'''
+    def __init__(self,
+                 rate: float = 4.0,
+                 max_rate: float = 50.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 log: Callable[[str], None]|None = None
+            ) -> None:
+        self.rate = rate
+        self.max_rate = max_rate
+        self._clock = clock
+        self._log = log
+        self._hosts: dict[str, HostLimiter] = {}
+        self._lock = threading.Lock()
+
+    def host(self, url: str) -> HostLimiter:
+        name = urlsplit(url).netloc
+        with self._lock:
+            if name not in self._hosts:
+                self._hosts[name] = HostLimiter(name, rate=self.rate, max_rate=self.max_rate,
+                                                clock=self._clock, log=self._log)
+            return self._hosts[name]
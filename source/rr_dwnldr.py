@@ -2,28 +2,83 @@
 import os
 import string
 import re
-from typing import Callable
+import time
+import zipfile
+import sqlite3
+import importlib.util
+import threading
+from itertools import repeat, islice
+from typing import Callable, Generator
+from collections import deque
+from contextlib import closing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor, Future
+from xml.sax.saxutils import escape
 import requests
-from bs4 import BeautifulSoup as bs
+from bs4 import BeautifulSoup as bs, SoupStrainer
 from requests import Response
-from source.epub_writer import EpubWriter, EpubImage, EpubChapter, TableOfContents, EpubCover
-
-def _from_file(name: str) -> str:
-    result: str | None = None
-    with open('./assets/' + name, mode='r', encoding='UTF-8') as stream:
-        result = stream.read()
-    if result is not None:
-        return result
-    raise Exception('File missing', name)
+from source.epub_writer import EpubWriter, EpubImage, EpubChapter, TableOfContents, EpubCover, CompressionPolicy, \
+    EpubException, epub_name
+from source.epub_reader import EpubReader, ExistingItem
+from source.http_session import default_session
+from source.image_store import ImageStore, content_hash
+from source.journal import Journal, JournaledChapter
+from source.image_optimizer import ImageOptimizer
+from source.payload_store import PayloadStore
+from source.volumes import VolumePolicy, VolumeCollector, CollectedChapter, fingerprint
+from source.selection import ChapterSelection
+from source.catalog import Catalog
+from source.profiler import stage, profiler, set_profiler, SpanRecord, SpanRecorder
+from source.progress import Event, BookStarted, ChapterStarted, ChapterFinished, Notice, BookWritten, \
+    Progress, CancelToken
+from source.templates import load_bytes, template
+
+_parser = 'lxml' if importlib.util.find_spec('lxml') is not None else 'html.parser'
+# lxml is several times faster than the pure python parser, but optional.
+
+_base_url = 'https://www.royalroad.com'
+# Where fictions, chapters and site-relative images are fetched from.
+
+_CHAPTER_PARTS = SoupStrainer('div', class_=re.compile(r'\b(chapter-content|author-note)\b'))
+# The parts of a chapter page that end up in the book.
+
+def parser_backend() -> str:
+    '''The BeautifulSoup parser used for pages downloaded from RoyalRoad'''
+    return _parser
+
+def set_parser_backend(name: str) -> None:
+    global _parser
+    if name == 'lxml' and importlib.util.find_spec('lxml') is None:
+        raise LocalizedException('lxml is not installed')
+    _parser = name
+
+def base_url() -> str:
+    '''The RoyalRoad site pages are downloaded from'''
+    return _base_url
+
+def set_base_url(url: str) -> None:
+    '''Fetch from another host, e.g. a local stand-in for benchmarks'''
+    global _base_url
+    _base_url = url.rstrip('/')
+
+class ScrapeError(ConnectionError):
+    '''Raised when the server answers with an error, once retries are exhausted'''
+    def __init__(self, message: str, url: str, status: int) -> None:
+        super().__init__(message, url)
+        self.url = url
+        self.status = status
 
 def scrape(url: str) -> requests.Response:
-    '''gets a resource, with a default timeout'''
+    '''gets a resource through the shared session, retrying transient failures.
+    Raises RuntimeError if it is missing, and ScrapeError for any other answer
+    but success or not modified.'''
     problem: Exception|None = None
     response: Response|None = None
-    try:
-        response = requests.get(url, timeout=30)
-    except Exception as issue:
-        problem = issue
+    with stage('scrape', url=url) as span:
+        try:
+            response = default_session().get(url)
+            span.bytes = len(response.content)
+        except Exception as issue:
+            problem = issue
     if response is None:
         raise ConnectionError(
             'Unable to connect to server.\nCheck your internet connection and try again.'
@@ -31,7 +86,10 @@ def scrape(url: str) -> requests.Response:
     if response.status_code == 404:
         raise RuntimeError('Missing net resource.', url) from problem
     if response.status_code == 522:
-        raise ConnectionError('Royal Road is down') from problem
+        raise ScrapeError('Royal Road is down', url, response.status_code)
+    if not (200 <= response.status_code < 300 or response.status_code == 304):
+        raise ScrapeError('Royal Road answered ' + str(response.status_code) + ' ' + response.reason
+                          + ' for ' + url, url, response.status_code)
     return response
 
 
@@ -47,28 +105,47 @@ class LocalizedException(Exception):
     pass
 
 
+class ChapterIds:
+    '''The internal IDs handed out to the chapters of one book.
+    A name already taken gets the first free suffix _2, _3, ..., so the same
+    chapter list always gives the same IDs. Each book keeps its own.'''
+    def __init__(self) -> None:
+        self._taken: set[str] = set()
+        self._next_suffix: dict[str, int] = {} # Base name -> first suffix worth trying
+
+    def allocate(self, name: str) -> str:
+        if name not in self._taken:
+            self._taken.add(name)
+            return name
+        i = self._next_suffix.get(name, 2)
+        while name + '_' + str(i) in self._taken:
+            i += 1
+        self._next_suffix[name] = i + 1
+        self._taken.add(name + '_' + str(i))
+        return name + '_' + str(i)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._taken
+
+    def __len__(self) -> int:
+        return len(self._taken)
+
+
 class Chapter:
     '''Functional class. Total garbage'''
-    _id_list: list = []
-
-    @staticmethod
-    def reset_class() -> None:
-        Chapter._id_list = []
 
-    def __init__(self, name: str, url: str) -> None:
-        self.data_soup: bs
+    def __init__(self, name: str, url: str, ids: ChapterIds|None = None) -> None:
+        self.data_soup: bs|None = None
         self.soup: bs
-        self.url = 'https://www.royalroad.com' + url
+        self.url = _base_url + url
         self.name = str(name).strip()
-        self.sanitized_name = sanitized_name_temp = re.sub(r'[\W]+', '_', self.name)
+        self.sanitized_name = re.sub(r'[\W]+', '_', self.name)
         # It was a huge pain to try to sanitize appropiately using
         #  escape from xml.sax.saxutils, so a simpler way was simply
         #  to replace all non alpha-numeric characters (regex: \W)
-        i = 2
-        while self.sanitized_name in Chapter._id_list:
-            self.sanitized_name = sanitized_name_temp+'_' + str(i)
-        Chapter._id_list.append(self.sanitized_name)
-        # Then ensure no conficts for internal IDs.
+        if ids is not None:
+            self.sanitized_name = ids.allocate(self.sanitized_name)
+        # Then ensure no conficts for internal IDs within the book.
 
     def __repr__(self) -> str:
         return str(self)
@@ -79,36 +156,27 @@ class Chapter:
     def get_author_info(self) -> tuple[str|None,str|None]:
         if self.data_soup is None:
             raise Exception('Data not yet retrieved')
-        soup = self.data_soup
-        tag = _find_val_suppress(
-            lambda: soup.find('i', class_='fa fa-info-circle').tag.parent.text # type: ignore[union-attr]
-        )
-        #This finds the information circle icon that preceeds the bio.
-        bio: str|None
-        if tag is None or tag == 'Bio:':
-            bio = None
-        else:
-            bio = tag.strip()
-        img: str|None = _find_val_suppress(
-            lambda: soup.find('div', class_='avatar-container-general').img.attrs['src'] # type: ignore[union-attr]
-        )
-        return (bio, img)
+        return _author_info(self.data_soup)
 
-    def get_data(self) -> None:
-        data = scrape(self.url)
-        self.data_soup = bs(data.text, 'html.parser')
-        #   Retrieve webpage & make soup
+    def parse(self, html: str, strain: bool = False, parser: str|None = None) -> None:
+        '''Formats the chapter from its downloaded page. A strained parse only builds
+        the content and author's notes, so get_author_info() will find nothing.'''
+        with stage('parse', url=self.url) as span:
+            span.bytes = len(html)
+            self.data_soup = bs(html, _parser if parser is None else parser,
+                                parse_only=_CHAPTER_PARTS if strain else None)
+        #   make soup
 
         content = self.data_soup.find('div', class_='chapter-inner chapter-content')
         notes = self.data_soup.find_all('div', class_='portlet-body author-note')
         #   Get chapter contents
         #TODO: Fix 'spoilers' in notes, content
 
-        self.soup = bs(_from_file('BasicChapter.xhtml'),'html.parser')
-        #   Once contents are isolated, get the template xhtml document
+        self.soup = bs('<div></div>', 'html.parser')
+        #   Once contents are isolated, gather them in a body fragment; see render()
         soup_div = self.soup.div
-        if soup_div is None or self.soup.title is None:
-            raise LocalizedException('basic.xhtml is invalid')
+        if soup_div is None:
+            raise LocalizedException('Unable to make chapter body')
         if content is None:
             print('Unable to find content for chapter', self.sanitized_name)
             content = self.soup.new_tag('div')
@@ -119,12 +187,10 @@ class Chapter:
             tag = self.soup.new_tag('div')
             # Make a new tag for the chapter content and both author's notes
 
-            test = notes[0].parent.next_sibling
-            while test != content and test is not None:
-                test = test.next_sibling
+            test = content.find_previous('div', class_='portlet-body author-note')
             # Determine if the author's note comes before chapter content
 
-            if test == content:
+            if test is not None:
                 tag.append(notes[0])
                 tag.append(content)
                 # If the note comes before the content, add it before the content.
@@ -142,132 +208,681 @@ class Chapter:
             tag.append(notes[1])
             soup_div.replace_with(tag)
 
-        self.soup.title.string = self.name
-        #   Substitute the content and name into the template
+    def render(self, pretty: bool = False) -> str:
+        '''Substitutes the content and name into the chapter template.
+        Compact output is much faster to make and smaller; pretty output is
+        re-indented, which makes it easier to read when debugging.'''
+        with stage('render', chapter=self.name) as span:
+            body = self.soup.prettify() if pretty else self.soup.decode(formatter='minimal')
+            span.bytes = len(body)
+            return template('BasicChapter.xhtml').render(title=escape(self.name), body=body)
+
+def _author_info(soup: bs) -> tuple[str|None,str|None]:
+    '''The author's bio and the address of their avatar, from a page showing them'''
+    tag = _find_val_suppress(
+        lambda: soup.find('i', class_='fa fa-info-circle').tag.parent.text # type: ignore[union-attr]
+    )
+    #This finds the information circle icon that preceeds the bio.
+    bio: str|None
+    if tag is None or tag == 'Bio:':
+        bio = None
+    else:
+        bio = tag.strip()
+    img: str|None = _find_val_suppress(
+        lambda: soup.find('div', class_='avatar-container-general').img.attrs['src'] # type: ignore[union-attr]
+    )
+    return (bio, img)
+
+_IMAGE_MARKER = 'rr-image'
+# Stands in for the src of a chapter's images until they are given names in the book.
+
+class TransformedChapter:
+    '''A chapter rendered by transform_chapter(). Its images' srcs are markers; see
+    BookDownloader._do_chapter.'''
+    def __init__(self, xhtml: str, images: list[str], author_info: tuple[str|None, str|None]|None,
+                 missing_src: int, marker: str = _IMAGE_MARKER) -> None:
+        self.xhtml = xhtml
+        self.images = images            # img srcs, in document order; the Nth is marked "marker:N"
+        self.marker = marker            # Found nowhere else in xhtml
+        self.author_info = author_info  # (bio, image address), unless the parse was strained
+        self.missing_src = missing_src  # imgs without a src, which are left alone
+        self.spans: list[SpanRecord] = [] # Timed in a worker process, for the parent's profiler
+
+    def with_images(self, names: list[str]) -> str:
+        '''xhtml with the Nth image's src replaced by names[N]'''
+        return re.sub('"' + re.escape(self.marker) + r':(\d+)"',
+                      lambda match: '"' + names[int(match[1])] + '"', self.xhtml)
+
+def transform_chapter(name: str, html: str, strain: bool, pretty: bool, parser: str) -> TransformedChapter:
+    '''Parses a chapter's page and renders its xhtml. Pure CPU work, so it can run
+    in another process (see ChapterTransformer); everything it needs is passed in.'''
+    chapter = Chapter(name, '')
+    chapter.parse(html, strain, parser)
+    img_tags = [img_tag for img_tag in chapter.soup.find_all('img') if 'src' in img_tag.attrs]
+    images = [str(img_tag.attrs['src']) for img_tag in img_tags]
+    marker = _IMAGE_MARKER
+    attempt = 0
+    while True:
+        for index, img_tag in enumerate(img_tags):
+            img_tag.attrs['src'] = marker + ':' + str(index)
+        xhtml = chapter.render(pretty)
+        if xhtml.count(marker) == len(img_tags):
+            break
+        # The chapter's text has the marker in it too, so try another.
+        attempt += 1
+        marker = _IMAGE_MARKER + '-' + str(attempt)
+    return TransformedChapter(xhtml, images, None if strain else chapter.get_author_info(),
+                              len(chapter.soup.find_all('img')) - len(img_tags), marker)
+
+def _transform_in_worker(name: str, html: str, strain: bool, pretty: bool, parser: str,
+                         profile: bool) -> TransformedChapter:
+    '''transform_chapter() on a worker process, bringing back the spans it timed
+    if the parent is profiling'''
+    recorder = SpanRecorder() if profile else None
+    set_profiler(recorder)
+    # A forked worker starts with a copy of the parent's profiler, which nobody would read.
+    try:
+        with stage('transform', chapter=name):
+            transformed = transform_chapter(name, html, strain, pretty, parser)
+    finally:
+        set_profiler(None)
+    if recorder is not None:
+        transformed.spans = recorder.spans
+    return transformed
+
+class ChapterTransformer:
+    '''Runs transform_chapter() on a pool of worker processes, so parsing and
+    rendering a book's chapters uses every core instead of sharing one under the GIL.
+    One transformer can be shared by every book in a batch.'''
+    def __init__(self, workers: int|None = None) -> None:
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, name: str, html: str, strain: bool, pretty: bool) -> Future[TransformedChapter]:
+        return self._executor.submit(_transform_in_worker, name, html, strain, pretty, _parser,
+                                     profiler() is not None)
+
+    def close(self) -> None:
+        self._executor.shutdown(cancel_futures=True)
+
+_Fetched = tuple[Chapter, int, TransformedChapter|Future[TransformedChapter]]
+# A chapter as the chapter pool leaves it: see BookDownloader._fetch_chapter.
+
+class BookInfo:
+    '''What a fiction's page says about it, before any chapter is downloaded'''
+    def __init__(self,
+                 book_id: str,
+                 url: str,
+                 title: str,
+                 author: str|None,
+                 description: str|None,
+                 cover_url: str|None,
+                 date_updated: str,
+                 chapters: list[Chapter],
+                 author_info: tuple[str|None, str|None]|None = None
+            ) -> None:
+        self.book_id = book_id
+        self.url = url
+        self.title = title
+        self.author = author
+        self.description = description
+        self.cover_url = cover_url
+        self.date_updated = date_updated   # YYYY-MM-DD of the latest chapter
+        self.chapters = chapters           # In book order, with their internal IDs allocated
+        self.author_info = author_info     # (bio, avatar address), if the page shows the author
+
+def fetch_book_info(book_num: str) -> BookInfo:
+    '''Downloads a fiction's page, for its details and list of chapters'''
+    url = _base_url + '/fiction/' + str(book_num)
+    page = scrape(url)
+    title_soup = bs(page.text, _parser)           # Get the webpage of the indicated book.
+    author = _find_val_suppress(
+        lambda: title_soup.find('meta', property='books:author').attrs['content'], # type: ignore[union-attr]
+        'Unable to find author'
+    )
+    description = _find_val_suppress(
+        lambda: title_soup.find(class_='description').text.strip(), # type: ignore[union-attr]
+        'Unable to find book description'
+    )
+    some_name = _find_val_suppress(
+        lambda: str(title_soup.title.string), # type: ignore[union-attr]
+        'unable to find title'
+    )
+    book_name = 'Fiction ' + str(book_num) if some_name is None else some_name[:-13]
+    cover_addr = _find_val_suppress(
+        lambda: title_soup.find('div', class_ ='cover-art-container').img.attrs['src'], # type: ignore[union-attr]
+        'unable to find cover'
+    )
+    author_info: tuple[str|None, str|None]|None = _author_info(title_soup)
+    if author_info == (None, None):
+        author_info = None
+    # The author's box, as on chapter pages, so no chapter has to be downloaded for it.
+
+    if title_soup.table is not None:
+        table = title_soup.table.find_all('td')
+    else:
+        raise Exception('Unable to parse page; no chapters found')
+    chapter_ids = ChapterIds()
+    chapter_list = [Chapter(row.text, row.find('a').get('href'), chapter_ids) for row in table[::2]]
+    #   Get the chapters of the book by searching the table data.
+
+    date_updated = None
+    for row in table[1::2]:
+        try:
+            date_updated = row.time.attrs['title']
+        except AttributeError:
+            pass
+    if date_updated is not None:
+        _d = date_updated.split()
+        # date = f'{_d[3]$$-_d[1]:02$$-_d[2]:02}'
+        date_updated = _d[3]+'-'+month_number(_d[1])+'-'+_d[2].strip(string.punctuation).rjust(2,'0')
+    else:
+        date_updated = '1980-01-01'
+    # Go through the table data, and grab the date of the latest data. Then format appropiately.
+    return BookInfo(str(book_num), url, book_name, author, description, cover_addr, date_updated, chapter_list,
+                    author_info)
 
 class BookDownloader:
     '''Another garbage functional class'''
     _BROKEN_IMAGE_TEXT_START = '<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchBucket'
-    _brokenImage = None
-    with open('./assets/brokenImage.jpg', 'rb') as image:
-        _brokenImage = image.read()
-
-    def __init__(self, book_num: str, single_chapter: int = -1) -> None:
-        print('Finding', book_num)
-        Chapter.reset_class()
-        self.url = 'https://www.royalroad.com/fiction/' + str(book_num)
-        self.book_num = book_num
-        self.single_chapter = single_chapter
-        self._chapter_list: list[Chapter] = []  # List of chapters
-        self._images: dict[str, EpubImage] = {} # Dictionary of images in book
-        self.author_info = None                 # Tuple ( bio, image_address)
-        self._date_updated = None
-
-        page = scrape(self.url)
-        title_soup = bs(page.text, 'html.parser')     # Get the webpage of the indicated book.
-        self.author = _find_val_suppress(
-            lambda: title_soup.find('meta', property='books:author').attrs['content'], # type: ignore[union-attr]
-            'Unable to find author'
-        )
-        self.description = _find_val_suppress(
-            lambda: title_soup.find(class_='description').text.strip(), # type: ignore[union-attr]
-            'Unable to find book description'
-        )
-        some_name = _find_val_suppress(
-            lambda: str(title_soup.title.string), # type: ignore[union-attr]
-            'unable to find title'
-        )
-        if some_name is not None:
-            self.book_name = some_name[:-13]
-
-        self._epub_writer = EpubWriter(self.book_name)
-
-        if title_soup.table is not None:
-            table = title_soup.table.find_all('td')
-        else:
-            raise Exception('Unable to parse page; no chapters found')
-        for row in table[::2]:
-            self._chapter_list.append(Chapter(row.text, row.find('a').get('href')))
-        #   Get the chapters of the book by searching the table data.
-
-        for row in table[1::2]:
-            try:
-                self._date_updated = row.time.attrs['title']
-            except AttributeError:
-                pass
-        if self._date_updated is not None:
-            _d = self._date_updated.split()
-            # date = f'{_d[3]$$-_d[1]:02$$-_d[2]:02}'
-            self._date_updated = _d[3]+'-'+month_number(_d[1])+'-'+_d[2].strip(string.punctuation).rjust(2,'0')
-        else:
-            self._date_updated = '1980-01-01'
-        # Go through the table data, and grab the date of the latest data. Then format appropiately.
-
-        if single_chapter == -1:
-            print(
-                'Downloading',
-                len(self._chapter_list),
-                'chapters of book',
-                self.book_name,
-                'from RoyalRoad'
+    _brokenImage = load_bytes('brokenImage.jpg')
+
+    def __init__(self,
+                 book: BookInfo,
+                 chapters: ChapterSelection|None = None,
+                 workers: int = 1,
+                 existing: str|None = None,
+                 streaming: bool = False,
+                 image_store: ImageStore|None = None,
+                 image_workers: int = 4,
+                 pretty: bool = False,
+                 chapter_executor: Executor|None = None,
+                 image_executor: Executor|None = None,
+                 work_dir: str|None = None,
+                 optimizer: ImageOptimizer|None = None,
+                 compression: CompressionPolicy|None = None,
+                 transformer: ChapterTransformer|None = None,
+                 payload_store: PayloadStore|None = None,
+                 volumes: VolumePolicy|None = None,
+                 catalog: Catalog|None = None,
+                 on_event: Callable[[Event], None]|None = None,
+                 cancel: CancelToken|None = None
+            ) -> None:
+        '''Builds book (see fetch_book_info) as an epub: download(), then build().
+        close(), or a with block, cleans up after either. The chapters picked by
+        chapters are fetched by workers threads (or the shared chapter_executor of a
+        batch) and their images by image_workers (or image_executor). Progress goes to
+        on_event as the events in source.progress; cancel stops the download.
+        The other options are RRTool's, taking the classes that implement them.'''
+        self.info = book
+        self.url = book.url
+        self.book_num = book.book_id
+        self.book_name = book.title
+        self.author = book.author
+        self.description = book.description
+        self.chapters = ChapterSelection() if chapters is None else chapters
+        self.existing = existing
+        self.streaming = streaming
+        self.work_dir = work_dir
+        self.compression = compression
+        self.workers = max(1, workers)          # Chapters fetched at once
+        self.image_workers = max(1, image_workers)
+        self.pretty = pretty
+        self.save_name: str|None = None         # Name of the epub, once download() starts it
+        self._chapter_executor = chapter_executor # Shared pools, or None for the book's own
+        self._image_executor = image_executor
+        self._shared_images = image_executor is not None
+        self._chapter_list: list[Chapter] = book.chapters
+        self._images: dict[str, str] = {}       # Address -> placeholder name of images in book
+        self._image_hashes: dict[str, str] = {} # Content hash -> name of images in book
+        self._image_futures: dict[str, tuple[str, Future[tuple[bytes, str]]]] = {}
+        # Placeholder -> (identity, download) of images in flight; downloads give (data, extension)
+        self._resolved: dict[str, str] = {}     # Placeholder -> name the image ended up with
+        self._pending_chapters: deque[tuple[Chapter, int, str, list[str]]] = deque()
+        # Chapters waiting on their images; (chapter, place, xhtml, placeholders)
+        self._image_store = image_store
+        self._optimizer = optimizer
+        self._transformer = transformer
+        self._payload_store = payload_store
+        self._volume_policy = volumes
+        self._catalog = catalog
+        self._collector: VolumeCollector|None = None  # Chapters and images waiting for their volumes
+        self.volumes: list[str] = []                  # File names of the volumes, once built
+        self._modified: float|None = None             # Date the epubs are given
+        self._transforms: set[Future[TransformedChapter]] = set() # Transforms not yet collected
+        self._image_count = 0                   # Identities handed out to images
+        self._reader: EpubReader|None = None    # Epub being updated
+        self._journal: Journal|None = None      # Work done by an earlier, interrupted run
+        self._epub_writer: EpubWriter|None = None
+        self._toc = TableOfContents()
+        self._on_event = on_event
+        self._event_lock = threading.Lock()
+        self._cancel = cancel
+        self._progress = Progress(0, 0)
+        self.author_info: tuple[str|None, str|None]|None = book.author_info # Tuple ( bio, image_address)
+        self._date_updated = book.date_updated
+
+    def __enter__(self) -> 'BookDownloader':
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def download(self) -> None:
+        '''Downloads the chapters and their images into the epub, which stays
+        save_name + '.part' until build(). With existing, chapters already in that
+        epub are reused and only new ones are downloaded. With a work_dir, finished
+        chapters are journaled, so running an interrupted download again resumes it
+        and gives the same epub byte for byte. Cancelling cancel stops it at its
+        next chapter or image, raising Cancelled.'''
+        self._check()
+        existing = self.existing
+        if existing is not None and self._volume_policy is not None:
+            raise LocalizedException('A book split into volumes is updated by downloading it again')
+        if self._volume_policy is not None and not self.chapters.everything:
+            raise LocalizedException('Only a whole book can be split into volumes, as they are numbered '
+                                     'from its first chapter; ' + str(self.chapters) + ' picks part of it')
+        places = self.chapters.places(len(self._chapter_list))
+        if len(places) == 0:
+            raise LocalizedException('No chapters picked by ' + str(self.chapters) + ' out of '
+                                     + str(len(self._chapter_list)))
+        if existing is not None:
+            self._reader = EpubReader(existing)
+            self._image_count = 1 + max(
+                (int(image.get_short_name()[len('Images/'):]) for image in self._reader.images.values()
+                 if image.get_short_name()[len('Images/'):].isdigit()),
+                default=-1
             )
+            # New images are numbered after the existing ones.
+        if self.work_dir is not None:
+            self._journal = Journal(self.work_dir, self.book_num, {
+                'chapters': str(self.chapters), 'pretty': self.pretty, 'existing': existing, 'parser': _parser
+            })
+            # Chapters are rendered differently by each parser.
+        self._modified = None if self._journal is None else self._journal.started
+        if self._volume_policy is None:
+            self._epub_writer = EpubWriter(self.book_name, streaming=self.streaming, modified=self._modified,
+                                           compression=self.compression)
+            self.save_name = self._epub_writer.create(replace=existing)
         else:
-            print('Downloading chapter from index', single_chapter,
-                  'of book', self.book_name, 'From RoyalRoad')
-
-        self.save_name = self._epub_writer.create()
+            self._collector = VolumeCollector(self._volume_policy, self.compression)
+        if self._image_executor is None:
+            self._image_executor = ThreadPoolExecutor(max_workers=self.image_workers)
 
         # Chapter Retrieval #######################################
-        self._toc = TableOfContents()
-        i = 0
-        for item in self._chapter_list:
-            self._do_chapter(item, place = i)
-            i += 1
-        self.author_info = self._chapter_list[0].get_author_info()
-        self._epub_writer.push_item(self._toc)
+        reused = set() if self._reader is None else self._reader.chapters.keys()
+        resumed = {place: self._journaled(place) for place in places}
+        new = [place for place in places if self._chapter_list[place].sanitized_name not in reused]
+        to_fetch = [place for place in new if resumed[place] is None]
+        self._progress = Progress(len(places), len(to_fetch))
+        self._emit(BookStarted(self.book_num, self.book_name, len(self._chapter_list), len(places),
+                               len(new), len(new) - len(to_fetch), existing))
+        with closing(self._fetch_chapters(to_fetch)) as fetched:
+            for place in places:
+                self._check()
+                chapter = self._chapter_list[place]
+                journaled = resumed[place]
+                size = 0
+                if chapter.sanitized_name in reused:
+                    self._reuse_chapter(chapter, place)
+                    source = 'reused'
+                elif journaled is not None:
+                    self._resume_chapter(chapter, place, journaled)
+                    source = 'resumed'
+                else:
+                    chapter, size, transform = next(fetched)[1]
+                    self._do_chapter(chapter, place, transform)
+                    source = 'downloaded'
+                self._progress.chapter_done(source == 'downloaded')
+                self._emit(ChapterFinished(self.book_num, place, chapter.name, source, size,
+                                           self._progress.done, self._progress.total,
+                                           self._progress.bytes, self._progress.eta()))
+        self._flush_chapters(wait=True)
+        if self.author_info is None and self._reader is not None:
+            bio, image = self._reader.author_info()
+            self.author_info = (bio, None if image is None else image.href)
+            if image is not None:
+                self._reuse_image(image)
+            # The first chapter was reused, so the author is as the epub being updated has them.
+        if self.author_info is None:
+            self.author_info = (None, None)
+            # Neither the fiction page nor a downloaded first chapter showed the author.
+
+    def build(self) -> str:
+        '''Adds the table of contents, cover and author's page to the downloaded
+        chapters and finishes the epub, or each of its volumes (see _build_volumes).
+        Returns its file name. Each epub is recorded in catalog.'''
+        if (self._epub_writer is None or self.save_name is None) and self._collector is None \
+                or self.author_info is None:
+            raise LocalizedException('Nothing downloaded to build')
+        self._check()
 
         # Cover ###################################################
-        cover_addr = _find_val_suppress(
-            lambda: title_soup.find('div', class_ ='cover-art-container').img.attrs['src'], # type: ignore[union-attr]
-            'unable to find cover'
-        )
         img_name = None
-        if cover_addr is not None:
-            img_name = self._retrieve_image(cover_addr).get_name()
+        if self.info.cover_url is not None:
+            img_name = self._resolve_image(self._retrieve_image(self.info.cover_url, 'cover'))
         #   Get cover
 
         img_address = self.author_info[1]
-        author_image = None if img_address is None else self._retrieve_image(img_address).get_name()
-        self._epub_writer.push_item(EpubCover(img_name, self.book_name))
-        self._epub_writer.complete(self.author, self.author_info[0], author_image,self.description, book_num, self._date_updated)
-
-    def _do_chapter(self, chapter: Chapter, place: int = 0) -> None:
-        if self.single_chapter == -1 :
-            print('Getting index '+str(place) + '/' + str(len(self._chapter_list)-1),
-                  'chapter', chapter.name)
-        elif place != self.single_chapter:
+        author_image = None if img_address is None else self._resolve_image(self._retrieve_image(img_address, 'author'))
+        if self._epub_writer is None or self.save_name is None:
+            self.save_name = self._build_volumes(img_name, author_image)
+        else:
+            self._epub_writer.push_item(self._toc)
+            self._epub_writer.push_item(EpubCover(img_name, self.book_name))
+            self._epub_writer.complete(self.author, self.author_info[0], author_image, self.description,
+                                       self.book_num, self._date_updated)
+            self.volumes = [self.save_name]
+            self._record(self.save_name)
+            self._emit(BookWritten(self.book_num, self.save_name, self._progress.total,
+                                   self._progress.bytes, self._progress.seconds()))
+        if self._journal is not None:
+            self._journal.discard()
+            self._journal = None
+        return self.save_name
+
+    def _build_volumes(self, cover: str|None, author_image: str|None) -> str:
+        '''Writes each volume the policy splits the book into as an epub of its own,
+        several at once; volumes an earlier build left with the same contents are
+        kept as they are. Returns the first one's file name.'''
+        if self._collector is None:
+            raise LocalizedException('Not split into volumes')
+        collector = self._collector
+        shared = [name for name in (cover, author_image) if name is not None]
+        volumes = collector.policy.split(collector.chapters, collector.image_sizes,
+                                         sum(collector.image_sizes[name] for name in shared))
+        with ThreadPoolExecutor(max_workers=min(len(volumes), os.cpu_count() or 1)) as executor:
+            self.volumes = list(executor.map(self._write_volume, range(1, len(volumes) + 1), volumes,
+                                             repeat(cover), repeat(author_image)))
+            # zlib releases the GIL, so the volumes really are compressed in parallel.
+        collector.release()
+        return self.volumes[0]
+
+    def _write_volume(self, number: int, chapters: list[CollectedChapter], cover: str|None,
+                      author_image: str|None) -> str:
+        '''Writes one volume, unless the epub an earlier build left has the same
+        contents. Returns its file name.'''
+        if self._collector is None or self.author_info is None:
+            raise LocalizedException('Not split into volumes')
+        self._check()
+        collector = self._collector
+        title = self.book_name + ' - Volume ' + str(number)
+        save_name = epub_name(title)
+        images: dict[str, str] = {}     # Name -> content hash, of the images this volume shows
+        for name in [*(name for name in (cover, author_image) if name is not None),
+                     *(name for chapter in chapters for name in chapter.images)]:
+            if name in collector.image_digests:
+                images.setdefault(name, collector.image_digests[name])
+        contents = fingerprint((title, self.author, self.description, self.author_info[0], cover, author_image),
+                               chapters, images)
+        if os.path.exists(save_name):
+            try:
+                reader = EpubReader(save_name)
+                unchanged = reader.fingerprint == contents
+                reader.close()
+            except (OSError, zipfile.BadZipFile, EpubException):
+                unchanged = False
+            if unchanged:
+                self._emit(Notice(self.book_num, save_name + ' is unchanged'))
+                self._record(save_name)
+                return save_name
+
+        start = time.perf_counter()
+        writer = EpubWriter(title, streaming=self.streaming, modified=self._modified, compression=self.compression)
+        writer.create(replace=save_name)
+        try:
+            toc = TableOfContents()
+            for name in images:
+                writer.push_item(collector.images[name].share())
+            for chapter in chapters:
+                toc.push_chapter(chapter.item)
+                writer.push_item(chapter.item)
+            writer.push_item(toc)
+            writer.push_item(EpubCover(cover, title))
+            writer.complete(self.author, self.author_info[0], author_image, self.description,
+                            self.book_num + '-vol' + str(number), self._date_updated,
+                            series=(self.book_name, number), fingerprint=contents)
+        finally:
+            writer.abort()
+            # Does nothing once complete.
+        self._record(save_name)
+        self._emit(BookWritten(self.book_num, save_name, len(chapters), self._progress.bytes,
+                               time.perf_counter() - start))
+        return save_name
+
+    def close(self) -> None:
+        '''Stops any downloads still running and closes the epubs. An epub that
+        wasn't built is deleted; its journal is kept, to resume from.'''
+        if self._image_executor is not None:
+            if self._shared_images:
+                for _, download in self._image_futures.values():
+                    download.cancel()
+            else:
+                self._image_executor.shutdown(cancel_futures=True)
+                self._image_executor = None
+        for transform in list(self._transforms):
+            transform.cancel()
+        if self._epub_writer is not None:
+            self._epub_writer.abort()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    @property
+    def _writer(self) -> EpubWriter|VolumeCollector:
+        if self._collector is not None:
+            return self._collector
+        if self._epub_writer is None:
+            raise LocalizedException('The epub is only written while downloading')
+        return self._epub_writer
+
+    def _emit(self, event: Event) -> None:
+        if self._on_event is not None:
+            with self._event_lock:
+                self._on_event(event)
+
+    def _record(self, save_name: str) -> None:
+        '''Adds an epub that was written to the catalog; a catalog that can't be
+        written to doesn't fail the download'''
+        if self._catalog is None:
+            return
+        try:
+            self._catalog.record(save_name)
+        except (OSError, sqlite3.Error, zipfile.BadZipFile, EpubException) as issue:
+            self._emit(Notice(self.book_num, 'Unable to add ' + save_name + ' to the catalog: ' + str(issue)))
+
+    def _check(self) -> None:
+        if self._cancel is not None:
+            self._cancel.check()
+
+    def _fetch_chapters(self, places: list[int]) -> Generator[tuple[int, _Fetched], None, None]:
+        '''Downloads and parses the given chapters on a pool of workers.
+        Results are yielded in book order, regardless of completion order.'''
+        if self._chapter_executor is not None:
+            yield from self._fetch_in_order(self._chapter_executor, places)
+            # Books sharing the pool each keep a window of chapters queued on it, so
+            # it takes turns between them rather than finishing one book first.
             return
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            yield from self._fetch_in_order(executor, places)
+        finally:
+            executor.shutdown(cancel_futures=True)
+            # Don't leave stragglers downloading if a chapter failed.
+
+    def _fetch_in_order(self, executor: Executor, places: list[int]) -> Generator[tuple[int, _Fetched], None, None]:
+        '''executor.map() of _fetch_chapter, keeping only twice as many chapters in
+        flight as there are workers: chapters that finish behind a slow one wait in
+        memory until it arrives, so the window bounds how many do. Closing it cancels
+        the chapters not yet started.'''
+        upcoming = iter(places)
+        in_flight: deque[tuple[int, Future[_Fetched]]] = deque(
+            (place, executor.submit(self._fetch_chapter, place)) for place in islice(upcoming, 2 * self.workers))
+        try:
+            while len(in_flight) > 0:
+                place, fetch = in_flight.popleft()
+                for following in islice(upcoming, 1):
+                    in_flight.append((following, executor.submit(self._fetch_chapter, following)))
+                yield place, fetch.result()
+        finally:
+            for _, fetch in in_flight:
+                fetch.cancel()
+
+    def _fetch_chapter(self, place: int) -> _Fetched:
+        '''Runs on the chapter pool. The chapter, the size of its page, and the page
+        transformed, or being transformed on the transformer's processes.'''
+        self._check()
+        chapter = self._chapter_list[place]
+        self._emit(ChapterStarted(self.book_num, place, chapter.name, len(self._chapter_list)))
+        with stage('download', chapter=chapter.name) as span:
+            page = scrape(chapter.url)
+            size = span.bytes = len(page.content)
+        self._progress.add_bytes(size)
+        strain = place != 0 or self.author_info is not None
+        # Chapter 0 is parsed in full for the author's info, unless the fiction page had it.
+        if self._transformer is None:
+            with stage('transform', chapter=chapter.name):
+                return chapter, size, transform_chapter(chapter.name, page.text, strain, self.pretty, _parser)
+        transform = self._transformer.submit(chapter.name, page.text, strain, self.pretty)
+        self._transforms.add(transform)
+        return chapter, size, transform
+
+    def _reuse_chapter(self, chapter: Chapter, place: int) -> None:
+        '''Copies a chapter, and the images it shows, out of the epub being updated'''
+        if self._reader is None:
+            raise LocalizedException('No epub to reuse chapters from')
+        item = self._reader.chapters[chapter.sanitized_name][1]
+        data = self._reader.read(item).decode('UTF-8')
+        for image in self._reader.referenced_images(data):
+            self._reuse_image(image)
+        self._queue_chapter(chapter, place, data, [])
+
+    def _reuse_image(self, image: ExistingItem) -> str:
+        '''Copies an image out of the epub being updated, once, and returns its name.
+        It is resolved already; its href stands for it as an address would.'''
+        if self._reader is None:
+            raise LocalizedException('No epub to reuse images from')
+        if image.href not in self._images:
+            resource = self._reader.read(image)
+            epub_image = EpubImage(resource, image.get_ext(), image.get_short_name()[len('Images/'):],
+                                   self._payload_store)
+            self._images[image.href] = self._resolved[epub_image.get_name()] = epub_image.get_name()
+            self._image_hashes.setdefault(content_hash(resource), epub_image.get_name())
+            self._writer.push_item(epub_image)
+        return self._images[image.href]
+
+    def _do_chapter(self, chapter: Chapter, place: int,
+                    transform: TransformedChapter|Future[TransformedChapter]) -> None:
+        '''Names the images of a transformed chapter, starting their downloads, and queues it.
+        This, rather than the transform, is where image names are handed out, so they
+        follow book order however the chapters were transformed.'''
+        if isinstance(transform, Future):
+            with stage('await_transform', chapter=chapter.name):
+                transformed = transform.result()
+            self._transforms.discard(transform)
+            recording = profiler()
+            if recording is not None:
+                recording.merge(transformed.spans)
         else:
-            print('Getting chapter', chapter.name)
-        chapter.get_data()
-
-        imgs = chapter.soup.find_all('img')
-        # Get all the images in the chapter
-        for img_tag in imgs:
-            # Process every image
-            if 'src' not in img_tag.attrs:
-                print('Warning: img without src')
-                continue # if there isn't an image, skip
-
-            img_tag.attrs['src'] = self._retrieve_image(img_tag.attrs['src']).get_name()
-
-        epub_chapter = EpubChapter(chapter.name, chapter.sanitized_name, place, chapter.soup.prettify())
-        self._toc.push_chapter(epub_chapter)
-        self._epub_writer.push_item(epub_chapter)
-
-    def _retrieve_image(self, rsc_addr: str) -> EpubImage:
+            transformed = transform
+        names: list[str] = []           # Placeholder of each marked image
+        sources: list[list[str]] = []   # (src, placeholder), for the journal
+        with stage('rewrite_images', chapter=chapter.name):
+            for _ in range(transformed.missing_src):
+                self._emit(Notice(self.book_num, 'Warning: img without src'))
+            for src in transformed.images:
+                placeholder = self._retrieve_image(src)
+                sources.append([src, placeholder])
+                names.append(placeholder)
+            data = transformed.with_images(names)
+        placeholders = list(dict.fromkeys(names))
+        if place == 0 and transformed.author_info is not None:
+            self.author_info = transformed.author_info
+        if self._journal is not None:
+            self._journal.record_chapter(chapter.sanitized_name, chapter.url, data, sources,
+                                         transformed.author_info if place == 0 else None)
+        self._queue_chapter(chapter, place, data, placeholders)
+
+    def _journaled(self, place: int) -> JournaledChapter|None:
+        '''The chapter at place as an earlier run rendered it, if it is still the same chapter'''
+        if self._journal is None:
+            return None
+        chapter = self._chapter_list[place]
+        journaled = self._journal.chapters.get(chapter.sanitized_name)
+        if journaled is None or journaled.url != chapter.url:
+            return None
+        return journaled
+
+    def _resume_chapter(self, chapter: Chapter, place: int, journaled: JournaledChapter) -> None:
+        '''Queues a chapter rendered by an earlier run. Its images are requested in the
+        same order as when it was rendered, so they get the same placeholders unless
+        the chapters before it changed; any that differ are renamed.'''
+        placeholders: list[str] = []
+        renamed: dict[str, str] = {}
+        for src, old_placeholder in journaled.images:
+            placeholder = self._retrieve_image(src)
+            if placeholder != old_placeholder:
+                renamed[old_placeholder] = placeholder
+            if placeholder not in placeholders:
+                placeholders.append(placeholder)
+        data = journaled.read()
+        if len(renamed) > 0:
+            data = re.sub(r'"(Images/[^"]+)"', lambda match: '"' + renamed.get(match[1], match[1]) + '"', data)
+        if place == 0 and journaled.author_info is not None:
+            self.author_info = (journaled.author_info[0], journaled.author_info[1])
+        self._queue_chapter(chapter, place, data, placeholders)
+
+    def _queue_chapter(self, chapter: Chapter, place: int, data: str, placeholders: list[str]) -> None:
+        '''Holds a finished chapter until the images it shows have arrived.
+        Chapters are added to the book in the order they are queued.'''
+        self._pending_chapters.append((chapter, place, data, placeholders))
+        self._flush_chapters(wait=False)
+
+    def _flush_chapters(self, wait: bool) -> None:
+        '''Adds queued chapters to the book, up to the first whose images are still
+        downloading, or all of them if wait is set'''
+        while len(self._pending_chapters) > 0:
+            chapter, place, data, placeholders = self._pending_chapters[0]
+            if not wait and not all(self._image_futures[placeholder][1].done()
+                                    for placeholder in placeholders if placeholder in self._image_futures):
+                return
+            self._pending_chapters.popleft()
+            for placeholder in placeholders:
+                name = self._resolve_image(placeholder)
+                if name != placeholder:
+                    data = data.replace('"' + placeholder + '"', '"' + name + '"')
+                    # The picture was already in the book under another name.
+            epub_chapter = EpubChapter(chapter.name, chapter.sanitized_name, place, data, self._payload_store)
+            self._toc.push_chapter(epub_chapter)
+            self._writer.push_item(epub_chapter)
+
+    def _resolve_image(self, placeholder: str) -> str:
+        '''Waits for an image and adds it to the book, unless identical bytes already are.
+        Returns the name the image ended up with.'''
+        if placeholder in self._resolved:
+            return self._resolved[placeholder]
+        identity, download = self._image_futures.pop(placeholder)
+        resource, ext = download.result()
+        digest = content_hash(resource)
+        if digest in self._image_hashes:
+            name = self._image_hashes[digest]
+        else:
+            epub_image = EpubImage(resource, ext, identity, self._payload_store)
+            name = self._image_hashes[digest] = epub_image.get_name()
+            self._writer.push_item(epub_image)
+        self._resolved[placeholder] = name
+        return name
+
+    def _retrieve_image(self, rsc_addr: str, identity: str|None = None) -> str:
+        '''Starts downloading the image at rsc_addr, once per address, and returns
+        the placeholder name it will have in the book. See _resolve_image.
+        Chapters' images are numbered in book order; the cover and author's image
+        are given identities of their own, so their names don't change as chapters
+        with more images are added, and neither do the volumes that show them.'''
         if rsc_addr[0] == '/' :
-            rsc_addr = 'https://www.royalroad.com' + rsc_addr
+            rsc_addr = _base_url + rsc_addr
 
         if not '.gstatic.com/images?' in rsc_addr:
             rsc_addr = rsc_addr.partition('?')[0]
@@ -280,23 +895,57 @@ class BookDownloader:
         ext = os.path.splitext(rsc_addr)[1]
         # split extension
 
-        resource: bytes|None
+        if identity is None:
+            identity = str(self._image_count)
+            self._image_count += 1
+        placeholder = self._images[rsc_addr] = 'Images/' + identity + ext
+        if self._image_executor is None:
+            raise LocalizedException('Images are only retrieved while downloading')
+        self._image_futures[placeholder] = (
+            identity, self._image_executor.submit(self._download_image, rsc_addr, ext)
+        )
+        return placeholder
+
+    def _download_image(self, rsc_addr: str, ext: str) -> tuple[bytes, str]:
+        '''Runs on the image pool. The image as it goes in the book, and its extension.'''
+        self._check()
+        with stage('retrieve_image', url=rsc_addr) as span:
+            resource = self._fetch_image(rsc_addr)
+            span.bytes = len(resource)
+        if self._optimizer is not None:
+            with stage('optimize_image', url=rsc_addr) as span:
+                resource, ext = self._optimizer.submit(resource, ext).result()
+                # The work is done in another process; this thread only waits.
+                span.bytes = len(resource)
+        return resource, ext
+
+    def _fetch_image(self, rsc_addr: str) -> bytes:
+        '''The image as downloaded, or as an earlier run or book downloaded it'''
+        resource: bytes|None = None
+        if self._journal is not None:
+            resource = self._journal.image(rsc_addr)
+            if resource is not None:
+                return resource
+        if self._image_store is not None:
+            resource = self._image_store.lookup(rsc_addr)
         try:
-            resource = scrape(rsc_addr).content
-            # Get the resource
-            if str(resource)[2:100].startswith(BookDownloader._BROKEN_IMAGE_TEXT_START):
-                print('Royal Road image broken: ', rsc_addr)
-                resource = BookDownloader._brokenImage
-
-        except requests.exceptions.ConnectionError as error:
+            if resource is None:
+                resource = scrape(rsc_addr).content
+                self._progress.add_bytes(len(resource))
+                # Get the resource
+                if str(resource)[2:100].startswith(BookDownloader._BROKEN_IMAGE_TEXT_START):
+                    self._emit(Notice(self.book_num, 'Royal Road image broken: ' + rsc_addr))
+                    resource = BookDownloader._brokenImage
+                elif self._image_store is not None:
+                    self._image_store.store(rsc_addr, resource)
+                if self._journal is not None:
+                    self._journal.record_image(rsc_addr, resource)
+
+        except ConnectionError as error:
             resource = BookDownloader._brokenImage
             #if the image cannot be loaded, use a broken image icon
-            print(error, 'Unable to retrieve image: ', rsc_addr)
-        if resource is not None:
-            self._images[rsc_addr] = EpubImage(resource, ext, str(len(self._images)))
-            self._epub_writer.push_item(self._images[rsc_addr])
-
-        return self._images[rsc_addr]
+            self._emit(Notice(self.book_num, str(error.args[0]) + ' Unable to retrieve image: ' + rsc_addr))
+        return resource
 
 def month_number(month: str) -> str:
     '''converts month str into 2 digit month'''
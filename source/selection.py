@@ -0,0 +1,36 @@
+'''Which of a book's chapters to download'''
+
+class ChapterSelection:
+    '''Chapters picked by their place in the book, counting from 0 as -s does:
+    ranges from start up to but not including end, as Python slices (either may be
+    None for the start or end of the book, and negative counts from the end), and
+    the last chapters. A chapter in any of them is picked; with none, all are.'''
+    def __init__(self, ranges: list[tuple[int|None, int|None]]|None = None, last: int|None = None) -> None:
+        self.ranges = [] if ranges is None else ranges
+        self.last = last
+
+    @property
+    def everything(self) -> bool:
+        return len(self.ranges) == 0 and self.last is None
+
+    def places(self, count: int) -> list[int]:
+        '''The places picked out of a book of count chapters, in book order'''
+        if self.everything:
+            return list(range(count))
+        picked: set[int] = set()
+        for start, end in self.ranges:
+            picked.update(range(count)[start:end])
+        if self.last is not None and self.last > 0:
+            picked.update(range(max(0, count - self.last), count))
+        return sorted(picked)
+
+    def __str__(self) -> str:
+        parts = [('' if start is None else str(start)) + ':' + ('' if end is None else str(end))
+                 for start, end in self.ranges]
+        if self.last is not None:
+            parts.append('last ' + str(self.last))
+        return ','.join(parts) if len(parts) > 0 else 'all'
+
+def single(index: int) -> tuple[int, int|None]:
+    '''The range of the one chapter at index'''
+    return index, None if index == -1 else index + 1
@@ -0,0 +1,49 @@
+'''Assets, read once from the package and compiled for fast rendering'''
+import string
+import pathlib
+import functools
+from typing import Iterable, TextIO
+
+ASSET_DIR = pathlib.Path(__file__).resolve().parent.parent / 'assets'
+# Relative to the package, so the tool works from any directory.
+
+@functools.lru_cache(maxsize=None)
+def load_text(name: str) -> str:
+    with open(ASSET_DIR / name, mode='r', encoding='UTF-8') as stream:
+        return stream.read()
+
+@functools.lru_cache(maxsize=None)
+def load_bytes(name: str) -> bytes:
+    with open(ASSET_DIR / name, mode='rb') as stream:
+        return stream.read()
+
+class Template:
+    '''An asset with {slot} fields, in str.format syntax ({{ and }} for literal braces).
+    The text is split into literals and slots once; rendering only joins strings.'''
+    def __init__(self, text: str) -> None:
+        self._parts: list[tuple[str, str|None]] = [
+            (literal, field) for literal, field, _, _ in string.Formatter().parse(text)
+        ]
+
+    def render(self, **slots: str) -> str:
+        return ''.join(literal if field is None else literal + slots[field]
+                       for literal, field in self._parts)
+
+    def render_to(self, stream: TextIO, **slots: str|Iterable[str]) -> None:
+        '''Writes the template to stream. A slot may be an iterable of strings,
+        which is written piece by piece, so large documents are never whole in memory.'''
+        for literal, field in self._parts:
+            stream.write(literal)
+            if field is None:
+                continue
+            value = slots[field]
+            if isinstance(value, str):
+                stream.write(value)
+            else:
+                for piece in value:
+                    stream.write(piece)
+
+@functools.lru_cache(maxsize=None)
+def template(name: str) -> Template:
+    '''The compiled template for an asset, shared by every book'''
+    return Template(load_text(name))
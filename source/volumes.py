@@ -0,0 +1,107 @@
+'''Splitting a long book into volumes, each a complete epub of its own'''
+import re
+import hashlib
+from typing import Iterable
+from typing_extensions import Self
+from source.epub_writer import EpubChapter, EpubImage, CompressionPolicy
+from source.image_store import content_hash
+
+_ENTRY_OVERHEAD = 200
+# Bytes each entry adds besides its data: zip headers, and its lines in content.opf and toc.ncx.
+
+_VOLUME_OVERHEAD = 16 * 1024
+# Bytes of a volume besides its chapters and images: style, cover, author page, TOC, opf and ncx.
+
+class VolumePolicy:
+    '''Where volumes end: after chapters chapters, or before the volume's epub would
+    grow past size bytes, whichever comes first; a volume holds at least one chapter.
+    Boundaries are worked out from the first chapter on, from nothing but the
+    chapters before them, so chapters added to the end of a book never move them:
+    an update only changes the last volume, and adds new ones.'''
+    def __init__(self, chapters: int|None = None, size: int|None = None) -> None:
+        self.chapters = chapters
+        self.size = size
+
+    def split(self, chapters: list['CollectedChapter'], image_sizes: dict[str, int],
+              shared_size: int = 0) -> list[list['CollectedChapter']]:
+        '''Chapters in book order, as volumes. Images each volume shows are counted
+        towards it once, at their size in image_sizes; shared_size is what every
+        volume holds, e.g. the cover.'''
+        volumes: list[list[CollectedChapter]] = []
+        volume: list[CollectedChapter] = []
+        in_volume: set[str] = set()
+        size = 0
+        for chapter in chapters:
+            new_images = [name for name in chapter.images if name not in in_volume]
+            chapter_size = chapter.size + sum(image_sizes.get(name, 0) for name in new_images)
+            if len(volume) > 0 and (
+                    (self.chapters is not None and len(volume) >= self.chapters)
+                    or (self.size is not None and _VOLUME_OVERHEAD + shared_size + size + chapter_size > self.size)):
+                volumes.append(volume)
+                volume, in_volume, size = [], set(), 0
+                new_images = chapter.images
+                chapter_size = chapter.size + sum(image_sizes.get(name, 0) for name in new_images)
+            volume.append(chapter)
+            in_volume.update(new_images)
+            size += chapter_size
+        if len(volume) > 0:
+            volumes.append(volume)
+        return volumes
+
+class CollectedChapter:
+    '''A finished chapter waiting for its volume'''
+    def __init__(self, item: EpubChapter, images: list[str], size: int, digest: str) -> None:
+        self.item = item
+        self.images = images    # Names of the images it shows, in order
+        self.size = size        # Bytes it takes in the epub, compressed
+        self.digest = digest    # Hash of its xhtml
+
+class VolumeCollector:
+    '''Stands in for the EpubWriter while a book that is split into volumes downloads,
+    keeping what is pushed to it until the volumes can be worked out.
+    Sizes are only measured when the policy splits by size.'''
+    def __init__(self, policy: VolumePolicy, compression: CompressionPolicy|None = None) -> None:
+        self.policy = policy
+        self.compression = CompressionPolicy() if compression is None else compression
+        self.chapters: list[CollectedChapter] = []
+        self.images: dict[str, EpubImage] = {}  # Name -> image, in the order they were pushed
+        self.image_digests: dict[str, str] = {} # Name -> content hash
+        self.image_sizes: dict[str, int] = {}   # Name -> bytes it takes in the epub
+
+    def push_item(self, item: EpubImage|EpubChapter) -> Self:
+        data = item.get_data()
+        if isinstance(data, str):
+            data = data.encode('UTF-8')
+        if isinstance(item, EpubImage):
+            self.images[item.get_name()] = item
+            self.image_digests[item.get_name()] = content_hash(data)
+            self.image_sizes[item.get_name()] = self._zip_size(item.get_ext(), data)
+        else:
+            images = list(dict.fromkeys(re.findall(r'src="(Images/[^"]+)"', data.decode('UTF-8'))))
+            self.chapters.append(CollectedChapter(item, images, self._zip_size(item.get_ext(), data),
+                                                  content_hash(data)))
+        return self
+
+    def _zip_size(self, ext: str, data: bytes) -> int:
+        if self.policy.size is None:
+            return 0
+        return self.compression.compressed_size(ext, data) + _ENTRY_OVERHEAD
+
+    def release(self) -> None:
+        for chapter in self.chapters:
+            chapter.item.release()
+        for image in self.images.values():
+            image.release()
+
+def fingerprint(metadata: Iterable[str|None], chapters: list[CollectedChapter], images: dict[str, str]) -> str:
+    '''Identifies what a volume holds: if it matches an existing volume's, that
+    volume needn't be written again. images maps the names it shows to their hashes.'''
+    digest = hashlib.sha256()
+    for value in metadata:
+        digest.update(b'\0' + ('' if value is None else value).encode('UTF-8'))
+    for chapter in chapters:
+        digest.update(b'\1' + chapter.item.get_name().encode('UTF-8') + b'\0'
+                      + chapter.item.get_raw_name().encode('UTF-8') + b'\0' + chapter.digest.encode())
+    for name, image_digest in images.items():
+        digest.update(b'\2' + name.encode('UTF-8') + b'\0' + image_digest.encode())
+    return digest.hexdigest()
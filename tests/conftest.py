@@ -0,0 +1,24 @@
+'''A local stand-in for RoyalRoad, for tests that download books'''
+import os
+from typing import Iterator
+import pytest
+from bench.server import StandinServer
+from source.rr_dwnldr import base_url, set_base_url
+from source.http_session import HttpSession, RetryPolicy, default_session, set_default_session
+
+@pytest.fixture
+def standin(tmp_path: os.PathLike[str], monkeypatch: pytest.MonkeyPatch) -> Iterator[StandinServer]:
+    '''A stand-in serving 6 chapters with an image each, which downloads go to.
+    Tests run in tmp_path, where the epubs are written.'''
+    server = StandinServer(chapters=6, image_size=2048).start()
+    previous_url, previous_session = base_url(), default_session()
+    set_base_url(server.url)
+    session = HttpSession(retry=RetryPolicy(retries=2, backoff=0.01, max_backoff=0.05, jitter=0))
+    set_default_session(session)
+    monkeypatch.chdir(tmp_path)
+    yield server
+    set_default_session(previous_session)
+    set_base_url(previous_url)
+    session.close()
+    server.shutdown()
+    server.server_close()
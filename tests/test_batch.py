@@ -0,0 +1,39 @@
+'''A batch writes every book under a name of its own, and reports on each'''
+import os
+import sys
+import pytest
+import RRTool
+from bench.server import StandinServer
+from source.batch import download_books
+from source.epub_reader import EpubReader
+
+def book_id(path: str) -> str:
+    reader = EpubReader(path)
+    try:
+        return reader.book_id
+    finally:
+        reader.close()
+
+def test_books_with_the_same_title_are_kept_apart(standin: StandinServer) -> None:
+    results = download_books(['1', '2', '3'], books=3)
+    assert all(result.ok for result in results)
+    names = [result.save_name for result in results]
+    assert all(name is not None for name in names)
+    assert len(set(names)) == 3
+    assert sorted(os.listdir('.')) == sorted(name for name in names if name is not None)
+    assert [book_id(name) for name in names if name is not None] == ['1', '2', '3']
+
+def test_summary_reports_each_book(standin: StandinServer, monkeypatch: pytest.MonkeyPatch,
+                                   capsys: pytest.CaptureFixture[str]) -> None:
+    monkeypatch.setattr(sys, 'argv', ['RRTool.py', 'batch', '1', 'missing', '2', '--site', standin.url,
+                                      '--retries', '0'])
+    with pytest.raises(SystemExit) as exited:
+        RRTool.main()
+    assert exited.value.code == 1
+    lines = capsys.readouterr().out.splitlines()
+    summary = lines[lines.index('') + 1:]
+    assert [line.split()[:2] for line in summary[:3]] == [['ok', '1'], ['FAILED', 'missing'], ['ok', '2']]
+    assert summary[0].split(None, 3)[3] != summary[2].split(None, 3)[3]
+    # The books' file names.
+    assert 'The story does not exist' in summary[1]
+    assert summary[3] == '2 of 3 books downloaded'
@@ -0,0 +1,46 @@
+'''The catalog knows which epubs beside it it holds'''
+import os
+import shutil
+from source.catalog import Catalog
+from source.epub_writer import EpubWriter, EpubChapter, TableOfContents, EpubCover
+
+def build(path: str) -> None:
+    writer = EpubWriter('Listed', log=open(os.devnull, 'w', encoding='UTF-8'))
+    writer.create(replace=path)
+    toc = TableOfContents()
+    chapter = EpubChapter('One', 'Chapter_0', 0, '<p>One</p>')
+    toc.push_chapter(chapter)
+    writer.push_item(chapter)
+    writer.push_item(toc)
+    writer.push_item(EpubCover(None, 'Listed'))
+    writer.complete('Author', None, None, None, '1', '2021-01-01')
+
+def test_epubs_added_by_hand_are_unlisted(tmp_path: os.PathLike[str]) -> None:
+    first = os.path.join(tmp_path, 'first.epub')
+    build(first)
+    catalog = Catalog(os.path.join(tmp_path, '.rrcatalog.db'))
+    try:
+        assert catalog.reindex() == (1, 0, 0)
+        assert catalog.unlisted() == []
+        second = os.path.join(tmp_path, 'second.epub')
+        shutil.copyfile(first, second)
+        with open(os.path.join(tmp_path, 'notes.txt'), 'w', encoding='UTF-8') as stream:
+            stream.write('not an epub')
+        assert catalog.unlisted() == [second]
+        catalog.reindex()
+        assert catalog.unlisted() == []
+    finally:
+        catalog.close()
+
+def test_unreadable_epubs_stay_unlisted(tmp_path: os.PathLike[str]) -> None:
+    broken = os.path.join(tmp_path, 'broken.epub')
+    with open(broken, 'wb') as stream:
+        stream.write(b'not a zip')
+    catalog = Catalog(os.path.join(tmp_path, '.rrcatalog.db'))
+    issues: list[str] = []
+    try:
+        catalog.reindex(on_error=lambda path, issue: issues.append(path))
+        assert issues == [broken]
+        assert catalog.unlisted() == [broken]
+    finally:
+        catalog.close()
@@ -0,0 +1,33 @@
+'''ChapterIds hands out unique, repeatable IDs, however many chapters share a title'''
+import time
+from source.rr_dwnldr import ChapterIds
+
+def allocate(names: list[str]) -> list[str]:
+    ids = ChapterIds()
+    return [ids.allocate(name) for name in names]
+
+def test_duplicates_get_the_first_free_suffix() -> None:
+    assert allocate(['Interlude', 'Interlude', 'One', 'Interlude']) == \
+        ['Interlude', 'Interlude_2', 'One', 'Interlude_3']
+
+def test_names_that_look_suffixed_are_skipped() -> None:
+    names = ['Interlude_2', 'Interlude', 'Interlude', 'Interlude_3', 'Interlude', 'Interlude_2']
+    allocated = allocate(names)
+    assert allocated == ['Interlude_2', 'Interlude', 'Interlude_3', 'Interlude_3_2', 'Interlude_4', 'Interlude_2_2']
+    assert len(set(allocated)) == len(names)
+
+def test_the_same_names_give_the_same_ids() -> None:
+    names = ['Part_2', 'Part', 'Part', 'Part_2', 'Epilogue', 'Part', 'Epilogue']
+    assert allocate(names) == allocate(names)
+
+def test_many_duplicates_are_allocated_promptly() -> None:
+    names = ['Chapter'] * 20000 + ['Chapter_' + str(i) for i in range(2, 100)] + ['Chapter'] * 100
+    start = time.perf_counter()
+    allocated = allocate(names)
+    assert time.perf_counter() - start < 2.0
+    assert len(set(allocated)) == len(names)
+    ids = ChapterIds()
+    for name in names:
+        ids.allocate(name)
+    assert len(ids) == len(names)
+    assert 'Chapter_20100' in ids
@@ -0,0 +1,46 @@
+'''RRTool's commands clean up after downloads that stop part way'''
+import os
+import sys
+from typing import Any
+import pytest
+import RRTool
+from bench.server import StandinServer
+from source.catalog import Catalog
+from source.http_session import HttpSession
+from source.library import download_book
+from source.progress import CancelToken, Cancelled, ChapterFinished, Event
+
+def test_cancelled_download_leaves_no_part_file(standin: StandinServer) -> None:
+    token = CancelToken()
+    partial: list[str] = []
+
+    def cancel_after_two(event: Event) -> None:
+        if isinstance(event, ChapterFinished) and event.done == 2:
+            partial.extend(name for name in os.listdir('.') if name.endswith('.part'))
+            token.cancel()
+    with pytest.raises(Cancelled):
+        download_book('1', cancel_after_two, token, streaming=True, work_dir='.rrwork')
+    assert len(partial) == 1
+    assert not os.path.exists(partial[0])
+    assert os.listdir('.') == ['.rrwork']
+    # The journal is kept, to resume from.
+
+def test_cli_closes_what_it_opened(standin: StandinServer, monkeypatch: pytest.MonkeyPatch,
+                                   capsys: pytest.CaptureFixture[str]) -> None:
+    closed: list[str] = []
+
+    def recorded(kind: type[HttpSession]|type[Catalog]) -> None:
+        close = kind.close
+        def recording_close(self: Any) -> None:
+            closed.append(kind.__name__)
+            close(self)
+        monkeypatch.setattr(kind, 'close', recording_close)
+    recorded(HttpSession)
+    recorded(Catalog)
+    standin.latency = 0.1
+    monkeypatch.setattr(sys, 'argv', ['RRTool.py', 'download', '1', '--site', standin.url, '--stream',
+                                      '--retries', '0', '--timeout', '0.5'])
+    RRTool.main()
+    assert 'timed out' in capsys.readouterr().out
+    assert sorted(closed) == ['Catalog', 'HttpSession']
+    assert not any(name.endswith('.part') for name in os.listdir('.'))
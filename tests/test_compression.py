@@ -0,0 +1,76 @@
+'''EpubWriter's entries, compressed on the pool or by ZipFile, make a valid epub'''
+import os
+import zipfile
+import pytest
+from source import epub_writer
+from source.epub_writer import EpubWriter, EpubChapter, EpubImage, TableOfContents, EpubCover, CompressionPolicy
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 8
+
+def build(path: str, level: int = 6) -> None:
+    writer = EpubWriter('Compressed', log=open(os.devnull, 'w', encoding='UTF-8'), modified=1609459200,
+                        compression=CompressionPolicy(level=level), compress_workers=2)
+    writer.create(replace=path)
+    toc = TableOfContents()
+    for place in range(20):
+        chapter = EpubChapter('Chapter ' + str(place), 'Chapter_' + str(place), place,
+                              '<p>' + 'All work and no play. ' * 200 + '</p>')
+        toc.push_chapter(chapter)
+        writer.push_item(chapter)
+        writer.push_item(EpubImage(PNG, '.png', 'Images/' + str(place)))
+    writer.push_item(toc)
+    writer.push_item(EpubCover(None, 'Compressed'))
+    writer.complete('Author', None, None, None, '1', '2021-01-01')
+
+@pytest.fixture(params=[True, False], ids=['pool', 'zipfile'])
+def raw_entries(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> bool:
+    monkeypatch.setattr(epub_writer, '_RAW_ENTRIES', request.param and epub_writer._RAW_ENTRIES)
+    return bool(request.param)
+
+def test_archive_is_valid(tmp_path: os.PathLike[str], raw_entries: bool) -> None:
+    path = os.path.join(tmp_path, 'book.epub')
+    build(path)
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+        entries = archive.infolist()
+        assert entries[0].filename == 'mimetype'
+        assert entries[0].compress_type == zipfile.ZIP_STORED
+        assert archive.read('mimetype') == b'application/epub+zip'
+        for entry in entries:
+            if entry.filename.endswith('.png'):
+                assert entry.compress_type == zipfile.ZIP_STORED
+                assert archive.read(entry) == PNG
+            elif entry.filename.endswith('.xhtml'):
+                assert entry.compress_type == zipfile.ZIP_DEFLATED
+                assert entry.compress_size < entry.file_size
+
+def test_pool_and_zipfile_write_the_same_bytes(tmp_path: os.PathLike[str], monkeypatch: pytest.MonkeyPatch) -> None:
+    if not epub_writer._RAW_ENTRIES:
+        pytest.skip("entries are only compressed on the pool where _write_raw works")
+    pooled = os.path.join(tmp_path, 'pooled.epub')
+    build(pooled)
+    monkeypatch.setattr(epub_writer, '_RAW_ENTRIES', False)
+    plain = os.path.join(tmp_path, 'plain.epub')
+    build(plain)
+    with open(pooled, 'rb') as first, open(plain, 'rb') as second:
+        assert first.read() == second.read()
+
+@pytest.mark.parametrize('level', [1, 9])
+def test_level_is_applied(tmp_path: os.PathLike[str], raw_entries: bool, level: int) -> None:
+    path = os.path.join(tmp_path, 'book.epub')
+    build(path, level)
+    with zipfile.ZipFile(path) as archive:
+        entry = archive.getinfo('OEBPS/Chapter_0.xhtml')
+        assert entry.compress_size == CompressionPolicy(level=level).compressed_size('.xhtml', archive.read(entry))
+
+def test_raw_entries_work_here() -> None:
+    assert epub_writer._raw_entries_work()
+
+def test_changed_zipfile_is_not_written_raw(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delattr(zipfile.ZipFile, '_writecheck')
+    assert not epub_writer._raw_entries_work()
+
+def test_wrong_entries_are_not_written_raw(monkeypatch: pytest.MonkeyPatch) -> None:
+    header = zipfile.ZipInfo.FileHeader
+    monkeypatch.setattr(zipfile.ZipInfo, 'FileHeader', lambda entry, zip64=None: header(entry, zip64)[:-2])
+    assert not epub_writer._raw_entries_work()
@@ -0,0 +1,77 @@
+'''Epubs EpubWriter makes read back with EpubReader and EpubSummary'''
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+import pytest
+from source.epub_writer import EpubException, EpubWriter, EpubChapter, TableOfContents, EpubCover
+from source.epub_reader import EpubReader, EpubSummary
+
+TITLE = 'Swords & Sorcery <3'
+AUTHOR = 'Smith & "Sons" <ltd>'
+DESCRIPTION = 'Fights & feelings, <b>not</b> bold'
+
+def build(path: str, chapters: list[str]) -> None:
+    writer = EpubWriter(TITLE, log=open(os.devnull, 'w', encoding='UTF-8'))
+    writer.create(replace=path)
+    toc = TableOfContents()
+    for place, name in enumerate(chapters):
+        chapter = EpubChapter(name, 'Chapter_' + str(place), place, '<p>Text of ' + str(place) + '</p>')
+        toc.push_chapter(chapter)
+        writer.push_item(chapter)
+    writer.push_item(toc)
+    writer.push_item(EpubCover(None, TITLE))
+    writer.complete(AUTHOR, 'Bio & <more>', None, DESCRIPTION, '12345', '2021-03-03')
+
+def test_metadata_with_markup_reads_back(tmp_path: os.PathLike[str]) -> None:
+    path = os.path.join(tmp_path, 'book.epub')
+    build(path, ['One & Two', 'Three <four>'])
+    reader = EpubReader(path)
+    try:
+        assert reader.book_id == '12345'
+        assert reader.book_name == TITLE
+        assert [name for name, _ in reader.chapters.values()] == ['One & Two', 'Three <four>']
+    finally:
+        reader.close()
+    reader = EpubReader(path)
+    try:
+        assert reader.author_info() == ('Bio & <more>', None)
+    finally:
+        reader.close()
+    summary = EpubSummary(path)
+    assert (summary.title, summary.author, summary.chapters) == (TITLE, AUTHOR, 2)
+
+def test_every_xml_entry_is_well_formed(tmp_path: os.PathLike[str]) -> None:
+    path = os.path.join(tmp_path, 'book.epub')
+    build(path, ['One & Two'])
+    with zipfile.ZipFile(path) as epub:
+        for name in epub.namelist():
+            if name.endswith(('.opf', '.ncx', '.xhtml', '.xml')):
+                ET.fromstring(epub.read(name))
+        opf = ET.fromstring(epub.read('OEBPS/content.opf'))
+    description = opf.find('.//{http://purl.org/dc/elements/1.1/}description')
+    assert description is not None and description.text == DESCRIPTION
+
+def test_books_built_at_once_with_the_same_title_get_their_own_files(tmp_path: os.PathLike[str],
+                                                                      monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    first = EpubWriter(TITLE, log=open(os.devnull, 'w', encoding='UTF-8'))
+    second = EpubWriter(TITLE, log=open(os.devnull, 'w', encoding='UTF-8'))
+    names = [first.create(), second.create()]
+    assert names[0] != names[1]
+    for writer in (first, second):
+        writer.push_item(EpubCover(None, TITLE))
+        writer.complete(AUTHOR, None, None, DESCRIPTION, '12345', '2021-03-03')
+    assert sorted(os.listdir(tmp_path)) == sorted(names)
+    third = EpubWriter(TITLE, log=open(os.devnull, 'w', encoding='UTF-8'))
+    assert third.create() == names[0]
+    # Once built, the name is free to be built again.
+    third.abort()
+
+def test_replacing_an_epub_being_built_is_refused(tmp_path: os.PathLike[str]) -> None:
+    path = os.path.join(tmp_path, 'book.epub')
+    first = EpubWriter(TITLE, log=open(os.devnull, 'w', encoding='UTF-8'))
+    first.create(replace=path)
+    with pytest.raises(EpubException):
+        EpubWriter(TITLE, log=open(os.devnull, 'w', encoding='UTF-8')).create(replace=path)
+    first.abort()
+    assert os.listdir(tmp_path) == []
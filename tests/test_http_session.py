@@ -0,0 +1,219 @@
+'''RetryPolicy, HttpSession and HttpCache, against a local server playing scripted responses'''
+import os
+import time
+import threading
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Iterator
+import pytest
+import requests
+from source.http_session import HttpSession, RetryPolicy
+from source.http_cache import HttpCache
+
+class ScriptedServer(ThreadingHTTPServer):
+    '''Answers each request with the next of script: a status, a (status, headers)
+    pair, or 'slow' to stall past the client's timeout before answering 200.
+    Once the script runs out, the last answer repeats.'''
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.script: list[object] = [200]
+        self.requests = 0
+        self.conditions: list[tuple[str|None, str|None]] = []
+        # If-None-Match and If-Modified-Since of each request.
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:' + str(self.server_address[1]) + '/page'
+
+    def next_answer(self) -> object:
+        with self._lock:
+            answer = self.script[min(self.requests, len(self.script) - 1)]
+            self.requests += 1
+            return answer
+
+class _Handler(BaseHTTPRequestHandler):
+    server: ScriptedServer
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.server.conditions.append((self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')))
+        answer = self.server.next_answer()
+        headers: dict[str, str] = {}
+        if answer == 'slow':
+            time.sleep(0.5)
+            answer = 200
+        if isinstance(answer, tuple):
+            answer, headers = answer
+        body = b'' if answer == 304 else b'status ' + str(answer).encode()
+        self.send_response(int(str(answer)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def server() -> Iterator[ScriptedServer]:
+    server = ScriptedServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def session(retries: int = 3, timeout: float = 5) -> tuple[HttpSession, list[float]]:
+    '''A session that records its waits instead of sleeping'''
+    waits: list[float] = []
+    policy = RetryPolicy(retries=retries, backoff=0.5, max_backoff=4, jitter=0)
+    return HttpSession(timeout=timeout, retry=policy, sleep=waits.append), waits
+
+def test_retry_after_seconds_is_honored_up_to_the_cap() -> None:
+    policy = RetryPolicy(max_retry_after=60, jitter=0)
+    assert policy.delay(0, '7') == 7
+    assert policy.delay(3, ' 12 ') == 12
+    assert policy.delay(0, '3600') == 60
+
+def test_retry_after_http_date() -> None:
+    policy = RetryPolicy(jitter=0)
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 27 <= policy.delay(0, later) <= 30
+    earlier = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=30), usegmt=True)
+    assert policy.delay(0, earlier) == 0
+
+def test_unreadable_retry_after_falls_back_to_backoff() -> None:
+    policy = RetryPolicy(backoff=0.5, jitter=0)
+    assert policy.delay(1, 'soon') == 1.0
+
+def test_backoff_doubles_up_to_its_cap() -> None:
+    policy = RetryPolicy(backoff=0.5, max_backoff=4, jitter=0)
+    assert [policy.delay(attempt) for attempt in range(6)] == [0.5, 1, 2, 4, 4, 4]
+
+def test_jitter_stays_within_its_share() -> None:
+    policy = RetryPolicy(backoff=1, max_backoff=1, jitter=0.5)
+    assert all(1 <= policy.delay(0) <= 1.5 for _ in range(100))
+
+def test_retries_429_and_5xx_until_success(server: ScriptedServer) -> None:
+    server.script = [(429, {'Retry-After': '2'}), 503, 502, 200]
+    client, waits = session()
+    response = client.get(server.url)
+    assert response.status_code == 200
+    assert server.requests == 4
+    assert waits == [2, 1, 2]
+    # Retry-After first, then the backoff of the second and third retries.
+
+def test_other_statuses_are_not_retried(server: ScriptedServer) -> None:
+    server.script = [404, 200]
+    client, waits = session()
+    assert client.get(server.url).status_code == 404
+    assert server.requests == 1
+    assert waits == []
+
+def test_gives_up_with_the_last_response(server: ScriptedServer) -> None:
+    server.script = [503]
+    client, waits = session(retries=2)
+    assert client.get(server.url).status_code == 503
+    assert server.requests == 3
+    assert waits == [0.5, 1]
+
+def test_read_timeout_is_retried(server: ScriptedServer) -> None:
+    server.script = ['slow', 200]
+    client, waits = session(timeout=0.2)
+    assert client.get(server.url).status_code == 200
+    assert waits == [0.5]
+
+def test_read_timeout_raised_once_retries_run_out(server: ScriptedServer) -> None:
+    server.script = ['slow']
+    client, waits = session(retries=1, timeout=0.2)
+    with pytest.raises(requests.exceptions.Timeout):
+        client.get(server.url)
+    assert server.requests == 2
+    assert waits == [0.5]
+
+def test_connection_errors_are_retried_then_raised() -> None:
+    closed = ScriptedServer()
+    url = closed.url
+    closed.server_close()
+    # Nothing listens on the port any more.
+    client, waits = session(retries=2)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get(url)
+    assert waits == [0.5, 1]
+
+class Clock:
+    '''Time that moves a second each time it is read, so every use is later'''
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        self.now += 1
+        return self.now
+
+@pytest.fixture
+def cache(tmp_path: os.PathLike[str]) -> Iterator[HttpCache]:
+    cache = HttpCache(str(tmp_path), max_bytes=25, clock=Clock())
+    # Two of the server's 10 byte bodies fit, and not three.
+    yield cache
+    cache.close()
+
+def cached_session(cache: HttpCache) -> HttpSession:
+    return HttpSession(retry=RetryPolicy(retries=0), cache=cache)
+
+LAST_MODIFIED = 'Fri, 01 Jan 2021 00:00:00 GMT'
+
+def test_unchanged_responses_come_from_the_cache(server: ScriptedServer, cache: HttpCache) -> None:
+    server.script = [(200, {'ETag': '"one"', 'Last-Modified': LAST_MODIFIED}), 304]
+    client = cached_session(cache)
+    assert client.get(server.url).content == b'status 200'
+    response = client.get(server.url)
+    assert response.status_code == 200
+    assert response.content == b'status 200'
+    assert server.conditions == [(None, None), ('"one"', LAST_MODIFIED)]
+
+def test_changed_responses_replace_the_cached_one(server: ScriptedServer, cache: HttpCache) -> None:
+    server.script = [(200, {'ETag': '"one"'}), (201, {}), (200, {'ETag': '"two"'}), 304]
+    client = cached_session(cache)
+    client.get(server.url)
+    assert client.get(server.url).status_code == 201
+    # Only 200s are stored.
+    client.get(server.url)
+    client.get(server.url)
+    assert [condition[0] for condition in server.conditions] == [None, '"one"', '"one"', '"two"']
+
+def test_least_recently_used_are_evicted(server: ScriptedServer, cache: HttpCache) -> None:
+    client = cached_session(cache)
+    first, second, third = (server.url + '?' + name for name in ('first', 'second', 'third'))
+    client.get(first)
+    client.get(second)
+    assert cache.lookup(first) is not None
+    client.get(third)
+    assert cache.lookup(second) is None
+    assert cache.lookup(first) is not None
+    assert cache.lookup(third) is not None
+    assert len(os.listdir(os.path.join(cache.directory, 'bodies'))) == 2
+
+def test_offline_answers_from_the_cache_only(server: ScriptedServer, cache: HttpCache) -> None:
+    client = cached_session(cache)
+    client.get(server.url)
+    cache.offline = True
+    assert client.get(server.url).content == b'status 200'
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get(server.url + '?elsewhere')
+    assert server.requests == 1
+
+def test_offline_hits_count_as_uses(server: ScriptedServer, cache: HttpCache) -> None:
+    client = cached_session(cache)
+    first, second, third = (server.url + '?' + name for name in ('first', 'second', 'third'))
+    client.get(first)
+    client.get(second)
+    cache.offline = True
+    client.get(first)
+    cache.offline = False
+    client.get(third)
+    assert cache.lookup(first) is not None
+    assert cache.lookup(second) is None
@@ -0,0 +1,98 @@
+'''Journals resume interrupted downloads, and their work directory is cleaned up after them'''
+import os
+import types
+import pytest
+from bench.server import StandinServer
+from source import journal, rr_dwnldr
+from source.journal import Journal
+from source.library import download_book
+from source.progress import CancelToken, Cancelled, ChapterFinished, Event
+
+SETTINGS = {'pretty': False}
+
+def test_work_dir_is_removed_with_the_last_book(tmp_path: os.PathLike[str]) -> None:
+    work_dir = os.path.join(tmp_path, '.rrwork')
+    first = Journal(work_dir, '1', SETTINGS)
+    second = Journal(work_dir, '2', SETTINGS)
+    first.discard()
+    assert os.listdir(work_dir) == ['2']
+    second.discard()
+    assert not os.path.exists(work_dir)
+
+def test_work_dir_with_other_files_is_kept(tmp_path: os.PathLike[str]) -> None:
+    work_dir = os.path.join(tmp_path, 'work')
+    os.mkdir(work_dir)
+    with open(os.path.join(work_dir, 'notes.txt'), 'w', encoding='UTF-8') as stream:
+        stream.write('mine')
+    Journal(work_dir, '1', SETTINGS).discard()
+    assert os.listdir(work_dir) == ['notes.txt']
+
+def test_interrupted_book_is_kept(tmp_path: os.PathLike[str]) -> None:
+    work_dir = os.path.join(tmp_path, '.rrwork')
+    interrupted = Journal(work_dir, '1', SETTINGS)
+    interrupted.record_chapter('one', 'https://example.com/1', '<p>One</p>', [])
+    interrupted.close()
+    finished = Journal(work_dir, '2', SETTINGS)
+    finished.discard()
+    assert os.listdir(work_dir) == ['1']
+    resumed = Journal(work_dir, '1', SETTINGS)
+    # As a later run, in another process, would.
+    assert list(resumed.chapters) == ['one']
+    resumed.discard()
+    assert not os.path.exists(work_dir)
+
+@pytest.fixture
+def started(monkeypatch: pytest.MonkeyPatch) -> None:
+    '''Every journal started at the same time, so the books it dates are comparable'''
+    monkeypatch.setattr(journal, 'time', types.SimpleNamespace(time=lambda: 1609459200.0))
+
+def fetched(server: StandinServer, kind: str) -> list[str]:
+    '''The chapters or images served since the last clear()'''
+    return [path for path in server.paths if kind in path]
+
+def interrupt(after: int) -> None:
+    '''Downloads book 1 into .rrwork, cancelling it once after chapters are finished'''
+    token = CancelToken()
+
+    def cancel(event: Event) -> None:
+        if isinstance(event, ChapterFinished) and event.done == after:
+            token.cancel()
+    with pytest.raises(Cancelled):
+        download_book('1', cancel, token, work_dir='.rrwork')
+
+def resume() -> tuple[str, list[str]]:
+    '''Downloads book 1 from .rrwork; its file name, and where each chapter came from'''
+    sources: list[str] = []
+
+    def record(event: Event) -> None:
+        if isinstance(event, ChapterFinished):
+            sources.append(event.source)
+    return download_book('1', record, work_dir='.rrwork'), sources
+
+def test_resumed_download_fetches_only_what_is_left(standin: StandinServer, started: None,
+                                                     tmp_path: os.PathLike[str]) -> None:
+    os.mkdir('interrupted')
+    os.chdir('interrupted')
+    interrupt(after=3)
+    chapters, images = fetched(standin, '/chapter/'), fetched(standin, '/images/')
+    standin.paths.clear()
+    path, sources = resume()
+    assert sources.count('resumed') >= 3
+    assert len(fetched(standin, '/chapter/')) == 6 - sources.count('resumed')
+    assert not set(fetched(standin, '/chapter/')) & set(chapters[:3])
+    assert not set(fetched(standin, '/images/')) & set(images)
+    # Images are journaled as they arrive, whether or not their chapter was finished.
+    assert os.listdir('.') == [path]
+    os.chdir(tmp_path)
+    os.mkdir('whole')
+    os.chdir('whole')
+    whole = download_book('1', work_dir='.rrwork')
+    with open(whole, 'rb') as built, open(os.path.join(tmp_path, 'interrupted', path), 'rb') as resumed:
+        assert built.read() == resumed.read()
+
+def test_journal_of_another_parser_is_discarded(standin: StandinServer, monkeypatch: pytest.MonkeyPatch) -> None:
+    pytest.importorskip('lxml')
+    monkeypatch.setattr(rr_dwnldr, '_parser', 'html.parser')
+    interrupt(after=3)
+    monkeypatch.setattr(rr_dwnldr, '_parser', 'lxml')
+    assert 'resumed' not in resume()[1]
@@ -0,0 +1,77 @@
+'''PayloadStore keeps payloads within its budget, and reuses the spill file's space'''
+import io
+import os
+from typing import Iterator
+import pytest
+from source.payload_store import PayloadStore
+
+@pytest.fixture
+def store(tmp_path: os.PathLike[str]) -> Iterator[PayloadStore]:
+    store = PayloadStore(budget=100, spill_size=50, directory=str(tmp_path))
+    yield store
+    store.close()
+
+def test_small_payloads_stay_in_memory(store: PayloadStore) -> None:
+    payload = store.put(b'a' * 40)
+    assert not payload.spilled
+    assert store.in_memory == 40
+    assert payload.read() == b'a' * 40
+    payload.release()
+    assert store.in_memory == 0
+    with pytest.raises(ValueError):
+        payload.read()
+
+def test_large_payloads_spill(store: PayloadStore) -> None:
+    payload = store.put(b'b' * 50)
+    assert payload.spilled
+    assert store.in_memory == 0
+    assert store.spilled == store.file_size == 50
+    assert payload.read() == b'b' * 50
+
+def test_payloads_beyond_the_budget_spill(store: PayloadStore) -> None:
+    kept = [store.put(bytes([place]) * 40) for place in range(3)]
+    assert [payload.spilled for payload in kept] == [False, False, True]
+    assert store.in_memory == 80
+    kept[0].release()
+    assert not store.put(b'c' * 40).spilled
+
+def test_spilled_payloads_copy_whole(store: PayloadStore, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr('source.payload_store._CHUNK', 7)
+    data = bytes(range(200))
+    payload = store.put(data)
+    stream = io.BytesIO()
+    payload.copy_to(stream)
+    assert stream.getvalue() == data
+
+def test_released_space_is_reused(store: PayloadStore) -> None:
+    first, second, third = (store.put(bytes([place]) * 60) for place in range(3))
+    assert store.file_size == 180
+    second.release()
+    reused = store.put(b'd' * 55)
+    assert store.file_size == 180
+    assert reused.read() == b'd' * 55
+    assert first.read() == b'\0' * 60
+    assert third.read() == b'\2' * 60
+    for _ in range(20):
+        store.put(b'e' * 100).release()
+    assert store.file_size == 180
+    assert store.spilled == 180 + 55 + 2000
+
+def test_file_is_cut_short_when_its_end_is_free(store: PayloadStore) -> None:
+    payloads = [store.put(bytes([place]) * 60) for place in range(4)]
+    payloads[1].release()
+    payloads[3].release()
+    assert store.file_size == 180
+    payloads[2].release()
+    # Merged with the space of the second, ending the file.
+    assert store.file_size == 60
+    payloads[0].release()
+    assert store.file_size == 0
+    assert store._file is not None
+    assert os.fstat(store._file.fileno()).st_size == 0
+
+def test_release_after_close_is_harmless(store: PayloadStore) -> None:
+    payload = store.put(b'f' * 60)
+    store.close()
+    payload.release()
+    assert store.file_size == 0
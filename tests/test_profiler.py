@@ -0,0 +1,56 @@
+'''Spans timed in ChapterTransformer's worker processes reach the parent's profiler'''
+import json
+import os
+from typing import Iterator
+import pytest
+from source.profiler import Profiler, SpanRecorder, profiler, set_profiler, stage
+from source.rr_dwnldr import ChapterTransformer
+
+PAGE = '<html><body><div class="chapter-inner chapter-content"><p>Text <img src="a.png"></p></div></body></html>'
+
+@pytest.fixture
+def profiling() -> Iterator[Profiler]:
+    previous = profiler()
+    recording = Profiler()
+    set_profiler(recording)
+    yield recording
+    set_profiler(previous)
+
+def test_recorded_spans_merge(profiling: Profiler) -> None:
+    recorder = SpanRecorder()
+    set_profiler(recorder)
+    with stage('parse', chapter='One') as span:
+        span.bytes = 10
+    set_profiler(profiling)
+    assert len(recorder.spans) == 1
+    profiling.merge(recorder.spans)
+    summary = profiling.summary()
+    assert 'parse' in summary
+    assert 'One' in summary
+
+def test_worker_spans_reach_the_parent(profiling: Profiler, tmp_path: os.PathLike[str]) -> None:
+    transformer = ChapterTransformer(1)
+    try:
+        transformed = transformer.submit('One', PAGE, True, False).result()
+    finally:
+        transformer.close()
+    assert transformed.images == ['a.png']
+    names = {span[0] for span in transformed.spans}
+    assert {'transform', 'parse', 'render'} <= names
+    assert all(span[6] != os.getpid() for span in transformed.spans)
+    profiling.merge(transformed.spans)
+    trace = os.path.join(tmp_path, 'trace.json')
+    profiling.write_trace(trace)
+    with open(trace, encoding='UTF-8') as stream:
+        events = json.load(stream)['traceEvents']
+    assert {event['name'] for event in events} == names
+
+def test_workers_keep_nothing_unless_profiling() -> None:
+    previous = profiler()
+    set_profiler(None)
+    transformer = ChapterTransformer(1)
+    try:
+        assert transformer.submit('One', PAGE, True, False).result().spans == []
+    finally:
+        transformer.close()
+        set_profiler(previous)
@@ -0,0 +1,88 @@
+import pytest
+from source.rate_limiter import HostLimiter, RateLimiter
+
+class Clock:
+    '''Time that only moves when a test says so'''
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+def request(limiter: HostLimiter, clock: Clock, healthy: bool = True, latency: float = 0.1) -> None:
+    '''One request, long enough after the last that a token is waiting for it'''
+    clock.now += 2.0 / limiter.rate
+    limiter.acquire()
+    limiter.release(healthy, latency)
+
+def test_slow_start_adds_one_per_request(clock: Clock) -> None:
+    limiter = HostLimiter('host', rate=4.0, concurrency=4.0, clock=clock)
+    for _ in range(3):
+        request(limiter, clock)
+    assert limiter.rate == 7.0
+    assert limiter.concurrency == 7.0
+
+def test_rate_is_capped_at_max_rate(clock: Clock) -> None:
+    limiter = HostLimiter('host', rate=4.0, max_rate=6.0, max_concurrency=5.0, clock=clock)
+    for _ in range(10):
+        request(limiter, clock)
+    assert limiter.rate == 6.0
+    assert limiter.concurrency == 5.0
+
+def test_throttling_cuts_the_rate_and_ends_slow_start(clock: Clock) -> None:
+    limiter = HostLimiter('host', rate=8.0, concurrency=8.0, increase=2.0, decrease=0.5, clock=clock)
+    request(limiter, clock, healthy=False)
+    assert limiter.rate == 4.0
+    assert limiter.concurrency == 4.0
+    request(limiter, clock)
+    assert limiter.rate == pytest.approx(4.5)
+    # Additive now: increase / rate.
+    assert limiter.concurrency == pytest.approx(4.25)
+
+def test_one_cut_per_cooldown(clock: Clock) -> None:
+    limiter = HostLimiter('host', rate=8.0, cooldown=5.0, clock=clock)
+    for _ in range(3):
+        request(limiter, clock, healthy=False)
+    assert limiter.rate == 4.0
+    clock.now += 5.0
+    request(limiter, clock, healthy=False)
+    assert limiter.rate == 2.0
+
+def test_rate_is_held_at_min_rate(clock: Clock) -> None:
+    limiter = HostLimiter('host', rate=1.0, min_rate=0.5, cooldown=0.0, clock=clock)
+    for _ in range(5):
+        request(limiter, clock, healthy=False)
+    assert limiter.rate == 0.5
+    assert limiter.concurrency == 1.0
+
+def test_slow_responses_hold_the_rate(clock: Clock) -> None:
+    limiter = HostLimiter('host', rate=4.0, slow_factor=3.0, clock=clock)
+    request(limiter, clock, latency=0.1)
+    request(limiter, clock, latency=1.0)
+    assert limiter.rate == 5.0
+
+def test_changes_are_logged(clock: Clock) -> None:
+    lines: list[str] = []
+    limiter = HostLimiter('host', rate=4.0, concurrency=4.0, clock=clock, log=lines.append)
+    request(limiter, clock)
+    assert lines == []
+    request(limiter, clock)
+    request(limiter, clock, healthy=False)
+    assert lines == ['host: speeding up to 6.0 requests/s, 6 at once',
+                     'host: slowing down to 3.0 requests/s, 3 at once']
+
+def test_hosts_are_paced_separately(clock: Clock) -> None:
+    limiter = RateLimiter(rate=4.0, max_rate=20.0, clock=clock)
+    first = limiter.host('https://example.com/fiction/1')
+    assert limiter.host('https://example.com/fiction/2') is first
+    second = limiter.host('https://images.example.com/cover.jpg')
+    assert second is not first
+    request(first, clock, healthy=False)
+    request(second, clock)
+    assert first.rate == 2.0
+    assert second.rate == 5.0
+    assert second.max_rate == 20.0
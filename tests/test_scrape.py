@@ -0,0 +1,35 @@
+'''scrape() raises for any answer but success, and a book's broken images are replaced'''
+import os
+import pytest
+from bench.server import StandinServer
+from source.library import download_book
+from source.progress import Event, Notice
+from source.rr_dwnldr import ScrapeError, scrape
+
+def test_success_is_returned(standin: StandinServer) -> None:
+    assert scrape(standin.url + '/fiction/1').status_code == 200
+
+def test_missing_resources_raise(standin: StandinServer) -> None:
+    with pytest.raises(RuntimeError):
+        scrape(standin.url + '/nowhere')
+
+def test_errors_raise_once_retried(standin: StandinServer) -> None:
+    standin.error_rate = 1.0
+    with pytest.raises(ScrapeError) as raised:
+        scrape(standin.url + '/fiction/1')
+    assert raised.value.status == 503
+    assert standin.requests == 3
+    # The first try and the fixture's two retries.
+
+def test_refused_connections_raise(standin: StandinServer) -> None:
+    with pytest.raises(ConnectionError):
+        scrape('http://127.0.0.1:1/fiction/1')
+
+def test_broken_images_are_replaced(standin: StandinServer) -> None:
+    standin.broken_images = True
+    events: list[Event] = []
+    path = download_book('1', events.append)
+    assert os.path.exists(path)
+    notices = [event.message for event in events if isinstance(event, Notice)]
+    assert len(notices) == len({image for number in range(6) for image in standin.chapter_images(number)})
+    assert all('Unable to retrieve image' in notice for notice in notices)
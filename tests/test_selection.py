@@ -0,0 +1,65 @@
+'''Which chapters --range, --last and -s pick'''
+import os
+import argparse
+import pytest
+from RRTool import bootstrap_arguments, chapter_ranges, chapter_selection
+from bench.server import StandinServer
+from source.library import download_book
+from source.rr_dwnldr import LocalizedException
+from source.selection import ChapterSelection, single
+from source.volumes import VolumePolicy
+
+def test_everything_by_default() -> None:
+    selection = ChapterSelection()
+    assert selection.everything
+    assert selection.places(4) == [0, 1, 2, 3]
+    assert str(selection) == 'all'
+
+def test_ranges_are_slices() -> None:
+    selection = ChapterSelection([(1, 3), (None, 1), (-2, None)])
+    assert not selection.everything
+    assert selection.places(10) == [0, 1, 2, 8, 9]
+    assert selection.places(2) == [0, 1]
+    assert str(selection) == '1:3,:1,-2:'
+
+def test_last_and_ranges_overlap_once() -> None:
+    selection = ChapterSelection([(2, 5)], last=3)
+    assert selection.places(6) == [2, 3, 4, 5]
+    assert ChapterSelection(last=10).places(3) == [0, 1, 2]
+    assert ChapterSelection(last=0).places(3) == []
+    assert str(selection) == '2:5,last 3'
+
+def test_single() -> None:
+    assert ChapterSelection([single(2)]).places(5) == [2]
+    assert ChapterSelection([single(-1)]).places(5) == [4]
+    assert ChapterSelection([single(7)]).places(5) == []
+
+@pytest.mark.parametrize('value, ranges', [
+    ('1200:1300', [(1200, 1300)]),
+    (':10', [(None, 10)]),
+    ('-5:', [(-5, None)]),
+    ('3', [(3, 4)]),
+    ('-1', [(-1, None)]),
+    (' 0:2 , 7 ', [(0, 2), (7, 8)]),
+])
+def test_chapter_ranges(value: str, ranges: list[tuple[int|None, int|None]]) -> None:
+    assert chapter_ranges(value) == ranges
+
+@pytest.mark.parametrize('value', ['a:b', '1:2:3', '', '1,,2', 'x'])
+def test_chapter_ranges_rejects(value: str) -> None:
+    with pytest.raises(argparse.ArgumentTypeError):
+        chapter_ranges(value)
+
+def test_selection_from_the_command_line() -> None:
+    args = bootstrap_arguments().parse_args(['download', '1', '--range', '0:2', '--range', '5', '--last', '1'])
+    assert chapter_selection(args).places(10) == [0, 1, 5, 9]
+    args = bootstrap_arguments().parse_args(['download', '1', '-s'])
+    assert chapter_selection(args).places(10) == [0]
+    assert chapter_selection(bootstrap_arguments().parse_args(['download', '1'])).everything
+
+def test_part_of_a_book_is_not_split_into_volumes(standin: StandinServer) -> None:
+    with pytest.raises(LocalizedException, match='whole book'):
+        download_book('1', chapters=ChapterSelection([(2, 4)]), volumes=VolumePolicy(2, None))
+    assert standin.requests == 1
+    # Only the fiction page; nothing was downloaded or written.
+    assert os.listdir('.') == []
@@ -0,0 +1,27 @@
+'''transform_chapter() marks a chapter's images so they can be named later'''
+from source.rr_dwnldr import transform_chapter
+
+def page(content: str) -> str:
+    return '<html><body><div class="chapter-inner chapter-content">' + content + '</div></body></html>'
+
+def test_images_are_named_in_order() -> None:
+    transformed = transform_chapter('One', page('<p><img src="a.png"> and <img src="b.png"><img></p>'),
+                                    True, False, 'html.parser')
+    assert transformed.images == ['a.png', 'b.png']
+    assert transformed.missing_src == 1
+    xhtml = transformed.with_images(['Images/1.png', 'Images/2.png'])
+    assert xhtml.index('src="Images/1.png"') < xhtml.index('src="Images/2.png"')
+    assert transformed.marker not in xhtml
+
+def test_text_like_a_marker_is_left_alone() -> None:
+    text = 'She typed "rr-image:0" and "rr-image-1:0", then src="rr-image:0"'
+    transformed = transform_chapter('One', page('<p>' + text + '</p><p><img src="a.png"></p>'),
+                                    True, False, 'html.parser')
+    xhtml = transformed.with_images(['Images/1.png'])
+    assert text in xhtml
+    assert xhtml.count('Images/1.png') == 1
+
+def test_chapter_without_images_is_unchanged() -> None:
+    transformed = transform_chapter('One', page('<p>About "rr-image:0"</p>'), True, False, 'html.parser')
+    assert transformed.images == []
+    assert transformed.with_images([]) == transformed.xhtml
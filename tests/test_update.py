@@ -0,0 +1,31 @@
+'''Updating an epub adds the new chapters and keeps what the old one showed'''
+from bench.server import StandinServer
+from source.library import download_book, update_book
+from source.epub_reader import EpubReader
+
+def author_section(path: str) -> tuple[str|None, bytes|None, int]:
+    '''The bio and image on the epub's author's page, and how many chapters it has'''
+    reader = EpubReader(path)
+    try:
+        bio, image = reader.author_info()
+        return bio, None if image is None else reader.read(image), len(reader.chapters)
+    finally:
+        reader.close()
+
+def test_update_keeps_the_author_section(standin: StandinServer) -> None:
+    standin.author_box = False
+    # So only the first chapter, which the update reuses, shows the author.
+    path = download_book('1')
+    bio, image, chapters = author_section(path)
+    assert image is not None
+    assert chapters == 6
+    standin.chapters = 8
+    assert update_book(path) == path
+    assert author_section(path) == (bio, image, 8)
+
+def test_update_with_nothing_new_keeps_the_author_section(standin: StandinServer) -> None:
+    path = download_book('1')
+    before = author_section(path)
+    standin.author_box = False
+    update_book(path)
+    assert author_section(path) == before
@@ -0,0 +1,73 @@
+'''VolumePolicy's boundaries, and volumes rebuilt only when their contents change'''
+import os
+from bench.server import StandinServer
+from source.epub_writer import EpubChapter
+from source.library import download_book
+from source.progress import BookWritten, Event, Notice
+from source.volumes import CollectedChapter, VolumePolicy, _VOLUME_OVERHEAD
+
+def chapters(*sizes: int, images: list[list[str]]|None = None) -> list[CollectedChapter]:
+    '''Chapters of sizes, digested as their place in the book'''
+    return [CollectedChapter(EpubChapter(str(place), str(place), place, ''),
+                             [] if images is None else images[place], size, str(place))
+            for place, size in enumerate(sizes)]
+
+def split(policy: VolumePolicy, book: list[CollectedChapter], image_sizes: dict[str, int]|None = None,
+          shared_size: int = 0) -> list[list[int]]:
+    '''The volumes, as the places of their chapters'''
+    return [[int(chapter.digest) for chapter in volume]
+            for volume in policy.split(book, {} if image_sizes is None else image_sizes, shared_size)]
+
+def test_split_by_chapters() -> None:
+    assert split(VolumePolicy(chapters=3), chapters(*[1] * 7)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert split(VolumePolicy(chapters=3), chapters(*[1] * 6)) == [[0, 1, 2], [3, 4, 5]]
+    assert split(VolumePolicy(chapters=3), []) == []
+
+def test_split_by_size() -> None:
+    limit = _VOLUME_OVERHEAD + 100
+    assert split(VolumePolicy(size=limit), chapters(50, 50, 1)) == [[0, 1], [2]]
+    # Exactly full, and one byte over.
+    assert split(VolumePolicy(size=limit), chapters(30, 500, 30)) == [[0], [1], [2]]
+    # A chapter bigger than a volume still gets one.
+    assert split(VolumePolicy(size=limit), chapters(40, 40), shared_size=30) == [[0], [1]]
+
+def test_whichever_limit_comes_first() -> None:
+    policy = VolumePolicy(chapters=2, size=_VOLUME_OVERHEAD + 100)
+    assert split(policy, chapters(10, 10, 10, 95, 20)) == [[0, 1], [2], [3], [4]]
+
+def test_images_are_counted_once_per_volume() -> None:
+    limit = _VOLUME_OVERHEAD + 100
+    book = chapters(10, 10, 10, 10, images=[['a'], ['a'], ['a', 'b'], ['a']])
+    assert split(VolumePolicy(size=limit), book, {'a': 60, 'b': 10}) == [[0, 1, 2], [3]]
+    # The first volume is exactly full with a in it once; the second holds a copy of its own.
+
+def test_new_chapters_never_move_boundaries() -> None:
+    policy = VolumePolicy(chapters=4, size=_VOLUME_OVERHEAD + 100)
+    sizes = [30, 60, 20, 20, 20, 70, 10, 40, 30, 10]
+    before = split(policy, chapters(*sizes[:6]))
+    after = split(policy, chapters(*sizes))
+    assert after[:len(before) - 1] == before[:-1]
+    assert after[len(before) - 1][:len(before[-1])] == before[-1]
+
+def download(events: list[Event]) -> list[str]:
+    '''Downloads book 1 as volumes of 4 chapters; the ones written, rather than kept'''
+    events.clear()
+    download_book('1', events.append, volumes=VolumePolicy(chapters=4))
+    return [event.save_name for event in events if isinstance(event, BookWritten)]
+
+def test_unchanged_volumes_are_kept(standin: StandinServer) -> None:
+    events: list[Event] = []
+    assert download(events) == ['Benchmark Fiction Volume 1.epub', 'Benchmark Fiction Volume 2.epub']
+    modified = {name: os.stat(name).st_mtime_ns for name in os.listdir('.')}
+    assert download(events) == []
+    assert [event.message for event in events if isinstance(event, Notice)] == \
+        ['Benchmark Fiction Volume 1.epub is unchanged', 'Benchmark Fiction Volume 2.epub is unchanged']
+    assert {name: os.stat(name).st_mtime_ns for name in os.listdir('.')} == modified
+
+def test_volume_with_a_new_chapter_is_rebuilt(standin: StandinServer) -> None:
+    events: list[Event] = []
+    download(events)
+    first = os.stat('Benchmark Fiction Volume 1.epub').st_mtime_ns
+    standin.chapters = 7
+    assert download(events) == ['Benchmark Fiction Volume 2.epub']
+    assert os.stat('Benchmark Fiction Volume 1.epub').st_mtime_ns == first